@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""Throughput, memory and accuracy benchmarks for the estimators.
+
+Every drone estimator runs over data.npy, noisy_data.npy and a synthetic
+long log. The turtlebot estimators run over a synthetic frozen-bearing
+unicycle log through a stand-in for rospy. Results can be saved as a JSON
+baseline and later runs compared against it.
+
+Example
+----------
+    $ python benchmark.py --save baseline.json
+    $ python benchmark.py --compare baseline.json --tolerance 0.2
+"""
+import argparse
+import contextlib
+import functools
+import importlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+
+from dataset import default_path, load_dataset
+from drone_estimator import \
+    OracleObserver, DeadReckoning, ExtendedKalmanFilter, \
+    SquareRootExtendedKalmanFilter, UnscentedKalmanFilter, ParticleFilter
+
+DRONE_ESTIMATORS = {
+    'oracle': OracleObserver,
+    'dr': DeadReckoning,
+    'ekf': ExtendedKalmanFilter,
+    'iekf': functools.partial(ExtendedKalmanFilter, max_iterations=5),
+    'srekf': SquareRootExtendedKalmanFilter,
+    'ukf': UnscentedKalmanFilter,
+    # Seeded, so that its MSE compares across runs
+    'pf': functools.partial(ParticleFilter, seed=0),
+}
+TURTLEBOT_ESTIMATORS = {
+    'oracle': 'OracleObserver',
+    'dr': 'DeadReckoning',
+    'kf': 'KalmanFilter',
+    'ekf': 'ExtendedKalmanFilter',
+}
+TURTLEBOT_SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'src', 'turtlebot_proj3_pkg', 'src')
+# Modules both packages ship, byte for byte identical, see
+# test_packages.py
+SHARED_MODULES = ('history', 'profiling', 'smoothing', 'downsampling',
+                  'model_compiler')
+# Modules the turtlebot Estimator imports from TURTLEBOT_SRC, the shared
+# ones shadowing the drone copies
+TURTLEBOT_MODULES = SHARED_MODULES + ('models', 'sequencing', 'Estimator')
+# Noise levels of the range and bearing measurements in noisy_data.npy
+MEASUREMENT_SD = (0.023, 0.01)
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--estimators', nargs='+', default=list(DRONE_ESTIMATORS),
+                    help='drone estimators to benchmark')
+parser.add_argument('--datasets', nargs='+', default=['data', 'noisy', 'long'],
+                    help='drone logs to run on')
+parser.add_argument('--long-repeat', type=int, default=20,
+                    help='how many times the input log is repeated in the long log')
+parser.add_argument('--repeat', type=int, default=3,
+                    help='timing runs per case, the fastest is reported')
+parser.add_argument('--no-memory', action='store_true',
+                    help='skip the tracemalloc pass')
+parser.add_argument('--no-turtlebot', action='store_true',
+                    help='skip the turtlebot estimators')
+parser.add_argument('--turtlebot-steps', type=int, default=3000,
+                    help='length of the synthetic turtlebot log')
+parser.add_argument('--save', default=None,
+                    help='write the results to this JSON baseline')
+parser.add_argument('--compare', default=None,
+                    help='compare the results against this JSON baseline')
+parser.add_argument('--tolerance', type=float, default=0.2,
+                    help='relative change tolerated before flagging a regression')
+
+
+def make_long_log(source, repeat, seed=0):
+    """Synthesize a long drone log by repeating the input of source.
+
+    States are integrated from the repeated inputs with the dead reckoning
+    model, so they are consistent with the inputs, and the measurements are
+    computed from the states with noise added.
+
+    Parameters
+    ----------
+    source : str or ndarray
+        Log whose inputs are repeated.
+    repeat : int
+        Number of repetitions.
+    seed : int
+        Seed of the measurement noise.
+
+    Returns
+    -------
+    data : ndarray
+        The (repeat * N, 11) synthetic log.
+    """
+    base = np.asarray(load_dataset(source))
+    n = base.shape[0] * repeat
+    model = DeadReckoning(data_path=base)
+    data = np.empty((n, base.shape[1]))
+    data[:, 0] = model.dt * np.arange(1, n + 1)
+    data[:, 7:9] = np.tile(base[:, 7:9], (repeat, 1))
+    data[:, 1:7] = model.integrate(base[0, 1:7], data[:-1, 7:9])
+    rng = np.random.default_rng(seed)
+    landmark = model.landmark
+    data[:, 9] = np.sqrt((landmark[0] - data[:, 1])**2 + landmark[1]**2
+                         + (landmark[2] - data[:, 2])**2)
+    data[:, 10] = data[:, 3]
+    data[:, 9:11] += rng.normal(0, MEASUREMENT_SD, (n, 2))
+    return data
+
+
+def measure(run, repeat, memory):
+    """Time and profile one benchmark case.
+
+    Parameters
+    ----------
+    run : callable
+        Builds and runs an estimator, returning (estimator, updates) where
+        updates is the number of update calls made.
+    repeat : int
+        Number of timed runs, the fastest is reported.
+    memory : bool
+        Whether to make an extra run under tracemalloc.
+
+    Returns
+    -------
+    result : dict
+        updates_per_second, peak_memory_bytes and mse.
+    """
+    best = np.inf
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            estimator, updates = run()
+            best = min(best, time.perf_counter() - start)
+        plt.close('all')
+    result = {'updates': updates,
+              'updates_per_second': updates / best,
+              'mse': float(estimator.mean_squared_error())}
+    if memory:
+        tracemalloc.start()
+        with contextlib.redirect_stdout(io.StringIO()):
+            run()
+        result['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        plt.close('all')
+    return result
+
+
+def drone_case(cls, path):
+    def run():
+        estimator = cls(is_noisy=True, data_path=path)
+        estimator.run()
+        return estimator, len(estimator.update_runtimes)
+    return run
+
+
+def ros_stand_in():
+    """Minimal rospy and std_msgs modules for running the turtlebot classes.
+
+    Subscribers and timers are inert, the benchmark drives the callbacks
+    and update directly.
+    """
+    rospy = types.ModuleType('rospy')
+    rospy.Subscriber = lambda *args, **kwargs: None
+    rospy.Timer = lambda *args, **kwargs: None
+    rospy.Duration = float
+    rospy.get_param = lambda name, default=None: default
+    rospy.loginfo = print
+    msg = types.ModuleType('std_msgs.msg')
+    msg.Float32MultiArray = object
+    std_msgs = types.ModuleType('std_msgs')
+    std_msgs.msg = msg
+    return {'rospy': rospy, 'std_msgs': std_msgs, 'std_msgs.msg': msg}
+
+
+def import_turtlebot():
+    """Import the turtlebot Estimator module next to the drone modules.
+
+    Both packages ship the SHARED_MODULES, so the drone copies of
+    TURTLEBOT_MODULES are set aside while the turtlebot module is
+    imported, and restored after.
+    rospy is replaced by a stand-in when it is not installed.
+    """
+    shadowed = {name: sys.modules.pop(name)
+                for name in TURTLEBOT_MODULES if name in sys.modules}
+    stand_in = {}
+    try:
+        importlib.import_module('rospy')
+    except ImportError:
+        stand_in = ros_stand_in()
+        sys.modules.update(stand_in)
+    sys.path.insert(0, TURTLEBOT_SRC)
+    try:
+        return importlib.import_module('Estimator')
+    finally:
+        sys.path.remove(TURTLEBOT_SRC)
+        for name in TURTLEBOT_MODULES:
+            sys.modules.pop(name, None)
+        sys.modules.update(shadowed)
+        for name in stand_in:
+            sys.modules.pop(name, None)
+
+
+def make_turtlebot_log(steps, dt=0.1, seed=0):
+    """Synthesize a frozen-bearing turtlebot log.
+
+    Both wheels get the same speed so the bearing stays at pi/4, which is
+    the configuration the KalmanFilter is built for.
+
+    Returns
+    -------
+    x, u, y : ndarray
+        Rows as published on the x, u and y topics, each starting with the
+        timestamp.
+    """
+    r, phid = 0.033, np.pi / 4
+    t = dt * np.arange(steps)
+    wheel = 1.0 + 0.5 * np.sin(0.2 * t)
+    u = np.column_stack((t, wheel, wheel))
+    x = np.zeros((steps, 6))
+    x[:, 0] = t
+    x[:, 1] = phid
+    speed = np.concatenate(([0], r * wheel[:-1] * dt))
+    x[:, 2] = np.cumsum(speed) * np.cos(phid)
+    x[:, 3] = np.cumsum(speed) * np.sin(phid)
+    x[:, 4] = np.concatenate(([0], np.cumsum(wheel[:-1] * dt)))
+    x[:, 5] = x[:, 4]
+    rng = np.random.default_rng(seed)
+    y = np.column_stack((t, x[:, 2:4] + rng.normal(0, 0.01, (steps, 2))))
+    return x, u, y
+
+
+def turtlebot_case(module, name, log):
+    x, u, y = log
+    messages = [(types.SimpleNamespace(data=tuple(xk)),
+                 types.SimpleNamespace(data=tuple(uk)),
+                 types.SimpleNamespace(data=tuple(yk)))
+                for xk, uk, yk in zip(x, u, y)]
+
+    def run():
+        estimator = getattr(module, name)()
+        for k, (mx, mu, my) in enumerate(messages):
+            estimator.callback_x(mx)
+            estimator.callback_u(mu)
+            estimator.callback_y(my)
+            if k:
+                estimator.update(None)
+        return estimator, len(messages) - 1
+    return run
+
+
+def run_benchmarks(args):
+    results = {}
+    memory = not args.no_memory
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {'data': default_path(False), 'noisy': default_path(True)}
+        if 'long' in args.datasets:
+            paths['long'] = os.path.join(tmp, 'long.npy')
+            np.save(paths['long'], make_long_log(paths['noisy'],
+                                                 args.long_repeat))
+        for name in args.estimators:
+            for dataset in args.datasets:
+                key = f'drone/{name}/{dataset}'
+                print(f'Running {key}...')
+                results[key] = measure(
+                    drone_case(DRONE_ESTIMATORS[name], paths[dataset]),
+                    args.repeat, memory)
+    if not args.no_turtlebot:
+        module = import_turtlebot()
+        log = make_turtlebot_log(args.turtlebot_steps)
+        for name, cls in TURTLEBOT_ESTIMATORS.items():
+            key = f'turtlebot/{name}/synthetic'
+            print(f'Running {key}...')
+            try:
+                results[key] = measure(turtlebot_case(module, cls, log),
+                                       args.repeat, memory)
+            except NotImplementedError:
+                results[key] = {'error': 'not implemented'}
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """List the cases that regressed beyond tolerance w.r.t. baseline."""
+    regressions = []
+    for key, result in results.items():
+        before = baseline.get(key)
+        if before is None or 'error' in result or 'error' in before:
+            continue
+        if result['updates_per_second'] < \
+                before['updates_per_second'] * (1 - tolerance):
+            regressions.append(
+                f"{key}: updates/s {before['updates_per_second']:.0f} -> "
+                f"{result['updates_per_second']:.0f}")
+        if 'peak_memory_bytes' in result and 'peak_memory_bytes' in before \
+                and result['peak_memory_bytes'] > \
+                before['peak_memory_bytes'] * (1 + tolerance):
+            regressions.append(
+                f"{key}: peak memory {before['peak_memory_bytes']} -> "
+                f"{result['peak_memory_bytes']} bytes")
+        if result['mse'] > before['mse'] * (1 + tolerance) + 1e-12:
+            regressions.append(
+                f"{key}: MSE {before['mse']:.6g} -> {result['mse']:.6g}")
+    return regressions
+
+
+def print_table(results):
+    print(f"{'case':<32}{'updates/s':>14}{'peak MiB':>10}{'MSE':>14}")
+    for key, result in results.items():
+        if 'error' in result:
+            print(f"{key:<32}{result['error']:>38}")
+            continue
+        peak = result.get('peak_memory_bytes')
+        peak = f'{peak / 2**20:.2f}' if peak is not None else '-'
+        print(f"{key:<32}{result['updates_per_second']:>14.0f}{peak:>10}"
+              f"{result['mse']:>14.6g}")
+
+
+def main():
+    """Entry point of the benchmark suite.
+
+    Returns
+    -------
+        None
+    """
+    args = parser.parse_args()
+    results = run_benchmarks(args)
+    print_table(results)
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+import os
+import numpy as np
+
+# Recorded logs are (N,11) arrays where each row is time, x, u, then y_obs.
+# NaN inputs and measurements are samples the log does not have.
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CHUNK_SIZE = 4096
+# Relative deviation from the nominal time step below which a timestamp
+# difference is taken as clock rounding
+DT_RTOL = 1e-6
+
+
+def default_path(is_noisy=False):
+    """Path of one of the sample logs shipped next to this module.
+
+    Parameters
+    ----------
+    is_noisy : bool
+        Whether to pick noisy_data.npy instead of data.npy.
+
+    Returns
+    -------
+    path : str
+        Absolute path of the sample log.
+    """
+    name = 'noisy_data.npy' if is_noisy else 'data.npy'
+    return os.path.join(DATA_DIR, name)
+
+
+def load_dataset(source, mmap=True):
+    """Open a recorded log without reading it into memory.
+
+    Parameters
+    ----------
+    source : str or ndarray
+        Path of a .npy log, or an already loaded array which is returned
+        unchanged.
+    mmap : bool
+        Whether to memory map the file. Rows are then only paged in when
+        they are accessed.
+
+    Returns
+    -------
+    data : ndarray
+        The (N,11) log, read-only when memory mapped.
+    """
+    if isinstance(source, np.ndarray):
+        return source
+    return np.load(source, mmap_mode='r' if mmap else None)
+
+
+def iter_chunks(data, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Iterate over a log in blocks of consecutive rows.
+
+    Every chunk is a zero-copy view into data. Memory maps are viewed as
+    plain ndarrays so that row slicing does not go through np.memmap.
+
+    Parameters
+    ----------
+    data : ndarray
+        The (N,11) log.
+    chunk_size : int
+        Number of rows per chunk. The last chunk may be shorter.
+
+    Yields
+    ------
+    chunk : ndarray
+        View of at most chunk_size rows.
+    """
+    if chunk_size < 1:
+        raise ValueError('chunk_size must be positive')
+    data = np.asarray(data)
+    for start in range(0, data.shape[0], chunk_size):
+        yield data[start:start + chunk_size]
+
+
+def step_sizes(t, nominal, rtol=DT_RTOL):
+    """Time steps between consecutive rows of a log.
+
+    Steps within rtol of nominal are rounding of the logger's clock and
+    are returned as nominal, so that uniformly sampled logs give exactly
+    one step size.
+
+    Parameters
+    ----------
+    t : ndarray
+        The (N,) timestamp column, or stacked (..., N) columns.
+    nominal : float or ndarray
+        Nominal time step of the log, or (..., 1) steps of stacked logs.
+    rtol : float
+        Relative tolerance of the snapping.
+
+    Returns
+    -------
+    dt : ndarray
+        The (..., N - 1) steps, dt[k] = t[k + 1] - t[k].
+    """
+    dt = np.diff(t)
+    return np.where(np.abs(dt - nominal) <= rtol * nominal, nominal, dt)
+
+
+def hold(u):
+    """Fill the NaN entries of an input log with the last value given.
+
+    Parameters
+    ----------
+    u : ndarray
+        The (N,m) inputs, NaN where a channel was not sampled, or stacked
+        (..., N, m) inputs of several logs.
+
+    Returns
+    -------
+    u : ndarray
+        Zero-order held copy of u. Entries before the first sample of a
+        channel stay NaN.
+    """
+    u = np.array(u, dtype=float)
+    rows = np.arange(u.shape[-2])[:, None]
+    last = np.where(np.isnan(u), 0, rows)
+    np.maximum.accumulate(last, axis=-2, out=last)
+    return np.take_along_axis(u, last, axis=-2)
+
+
+def decimate(data, input_every=1, measurement_every=1):
+    """Multi-rate copy of a log with the skipped samples set to NaN.
+
+    The states and timestamps are kept on every row, so the estimators
+    still run and are scored at the log's rate, while the inputs and each
+    measurement channel are only given every few rows. This is how logs of
+    slower sensors are fed to the estimators.
+
+    Parameters
+    ----------
+    data : ndarray
+        The (N,11) log.
+    input_every : int
+        Keep the inputs of every input_every-th row.
+    measurement_every : int or tuple
+        Keep the measurements of every measurement_every-th row, or a
+        (range, bearing) pair of periods.
+
+    Returns
+    -------
+    data : ndarray
+        The decimated (N,11) copy. Row 0 is always complete.
+    """
+    data = np.array(data, dtype=float)
+    rows = np.arange(data.shape[0])
+    data[rows % input_every != 0, 7:9] = np.nan
+    periods = np.broadcast_to(measurement_every, (2,))
+    for column, every in zip((9, 10), periods):
+        data[rows % every != 0, column] = np.nan
+    return data
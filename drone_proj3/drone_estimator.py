@@ -1,8 +1,30 @@
 import matplotlib.pyplot as plt
+import math
 import numpy as np
 import time
+from scipy.linalg import get_lapack_funcs
+from downsampling import MinMaxPyramid
+from dataset import \
+    DEFAULT_CHUNK_SIZE, DT_RTOL, default_path, load_dataset, iter_chunks, \
+    step_sizes, hold, decimate
+from history import History
+from profiling import StageTimer
+from smoothing import FixedLagSmoother, packed_size, pack, unpack
 plt.rcParams['font.family'] = ['Arial']
 plt.rcParams['font.size'] = 14
+# Fraction of their span the axis limits grow by during a replay, so that
+# they are rescaled, and the figure redrawn, only every so often
+REPLAY_HEADROOM = 0.5
+# Noise covariances found by tuning.py for the EKF on noisy_data.npy, the
+# defaults of the filters below
+DEFAULT_Q = np.diag([1.75e-4, 1.75e-4, 1.4e-5, 4.5e-5, 4.5e-5, 1.9e-3])
+DEFAULT_R = np.diag([0.032, 0.69])
+DEFAULT_P0 = np.eye(6) * 0.055
+# Noise covariances found by a random search over the UKF on the same log,
+# the defaults of UnscentedKalmanFilter
+UKF_Q = np.diag([3e-5, 3e-5, 1.6e-6, 9e-7, 9e-7, 1.25e-4])
+UKF_R = np.diag([0.024, 0.042])
+UKF_P0 = np.eye(6) * 0.09
 
 
 class Estimator:
@@ -15,35 +37,60 @@ class Estimator:
 
     Attributes:
     ----------
-        u : list
-            A list of system inputs, where, for the ith data point u[i],
+        u : History
+            A history of system inputs, where, for the ith data point u[i],
             u[i][1] is the thrust of the quadrotor
             u[i][2] is right wheel rotational speed (rad/s).
-        x : list
-            A list of system states, where, for the ith data point x[i],
+        x : History
+            A history of system states, where, for the ith data point x[i],
             x[i][0] is translational position in x (m),
             x[i][1] is translational position in z (m),
             x[i][2] is the bearing (rad) of the quadrotor
             x[i][3] is translational velocity in x (m/s),
             x[i][4] is translational velocity in z (m/s),
             x[i][5] is angular velocity (rad/s),
-        y : list
-            A list of system outputs, where, for the ith data point y[i],
+        y : History
+            A history of system outputs, where, for the ith data point y[i],
             y[i][1] is distance to the landmark (m)
             y[i][2] is relative bearing (rad) w.r.t. the landmark
-        x_hat : list
-            A list of estimated system states. It should follow the same format
-            as x.
+            A NaN component was not measured at that sample. Rows without
+            any measurement are predict-only steps for the filters.
+        x_hat : History
+            A history of estimated system states. It should follow the same
+            format as x.
+        x_lagged : History
+            Fixed-lag smoothed states, x_lagged[i] estimating x[i] once the
+            estimator is lag samples past it. None unless the estimator
+            runs a FixedLagSmoother.
+        t : History
+            A history of timestamps (s) of the data points.
         dt : float
-            Update frequency of the estimator.
+            Time step (s) of the update in progress, taken from the t
+            column. Set through set_dt.
+        nominal_dt : float
+            Average time step (s) of the log. Timestamp differences within
+            DT_RTOL of it are taken as exactly nominal_dt.
+        data : ndarray
+            The (N,11) recorded log, memory mapped when read from a file.
+            NaN inputs are held from the previous row.
+        chunk_size : int
+            Number of rows of data processed per chunk by run.
+        timer : StageTimer
+            Per-stage latency recorder filled by update.
+        update_runtimes : ndarray
+            Wall time (s) of every retained update call.
         fig : Figure
-            matplotlib Figure for real-time plotting.
+            matplotlib Figure for real-time plotting, None until init_figure
+            is called.
         axd : dict
             A dictionary of matplotlib Axis for real-time plotting.
         ln* : Line
             matplotlib Line object for ground truth states.
         ln_*_hat : Line
             matplotlib Line object for estimated states.
+        x_pyramid, x_hat_pyramid : MinMaxPyramid
+            Downsampled x, z and phi of x and x_hat for plotting, so that
+            the lines hold a few points per pixel whatever the log length.
         canvas_title : str
             Title of the real-time plot, which is chosen to be estimator type.
 
@@ -52,12 +99,58 @@ class Estimator:
         The landmark is positioned at (0, 5, 5).
     """
     # noinspection PyTypeChecker
-    def __init__(self, is_noisy=False):
-        self.u = []
-        self.x = []
-        self.y = []
-        self.x_hat = []  # Your estimates go here!
-        self.t = []
+    def __init__(self, is_noisy=False, data_path=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE, history_len=None,
+                 input_every=1, measurement_every=1):
+        # This is a (N,11) where it's time, x, u, then y_obs
+        if data_path is None:
+            data_path = default_path(is_noisy)
+        self.data = load_dataset(data_path)
+        if input_every != 1 or np.any(np.asarray(measurement_every) != 1):
+            # Simulate slower sensors, see dataset.decimate
+            self.data = decimate(self.data, input_every, measurement_every)
+        self.chunk_size = chunk_size
+
+        # Histories are sized for the whole log unless bounded by history_len
+        capacity = self.data.shape[0]
+        self.u = History(2, capacity=capacity, maxlen=history_len)
+        self.x = History(6, capacity=capacity, maxlen=history_len)
+        self.y = History(2, capacity=capacity, maxlen=history_len)
+        self.x_hat = History(6, capacity=capacity, maxlen=history_len)  # Your estimates go here!
+        self.t = History(capacity=capacity, maxlen=history_len)
+        self.x_lagged = None
+        self.timer = StageTimer(maxlen=history_len)
+        # The figure is only built when plotting is requested
+        self.fig = None
+        self.axd = None
+        self.canvas_title = 'N/A'
+        # Samples drawn by the previous frame, see plot_update
+        self._shown = 0
+        self.x_pyramid = MinMaxPyramid(3, maxlen=history_len)
+        self.x_hat_pyramid = MinMaxPyramid(3, maxlen=history_len)
+
+        # Defined in dynamics.py for the dynamics model
+        # m is the mass and J is the moment of inertia of the quadrotor 
+        self.gr = 9.81 
+        self.m = 0.92
+        self.J = 0.0023
+        # These are the X, Y, Z coordinates of the landmark
+        self.landmark = (0, 5, 5)
+
+        self.nominal_dt = self.data[-1][0]/self.data.shape[0]
+        self.dt = self.nominal_dt
+        self._missing = np.zeros(2, dtype=bool)
+
+    def init_figure(self):
+        """Build the real-time plotting figure on first use.
+
+        Returns
+        -------
+        fig : Figure
+            matplotlib Figure holding the line artists.
+        """
+        if self.fig is not None:
+            return self.fig
         self.fig, self.axd = plt.subplot_mosaic(
             [['xz', 'phi'],
              ['xz', 'x'],
@@ -70,46 +163,123 @@ class Estimator:
         self.ln_x_hat, = self.axd['x'].plot([], 'o-c', label='Estimated')
         self.ln_z, = self.axd['z'].plot([], 'o-g', linewidth=2, label='True')
         self.ln_z_hat, = self.axd['z'].plot([], 'o-c', label='Estimated')
-        self.canvas_title = 'N/A'
+        return self.fig
 
-        # Defined in dynamics.py for the dynamics model
-        # m is the mass and J is the moment of inertia of the quadrotor 
-        self.gr = 9.81 
-        self.m = 0.92
-        self.J = 0.0023
-        # These are the X, Y, Z coordinates of the landmark
-        self.landmark = (0, 5, 5)
+    @property
+    def update_runtimes(self):
+        return self.timer.seconds('total')
 
-        # This is a (N,12) where it's time, x, u, then y_obs 
-        if is_noisy:
-            with open('noisy_data.npy', 'rb') as f:
-                self.data = np.load(f)
-        else:
-            with open('data.npy', 'rb') as f:
-                self.data = np.load(f)
-
-        self.dt = self.data[-1][0]/self.data.shape[0]
+    def run(self, profile_out=None):
+        """Run the estimator over the whole log.
 
+        Parameters
+        ----------
+        profile_out : str
+            Path of a JSON file to write the per-stage latency summary to.
 
-    def run(self):
-        for i, data in enumerate(self.data):
-            self.t.append(np.array(data[0]))
-            self.x.append(np.array(data[1:7]))
-            self.u.append(np.array(data[7:9]))
-            self.y.append(np.array(data[9:12]))
-            if i == 0:
-                self.x_hat.append(self.x[-1])
-            else:
-                self.update(i)
-        average_runtime = np.mean(self.update_runtimes)
-        print(f"Average update runtime: {average_runtime:.6f} seconds")
-        print('Mean Squared Error: ', np.mean(np.square(np.array(self.x) - np.array(self.x_hat))))
+        Returns
+        -------
+        x_hat : History
+            Estimated states, one row per row of the log.
+        """
+        for chunk in iter_chunks(self.data, self.chunk_size):
+            for row in chunk:
+                self.step(row)
+        self.print_metrics()
+        if profile_out is not None:
+            self.timer.to_json(profile_out)
         return self.x_hat
 
+    def print_metrics(self):
+        runtimes = self.update_runtimes
+        if len(runtimes):
+            print(f"Average update runtime: {np.mean(runtimes):.6f} seconds")
+            print(f"p99 update runtime: {np.percentile(runtimes, 99):.6f} seconds")
+        print('Mean Squared Error: ', self.mean_squared_error())
+        if self.x_lagged is not None:
+            print('Fixed-lag Mean Squared Error: ',
+                  self.lagged_mean_squared_error())
+
+    def mean_squared_error(self):
+        return np.mean(np.square(self.x.view() - self.x_hat.view()))
+
+    def lagged_mean_squared_error(self):
+        # x_lagged trails x, compare the samples with absolute indices
+        # retained by both
+        start = max(self.x.dropped, self.x_lagged.dropped)
+        stop = self.x_lagged.total
+        x = self.x[start - self.x.dropped:stop - self.x.dropped]
+        x_lagged = self.x_lagged[start - self.x_lagged.dropped:]
+        return np.mean(np.square(x - x_lagged))
+
+    def metrics(self):
+        """Summary of the last run as a JSON-serializable dict."""
+        runtimes = self.update_runtimes
+        return {
+            'estimator': self.canvas_title,
+            'samples': len(self.x_hat),
+            'mse': float(self.mean_squared_error()),
+            'lagged_mse': float(self.lagged_mean_squared_error())
+                if self.x_lagged is not None else None,
+            'mean_update_runtime':
+                float(np.mean(runtimes)) if len(runtimes) else None,
+            'latency': self.timer.summary(),
+        }
+
+    def export(self, path):
+        """Save the retained t, x, u, y and x_hat histories to an .npz file."""
+        np.savez(path, **self.export_arrays())
+
+    def export_arrays(self):
+        arrays = dict(t=self.t.view(), x=self.x.view(), u=self.u.view(),
+                      y=self.y.view(), x_hat=self.x_hat.view())
+        if self.x_lagged is not None:
+            arrays['x_lagged'] = self.x_lagged.view()
+        return arrays
+
+    def step(self, row):
+        """Ingest one row of the log and run the estimator on it."""
+        if len(self.t):
+            dt = row[0] - self.t[-1]
+            if abs(dt - self.nominal_dt) <= DT_RTOL * self.nominal_dt:
+                dt = self.nominal_dt
+            if dt != self.dt:
+                self.set_dt(dt)
+        u = row[7:9]
+        if len(self.u) and (math.isnan(u[0]) or math.isnan(u[1])):
+            # Inputs are held between their samples
+            u = np.where(np.isnan(u), self.u[-1], u)
+        self.t.append(row[0])
+        self.x.append(row[1:7])
+        self.u.append(u)
+        self.y.append(row[9:12])
+        if len(self.x_hat) == 0:
+            self.x_hat.append(self.x[-1])
+        else:
+            self.update(len(self.x) - 1)
+
     def update(self, _):
         raise NotImplementedError
 
+    def set_dt(self, dt):
+        """Change the time step of the following updates."""
+        self.dt = dt
+
+    def missing(self, y):
+        """Mask of the components of the measurement y that are NaN.
+
+        The returned array is a reused buffer.
+        """
+        return np.isnan(y, out=self._missing)
+
+    @property
+    def lines(self):
+        """The line artists of the real-time plot."""
+        return [self.ln_xz, self.ln_xz_hat, self.ln_phi, self.ln_phi_hat,
+                self.ln_x, self.ln_x_hat, self.ln_z, self.ln_z_hat]
+
     def plot_init(self):
+        self.init_figure()
         self.axd['xz'].set_title(self.canvas_title)
         self.axd['xz'].set_xlabel('x (m)')
         self.axd['xz'].set_ylabel('z (m)')
@@ -125,51 +295,177 @@ class Estimator:
         self.axd['z'].set_xlabel('t (s)')
         self.axd['z'].legend()
         plt.tight_layout()
+        self._shown = 0
+        return self.lines
 
-    def plot_update(self, _):
-        self.plot_xzline(self.ln_xz, self.x)
-        self.plot_xzline(self.ln_xz_hat, self.x_hat)
-        self.plot_philine(self.ln_phi, self.x)
-        self.plot_philine(self.ln_phi_hat, self.x_hat)
-        self.plot_xline(self.ln_x, self.x)
-        self.plot_xline(self.ln_x_hat, self.x_hat)
-        self.plot_zline(self.ln_z, self.x)
-        self.plot_zline(self.ln_z_hat, self.x_hat)
-
-    def plot_xzline(self, ln, data):
-        if len(data):
-            x = [d[0] for d in data]
-            z = [d[1] for d in data]
-            ln.set_data(x, z)
-            self.resize_lim(self.axd['xz'], x, z)
-
-    def plot_philine(self, ln, data):
-        if len(data):
-            t = self.t
-            phi = [d[2] for d in data]
-            ln.set_data(t, phi)
-            self.resize_lim(self.axd['phi'], t, phi)
-
-    def plot_xline(self, ln, data):
-        if len(data):
-            t = self.t
-            x = [d[0] for d in data]
-            ln.set_data(t, x)
-            self.resize_lim(self.axd['x'], t, x)
-
-    def plot_zline(self, ln, data):
-        if len(data):
-            t = self.t
-            z = [d[1] for d in data]
-            ln.set_data(t, z)
-            self.resize_lim(self.axd['z'], t, z)
+    def replay_frames(self, fps=30, speed=1.0):
+        """Number of samples to show at each frame of a replay.
+
+        Frames are spaced in log time by speed / fps, independently of the
+        rate of the estimator, so a replay plays at speed times real time.
+
+        Parameters
+        ----------
+        fps : float
+            Frame rate of the replay.
+        speed : float
+            Log seconds shown per second of replay.
+
+        Returns
+        -------
+        frames : ndarray
+            Sample counts to pass to plot_update, one per frame.
+        """
+        t = self.t.view()
+        if len(t) == 0:
+            return np.zeros(1, dtype=int)
+        frame_times = np.arange(t[0], t[-1], speed / fps)
+        frames = np.searchsorted(t, frame_times, side='right')
+        return np.append(frames, len(t))
+
+    def plot_update(self, frame):
+        """Draw the estimation results up to a frame.
+
+        Only the samples added since the previous frame are scanned for the
+        axis limits. During a replay the limits grow with some headroom, and
+        the figure is only redrawn in full when they do. Otherwise only the
+        line artists are redrawn, by blitting.
+
+        Parameters
+        ----------
+        frame : int
+            Number of samples to show, see replay_frames. None shows all
+            the retained samples.
+
+        Returns
+        -------
+        artists : list
+            The line artists, which change with every frame.
+        """
+        self.init_figure()
+        if frame is None:
+            self._shown = 0
+            n = len(self.x_hat)
+            headroom = 0.0
+        else:
+            n = min(frame, len(self.x_hat))
+            headroom = REPLAY_HEADROOM
+        if n < self._shown:
+            # The replay started over
+            self._shown = 0
+        if n == self._shown:
+            return self.lines
+        t = self.t[:n]
+        x = self.x[:n]
+        x_hat = self.x_hat[:n]
+        new = slice(self._shown, n)
+        self._shown = n
+        self.x_pyramid.update(x[:, :3], self.x.dropped)
+        self.x_hat_pyramid.update(x_hat[:, :3], self.x_hat.dropped)
+        grown = False
+        for ln, data, pyramid in ((self.ln_xz, x, self.x_pyramid),
+                                  (self.ln_xz_hat, x_hat, self.x_hat_pyramid)):
+            grown |= self.plot_xzline(ln, data, pyramid, new, headroom)
+        for ln, data, pyramid in ((self.ln_phi, x, self.x_pyramid),
+                                  (self.ln_phi_hat, x_hat, self.x_hat_pyramid)):
+            grown |= self.plot_philine(ln, t, data, pyramid, new, headroom)
+        for ln, data, pyramid in ((self.ln_x, x, self.x_pyramid),
+                                  (self.ln_x_hat, x_hat, self.x_hat_pyramid)):
+            grown |= self.plot_xline(ln, t, data, pyramid, new, headroom)
+        for ln, data, pyramid in ((self.ln_z, x, self.x_pyramid),
+                                  (self.ln_z_hat, x_hat, self.x_hat_pyramid)):
+            grown |= self.plot_zline(ln, t, data, pyramid, new, headroom)
+        if grown and frame is not None:
+            # Ticks and labels are not blitted
+            self.fig.canvas.draw()
+        return self.lines
+
+    def plot_xzline(self, ln, data, pyramid, new, headroom):
+        grown = self.resize_lim(self.axd['xz'], data[new, 0], data[new, 1],
+                                headroom)
+        i = self.downsample(pyramid, (0, 1), self.axd['xz'], len(data))
+        ln.set_data(data[i, 0], data[i, 1])
+        return grown
+
+    def plot_philine(self, ln, t, data, pyramid, new, headroom):
+        grown = self.resize_lim(self.axd['phi'], t[new], data[new, 2],
+                                headroom)
+        i = self.downsample(pyramid, (2,), self.axd['phi'], len(data), t)
+        ln.set_data(t[i], data[i, 2])
+        return grown
+
+    def plot_xline(self, ln, t, data, pyramid, new, headroom):
+        grown = self.resize_lim(self.axd['x'], t[new], data[new, 0], headroom)
+        i = self.downsample(pyramid, (0,), self.axd['x'], len(data), t)
+        ln.set_data(t[i], data[i, 0])
+        return grown
+
+    def plot_zline(self, ln, t, data, pyramid, new, headroom):
+        grown = self.resize_lim(self.axd['z'], t[new], data[new, 1], headroom)
+        i = self.downsample(pyramid, (1,), self.axd['z'], len(data), t)
+        ln.set_data(t[i], data[i, 1])
+        return grown
+
+    def downsample(self, pyramid, series, ax, n, t=None):
+        """Rows of the first n retained samples to draw in ax.
+
+        Parameters
+        ----------
+        pyramid : MinMaxPyramid
+            Summary of the samples, see MinMaxPyramid.indices.
+        series : tuple
+            Series of the pyramid drawn.
+        ax : Axes
+            Axes drawn to, whose width in pixels sets the resolution.
+        n : int
+            Number of retained samples shown.
+        t : ndarray
+            Timestamps of the samples when they are drawn against time.
+            Only the samples within the horizontal limits of ax are drawn.
+
+        Returns
+        -------
+        rows : ndarray
+            Increasing row indices into the retained histories.
+        """
+        lo, hi = 0, n
+        if t is not None:
+            xlim = ax.get_xlim()
+            # One more sample on each side so that the line runs off the
+            # edges of the axes
+            lo = max(np.searchsorted(t, xlim[0]) - 1, 0)
+            hi = min(np.searchsorted(t, xlim[1], side='right') + 1, n)
+        offset = self.x.dropped
+        return pyramid.indices(series, offset + lo, offset + hi,
+                               ax.bbox.width) - offset
 
     # noinspection PyMethodMayBeStatic
-    def resize_lim(self, ax, x, y):
-        xlim = ax.get_xlim()
-        ax.set_xlim([min(min(x) * 1.05, xlim[0]), max(max(x) * 1.05, xlim[1])])
-        ylim = ax.get_ylim()
-        ax.set_ylim([min(min(y) * 1.05, ylim[0]), max(max(y) * 1.05, ylim[1])])
+    def resize_lim(self, ax, x, y, headroom=0.0):
+        """Grow the limits of ax to show x and y.
+
+        The limits only grow. When they do, they are extended by headroom
+        times their span on the side that grew.
+
+        Returns
+        -------
+        grown : bool
+            Whether the limits changed.
+        """
+        grown = False
+        for lim, set_lim, data in ((ax.get_xlim(), ax.set_xlim, x),
+                                   (ax.get_ylim(), ax.set_ylim, y)):
+            low = min(data.min() * 1.05, lim[0])
+            high = max(data.max() * 1.05, lim[1])
+            if (low, high) != tuple(lim):
+                span = high - low
+                if low < lim[0]:
+                    low -= headroom * span
+                if high > lim[1]:
+                    high += headroom * span
+                set_lim([low, high])
+                grown = True
+        return grown
+
 
 class OracleObserver(Estimator):
     """Oracle observer which has access to the true state.
@@ -182,12 +478,15 @@ class OracleObserver(Estimator):
     To run the oracle observer:
         $ python drone_estimator_node.py --estimator oracle_observer
     """
-    def __init__(self, is_noisy=False):
-        super().__init__(is_noisy)
+    def __init__(self, is_noisy=False, **kwargs):
+        super().__init__(is_noisy, **kwargs)
         self.canvas_title = 'Oracle Observer'
 
     def update(self, _):
+        self.timer.start()
         self.x_hat.append(self.x[-1])
+        self.timer.lap('bookkeeping')
+        self.timer.stop()
 
 
 class DeadReckoning(Estimator):
@@ -205,18 +504,19 @@ class DeadReckoning(Estimator):
     ----------
     To run dead reckoning:
         $ python drone_estimator_node.py --estimator dead_reckoning
+    To integrate the whole log at once instead of step by step:
+        $ python drone_estimator_node.py --estimator dr --batch
     """
-    def __init__(self, is_noisy=False):
-        super().__init__(False)
+    def __init__(self, is_noisy=False, **kwargs):
+        super().__init__(False, **kwargs)
         self.index = 0
         self.previousState = 0
         self.canvas_title = 'Dead Reckoning'
-        self.update_runtimes = []
 
     def update(self, _):
-        start_time = time.time()  # Start timing
+        self.timer.start()
 
-        if len(self.x_hat) > 0 and len(self.u) > self.index:
+        if len(self.x_hat) > 0 and len(self.u) > 1:
             # TODO: Your implementation goes here!
             # You may ONLY use self.u and self.x[0] for estimation
             if self.index == 0:
@@ -228,7 +528,8 @@ class DeadReckoning(Estimator):
                         [-(np.sin(lastPhi) / self.m), 0],
                         [(np.cos(lastPhi) / self.m), 0],
                         [0, (1 / self.J)]])
-            inputs = np.array([self.u[self.index][0], self.u[self.index][1]])
+            # The input applied over the step is the previous row's
+            inputs = np.array([self.u[-2][0], self.u[-2][1]])
 
             # print("Model: ", model)
             # print("Model Shape: ", model.shape)
@@ -247,15 +548,82 @@ class DeadReckoning(Estimator):
 
             # print("State Estimate: ", stateEstimate)
             # print("SE Shape: ", stateEstimate.shape)
+            self.timer.lap('predict')
 
             self.previousState = stateEstimate            
             self.x_hat.append(stateEstimate)
             
             self.index += 1
+            self.timer.lap('bookkeeping')
+
+        self.timer.stop()
+
+    def integrate(self, x0, u, dt=None):
+        """Integrate the whole input log in one pass.
+
+        Produces the same estimates as calling update once per row, but with
+        cumulative sums instead of a Python loop. The angular states do not
+        depend on the translational ones, so omega and phi are integrated
+        first and then used to integrate the velocities and positions.
 
-        end_time = time.time()  # End timing
-        elapsed_time = end_time - start_time  # Calculate elapsed time
-        self.update_runtimes.append(elapsed_time)  # Store runtime
+        Parameters
+        ----------
+        x0 : ndarray
+            Initial state, shape (6,).
+        u : ndarray
+            Inputs applied at each step, shape (N, 2).
+        dt : float or ndarray
+            Time step, or the (N,) steps of an irregular log. nominal_dt
+            by default.
+
+        Returns
+        -------
+        x_hat : ndarray
+            Estimated states, shape (N + 1, 6), starting with x0.
+        """
+        n = u.shape[0]
+        if dt is None:
+            dt = self.nominal_dt
+        x_hat = np.empty((n + 1, 6))
+        x_hat[0] = x0
+        # Prepending the initial value keeps cumsum's left-to-right summation
+        # order identical to the per-step Euler update.
+        x_hat[1:, 5] = u[:, 1] * (1 / self.J) * dt
+        np.cumsum(x_hat[:, 5], out=x_hat[:, 5])
+        x_hat[1:, 2] = x_hat[:-1, 5] * dt
+        np.cumsum(x_hat[:, 2], out=x_hat[:, 2])
+        phi = x_hat[:-1, 2]
+        x_hat[1:, 3] = -(np.sin(phi) / self.m) * u[:, 0] * dt
+        np.cumsum(x_hat[:, 3], out=x_hat[:, 3])
+        x_hat[1:, 4] = ((np.cos(phi) / self.m) * u[:, 0] - self.gr) * dt
+        np.cumsum(x_hat[:, 4], out=x_hat[:, 4])
+        x_hat[1:, 0] = x_hat[:-1, 3] * dt
+        np.cumsum(x_hat[:, 0], out=x_hat[:, 0])
+        x_hat[1:, 1] = x_hat[:-1, 4] * dt
+        np.cumsum(x_hat[:, 1], out=x_hat[:, 1])
+        return x_hat
+
+    def run_batch(self):
+        """Offline counterpart of run which integrates the whole log at once.
+
+        Returns
+        -------
+        x_hat : History
+            Estimated states, one row per row of the log.
+        """
+        start_time = time.time()
+        data = np.asarray(self.data)
+        self.t.extend(data[:, 0])
+        self.x.extend(data[:, 1:7])
+        u = hold(data[:, 7:9])
+        self.u.extend(u)
+        self.y.extend(data[:, 9:12])
+        dt = step_sizes(data[:, 0], self.nominal_dt)
+        self.x_hat.extend(self.integrate(data[0, 1:7], u[:-1], dt))
+        elapsed_time = time.time() - start_time
+        print(f"Batch integration runtime: {elapsed_time:.6f} seconds")
+        print('Mean Squared Error: ', self.mean_squared_error())
+        return self.x_hat
 
 # noinspection PyPep8Naming
 class ExtendedKalmanFilter(Estimator):
@@ -277,129 +645,1137 @@ class ExtendedKalmanFilter(Estimator):
             landmark[0] is the x coordinate.
             landmark[1] is the y coordinate.
             landmark[2] is the z coordinate.
+        Q : ndarray
+            Process noise covariance, DEFAULT_Q unless given.
+        R : ndarray
+            Measurement noise covariance, DEFAULT_R unless given.
+        P : ndarray
+            State covariance, initialized to P0 or DEFAULT_P0.
+        fixed_lag : FixedLagSmoother
+            Smoother fed by every update when a lag is given, else None.
+        max_iterations : int
+            Number of measurement updates allowed per step. Above 1, the
+            filter runs as an iterated EKF, relinearizing h around each
+            updated estimate until it moves by less than tolerance. The
+            number of passes taken is recorded as the 'iterations' counter
+            of timer. Iterating is opt-in: with the default covariances,
+            5 iterations give an MSE of 0.00465 on noisy_data.npy, 68%
+            above the 0.00276 of a single linearization, because
+            DEFAULT_Q and DEFAULT_R were tuned for the latter.
+        tolerance : float
+            Largest change of any state component that ends the iterations.
+        model : CompiledModel
+            Generated model kernels, e.g. models.quadrotor(), used by g, h,
+            their Jacobians and the fused kernels instead of the
+            hand-written code below. None for the latter.
 
     Example
     ----------
     To run the extended Kalman filter:
         $ python drone_estimator_node.py --estimator extended_kalman_filter
+    To run the iterated extended Kalman filter:
+        $ python drone_estimator_node.py --estimator iekf --max-iterations 5
+    To run it on the kernels generated from the symbolic model:
+        $ python drone_estimator_node.py --estimator ekf --symbolic
+    To also stream estimates smoothed 100 samples (0.2 s) behind:
+        $ python drone_estimator_node.py --estimator ekf --lag 100
+    To measure the range at a tenth of the log's rate, predicting alone
+    in between when the bearing is also missing:
+        $ python drone_estimator_node.py --estimator ekf --measurement-every 10 1
+    To search for better Q, R and P0:
+        $ python tuning.py --random 64
     """
-    def __init__(self, is_noisy=False):
-        super().__init__(is_noisy)
-        self.canvas_title = 'Extended Kalman Filter'
-        self.A = np.array([[1, 0, 0, 0, 0, 0],
-                           [0, 1, 0, 0, 0, 0],
-                           [0, 0, 1, 0, 0, 0],
-                           [0, 0, 0, 1, 0, 0],
-                           [0, 0, 0, 0, 1, 0],
-                           [0, 0, 0, 0, 0, 1]])
+    def __init__(self, is_noisy=False, Q=None, R=None, P0=None, lag=None,
+                 max_iterations=1, tolerance=1e-4, model=None, **kwargs):
+        super().__init__(is_noisy, **kwargs)
+        self.canvas_title = 'Extended Kalman Filter' if max_iterations == 1 \
+            else 'Iterated Extended Kalman Filter'
+        self.max_iterations = max_iterations
+        self.tolerance = tolerance
+        self.model = model
+        # Model constants folded for the kernels below, again by set_dt
+        # whenever the time step changes
+        self._fold_dt()
+        self._landmark_y2 = self.landmark[1]**2
+        # A and C are the Jacobian buffers; only their state-dependent
+        # entries are rewritten by predict and measure.
+        self.A = self.approx_A(np.zeros(6), np.zeros(2))
         self.B = None
-        self.C = np.array([[0, 0, 0, 0, 0, 0],
-                           [0, 0, 0, 0, 0, 0]])
-        self.Q = np.array([[1, 0, 0, 0, 0, 0],
-                           [0, 1, 0, 0, 0, 0],
-                           [0, 0, 1, 0, 0, 0],
-                           [0, 0, 0, 1, 0, 0],
-                           [0, 0, 0, 0, 1, 0],
-                           [0, 0, 0, 0, 0, 1]])
-        self.R = np.array([[1, 0],
-                           [0, 1]])
-        self.P = np.array([[1, 0, 0, 0, 0, 0],
-                           [0, 1, 0, 0, 0, 0],
-                           [0, 0, 1, 0, 0, 0],
-                           [0, 0, 0, 1, 0, 0],
-                           [0, 0, 0, 0, 1, 0],
-                           [0, 0, 0, 0, 0, 1]])
-        self.previous_state = None
+        self.C = self.approx_C(np.array([1.0, 0, 0, 0, 0, 0]))
+        self.Q = np.array(DEFAULT_Q if Q is None else Q, dtype=float)
+        self.R = np.array(DEFAULT_R if R is None else R, dtype=float)
+        self.P = np.array(DEFAULT_P0 if P0 is None else P0, dtype=float)
+        self.previous_state = np.zeros(6)
         self.index = 0
-        self.update_runtimes = []
+
+        # Preallocated workspace so that update does not allocate
+        self._I = np.eye(6)
+        self._x_pred = np.zeros(6)
+        self._P_pred = np.zeros((6, 6))
+        self._tmp = np.zeros((6, 6))
+        self._CP = np.zeros((2, 6))
+        self._S = np.zeros((2, 2))
+        self._K = np.zeros((6, 2))
+        self._KR = np.zeros((6, 2))
+        self._IKC = np.zeros((6, 6))
+        self._innovation = np.zeros(2)
+        self._x_lin = np.zeros(6)
+        self._offset = np.zeros(6)
+        self._C_obs = np.zeros((2, 6))
+        # Noise of each pattern of missing measurements, see observed_noise
+        self._observed_noise = {}
+        self._potrf, self._potrs = get_lapack_funcs(('potrf', 'potrs'),
+                                                    (self._S,))
+
+        self.fixed_lag = None
+        if lag is not None:
+            self.fixed_lag = FixedLagSmoother(6, lag)
+            self.x_lagged = History(6, capacity=self.data.shape[0],
+                                    maxlen=self.x_hat.maxlen)
 
     # noinspection DuplicatedCode
     def update(self, i):
-        start_time = time.time()
+        self.timer.start()
 
-        if len(self.x_hat) > 0: # and self.x_hat[-1][0] < self.x[-1][0]:
+        if len(self.x_hat) > 0:
             # You may use self.u, self.y, and self.x[0] for estimation
-            if self.index== 0:
-                self.previous_state = self.x[0]
-            
-            # State extrapolation
-            next_x = self.g(self.previous_state, self.u[-1])
-            # print("next_x: ", next_x)
+            if self.index == 0:
+                self.previous_state[:] = self.x[0]
+                if self.fixed_lag is not None:
+                    self.fixed_lag.push(self.previous_state, self.P)
+            x = self.previous_state
+            x_pred = self._x_pred
+            P_pred = self._P_pred
+            tmp = self._tmp
 
-            # Dynamics linearization
-            At = self.approx_A(self.previous_state, self.u[-1])
-            # print("At: ", At)
+            # State extrapolation and dynamics linearization
+            self.predict(x, self.u[-1], x_pred, self.A)
 
             # Covariance extrapolation
-            Pt1 = At @ self.P @ self.A.T + self.Q
-            # print("Pt1: ", Pt1)
-
-            # Measurement linearization
-            Ct = self.approx_C(next_x)
-            # print("Ct: ", Ct)
-
-            # Kalman gain
-            Kt1 = Pt1 @ Ct.T @ np.linalg.inv(Ct @ Pt1 @ Ct.T + self.R)
-            # print("Kt1: ", Kt1)
-            # print("Kt1 Shape: ", Kt1.shape)
-
-            # print("self.y[-1]: ", np.array(self.y[-1]))
-            # print("self.y[-1] shape: ", np.array(self.y[-1]).shape)
-            # print("self.h(next_x, None): ", self.h(next_x, None))
-            # print("h shape: ", self.h(next_x, None).shape)
-            # print("Kt1 @ (self.y[-1] - self.h(next_x, None): ", Kt1 @ (self.y[-1] - self.h(next_x, None)))
-            # print("Mult shape: ", (Kt1 @ (self.y[-1] - self.h(next_x, None))).shape)
-
-            # State update
-            next_state = next_x + Kt1 @ (self.y[-1] - self.h(next_x, None)) # double check y in self.h
-
-            # Covariance update
-            self.P = (np.eye(6) - (Kt1 @ self.C)) @ Pt1
-
-            # State estimate update
-            state_estimate = np.zeros(6)
-            # print("State Estimate: ", state_estimate)
-            # print("Next State: ", next_state)
-            state_estimate = next_state
-
-            self.previous_state = state_estimate
-            self.x_hat.append(state_estimate)
+            np.matmul(self.A, self.P, out=tmp)
+            np.matmul(tmp, self.A.T, out=P_pred)
+            P_pred += self.Q
+            self.timer.lap('predict')
+
+            y = self.y[-1]
+            missing = self.missing(y)
+            if missing.all():
+                self.skip_measurement(x, x_pred, P_pred)
+            else:
+                self.correct(x, x_pred, P_pred, y, missing)
+
+            if self.fixed_lag is not None:
+                smoothed = self.fixed_lag.push(x, self.P, self.A, x_pred,
+                                               P_pred)
+                if smoothed is not None:
+                    self.x_lagged.append(smoothed[0])
+                self.timer.lap('smooth')
+
+            self.x_hat.append(x)
+            self.index += 1
+            self.timer.lap('bookkeeping')
+
+        self.timer.stop()
+
+    def skip_measurement(self, x, x_pred, P_pred):
+        """Predict-only step, the estimate is the prediction."""
+        x[:] = x_pred
+        self.P[:] = P_pred
+        self.timer.lap('correct')
+
+    def correct(self, x, x_pred, P_pred, y, missing):
+        """Measurement update of the prediction, written to x and P.
+
+        Missing components of y are dropped by zeroing their rows of C and
+        their innovations, and by giving them unit, uncorrelated noise. S
+        is then block diagonal and K has zero columns for them, which is
+        exactly the update with the observed components only.
+        """
+        partial = missing.any()
+        C = self._C_obs if partial else self.C
+        R = self.observed_noise(missing) if partial else self.R
+        tmp = self._tmp
+        x_lin = x_pred
+        K = self._K
+        for iteration in range(1, self.max_iterations + 1):
+            # Measurement prediction and linearization
+            self.measure(x_lin, self._innovation, self.C)
+            if partial:
+                C[:] = self.C
+                C[missing] = 0
+            self.timer.lap('measure')
+
+            # Kalman gain, K = P C^T S^-1 solved as S K^T = C P by Cholesky
+            np.matmul(C, P_pred, out=self._CP)
+            np.matmul(self._CP, C.T, out=self._S)
+            self._S += R
+            L, info = self._potrf(self._S, lower=1, overwrite_a=1, clean=1)
+            if info != 0:
+                raise np.linalg.LinAlgError(
+                    'Innovation covariance is not positive definite')
+            Kt, info = self._potrs(L, self._CP, lower=1, overwrite_b=1)
+            K[:] = Kt.T
+            self.timer.lap('gain')
+
+            # State update, relinearized around x_lin:
+            # x = x_pred + K (y - h(x_lin) - C (x_pred - x_lin))
+            np.subtract(y, self._innovation, out=self._innovation)
+            if partial:
+                self._innovation[missing] = 0
+            if x_lin is not x_pred:
+                np.subtract(x_pred, x_lin, out=self._offset)
+                self._innovation -= C @ self._offset
+            np.matmul(K, self._innovation, out=x)
+            x += x_pred
+            if iteration == self.max_iterations:
+                break
+            np.subtract(x, x_lin, out=self._offset)
+            if np.abs(self._offset).max() < self.tolerance:
+                break
+            x_lin = self._x_lin
+            x_lin[:] = x
+            self.timer.lap('correct')
+        if self.max_iterations > 1:
+            self.timer.count('iterations', iteration)
+
+        # Covariance update in Joseph form,
+        # P = (I - K C) P (I - K C)^T + K R K^T
+        np.matmul(K, C, out=self._IKC)
+        np.subtract(self._I, self._IKC, out=self._IKC)
+        np.matmul(self._IKC, P_pred, out=tmp)
+        np.matmul(tmp, self._IKC.T, out=self.P)
+        np.matmul(K, R, out=self._KR)
+        np.matmul(self._KR, K.T, out=tmp)
+        self.P += tmp
+        # Enforce symmetry against round-off drift
+        np.add(self.P, self.P.T, out=tmp)
+        np.multiply(tmp, 0.5, out=self.P)
+        self.timer.lap('correct')
+
+    def observed_noise(self, missing):
+        """R with the missing components set to unit, uncorrelated noise.
+
+        Returns
+        -------
+        R : ndarray
+            Cached per pattern of missing components, do not modify.
+        """
+        key = missing.tobytes()
+        R = self._observed_noise.get(key)
+        if R is None:
+            R = np.array(self.R)
+            R[missing] = 0
+            R[:, missing] = 0
+            R[missing, missing] = 1
+            self._observed_noise[key] = R
+        return R
+
+    def set_dt(self, dt):
+        super().set_dt(dt)
+        self._fold_dt()
+        self.A[0, 3] = self.A[1, 4] = self.A[2, 5] = dt
+
+    def _fold_dt(self):
+        self._dt_m = self.dt / self.m
+        self._dt_J = self.dt / self.J
+        self._gr_dt = self.gr * self.dt
+
+    def g(self, x, u, out=None):
+        # Dynamics model, x + f(x, u) dt
+        if self.model is not None:
+            return self.model.g(x, u, self.dt, out)
+        if out is None:
+            out = np.empty(6)
+        phi = x[2]
+        thrust = u[0] * self._dt_m
+        out[0] = x[0] + x[3] * self.dt
+        out[1] = x[1] + x[4] * self.dt
+        out[2] = phi + x[5] * self.dt
+        out[3] = x[3] - math.sin(phi) * thrust
+        out[4] = x[4] + math.cos(phi) * thrust - self._gr_dt
+        out[5] = x[5] + u[1] * self._dt_J
+        return out
+
+    def h(self, x, y_obs, out=None):
+        # Measurement model, distance to the landmark and bearing
+        if self.model is not None:
+            return self.model.h(x, out)
+        if out is None:
+            out = np.empty(2)
+        dx = x[0] - self.landmark[0]
+        dz = x[1] - self.landmark[2]
+        out[0] = math.sqrt(dx * dx + self._landmark_y2 + dz * dz)
+        out[1] = x[2]
+        return out
+
+    def approx_A(self, x, u, out=None):
+        # Linear approx of g w.r.t. x
+        if self.model is not None:
+            return self.model.approx_A(x, u, self.dt, out)
+        if out is None:
+            out = np.eye(6)
+            out[0, 3] = self.dt
+            out[1, 4] = self.dt
+            out[2, 5] = self.dt
+        thrust = u[0] * self._dt_m
+        out[3, 2] = -math.cos(x[2]) * thrust
+        out[4, 2] = -math.sin(x[2]) * thrust
+        return out
+
+    def approx_C(self, x, out=None):
+        # Linear approx of h w.r.t. x
+        if self.model is not None:
+            return self.model.approx_C(x, out)
+        if out is None:
+            out = np.zeros((2, 6))
+            out[1, 2] = 1
+        dx = x[0] - self.landmark[0]
+        dz = x[1] - self.landmark[2]
+        distance = math.sqrt(dx * dx + self._landmark_y2 + dz * dz)
+        out[0, 0] = dx / distance
+        out[0, 1] = dz / distance
+        return out
+
+    def predict(self, x, u, out, A):
+        """Fused g and approx_A, sharing one sin and cos of the bearing.
+
+        Writes g(x, u) to out and the state-dependent entries of its
+        Jacobian at x to A.
+        """
+        if self.model is not None:
+            self.model.predict(x, u, self.dt, out, A)
+            return
+        phi = x[2]
+        sin = math.sin(phi)
+        cos = math.cos(phi)
+        thrust = u[0] * self._dt_m
+        out[0] = x[0] + x[3] * self.dt
+        out[1] = x[1] + x[4] * self.dt
+        out[2] = phi + x[5] * self.dt
+        out[3] = x[3] - sin * thrust
+        out[4] = x[4] + cos * thrust - self._gr_dt
+        out[5] = x[5] + u[1] * self._dt_J
+        A[3, 2] = -cos * thrust
+        A[4, 2] = -sin * thrust
+
+    def measure(self, x, out, C):
+        """Fused h and approx_C, sharing one landmark distance.
+
+        Writes h(x) to out and the state-dependent entries of its Jacobian
+        at x to C.
+        """
+        if self.model is not None:
+            self.model.measure(x, out, C)
+            return
+        dx = x[0] - self.landmark[0]
+        dz = x[1] - self.landmark[2]
+        distance = math.sqrt(dx * dx + self._landmark_y2 + dz * dz)
+        out[0] = distance
+        out[1] = x[2]
+        C[0, 0] = dx / distance
+        C[0, 1] = dz / distance
+
+
+# noinspection PyPep8Naming
+class SquareRootExtendedKalmanFilter(ExtendedKalmanFilter):
+    """Square-root extended Kalman filter estimator.
+
+    Same model as ExtendedKalmanFilter, but the filter carries a lower
+    triangular Cholesky factor L of the state covariance, P = L L^T,
+    instead of P. The time update triangularizes [A L, Lq] and the
+    measurement update the array [[Lr, C L], [0, L]] by QR, so P stays
+    positive semi-definite by construction and the factor has the square
+    root of P's condition number. This keeps the filter usable in float32,
+    selected with dtype, where the dense covariance update loses
+    definiteness on long noisy runs.
+
+    Attributes:
+    ----------
+        L : ndarray
+            Lower Cholesky factor of the state covariance. P is computed
+            from it on access.
+        dtype : dtype
+            Floating point type of the state, the factor, every work array
+            and the stored estimates, x_hat and x_lagged, whose memory
+            float32 halves. The t, x, u and y histories keep the log's
+            float64, and the fixed-lag smoother computes in float64 over
+            its fixed window.
+
+    Example
+    ----------
+    To run the square-root extended Kalman filter in single precision:
+        $ python drone_estimator_node.py --estimator srekf --dtype float32
+    """
+    def __init__(self, is_noisy=False, dtype=np.float64, **kwargs):
+        # Set first, the base class assigns P through the property below
+        self.dtype = np.dtype(dtype)
+        super().__init__(is_noisy, **kwargs)
+        if self.max_iterations != 1:
+            raise ValueError('The square-root filter does not iterate')
+        self.canvas_title = 'Square-Root Extended Kalman Filter'
+        dtype = self.dtype
+        self.x_hat = History(6, dtype=dtype, capacity=self.data.shape[0],
+                             maxlen=self.x_hat.maxlen)
+        if self.x_lagged is not None:
+            self.x_lagged = History(6, dtype=dtype,
+                                    capacity=self.data.shape[0],
+                                    maxlen=self.x_hat.maxlen)
+        self.A = self.A.astype(dtype)
+        self.C = self.C.astype(dtype)
+        self.previous_state = self.previous_state.astype(dtype)
+        self._x_pred = self._x_pred.astype(dtype)
+        self._innovation = self._innovation.astype(dtype)
+
+        # QR pre-arrays, transposed so that the QR gives the factors'
+        # transposes. The noise block of the time update is filled once
+        # here, the one of the measurement update per step.
+        self._pre_time = np.zeros((12, 6), dtype)
+        self._pre_time[6:] = np.linalg.cholesky(self.Q).T
+        self._pre_meas = np.zeros((8, 8), dtype)
+        self._R_root = np.linalg.cholesky(self.R).T.astype(dtype)
+        self._C_obs = self._C_obs.astype(dtype)
+        self._trtrs, = get_lapack_funcs(('trtrs',), (self._pre_meas,))
+
+    @property
+    def P(self):
+        return self.L @ self.L.T
+
+    @P.setter
+    def P(self, P):
+        self.L = np.linalg.cholesky(P).astype(self.dtype)
+
+    def update(self, i):
+        self.timer.start()
+
+        if len(self.x_hat) > 0:
+            if self.index == 0:
+                self.previous_state[:] = self.x[0]
+                if self.fixed_lag is not None:
+                    self.fixed_lag.push(self.previous_state, self.P)
+            x = self.previous_state
+            x_pred = self._x_pred
+            u = self.u[-1]
+
+            # State extrapolation and dynamics linearization
+            self.predict(x, u, x_pred, self.A)
+
+            # Factor extrapolation, [A L, Lq] = [L_pred, 0] Q^T
+            pre = self._pre_time
+            np.matmul(self.L.T, self.A.T, out=pre[:6])
+            L_pred = np.linalg.qr(pre, mode='r').T
+            self.timer.lap('predict')
+
+            y = self.y[-1]
+            missing = self.missing(y)
+            if missing.all():
+                x[:] = x_pred
+                self.L = L_pred
+                self.timer.lap('correct')
+            else:
+                self.correct_factor(x, x_pred, L_pred, y, missing)
+
+            if self.fixed_lag is not None:
+                smoothed = self.fixed_lag.push(x, self.P, self.A, x_pred,
+                                               L_pred @ L_pred.T)
+                if smoothed is not None:
+                    self.x_lagged.append(smoothed[0])
+                self.timer.lap('smooth')
+
+            self.x_hat.append(x)
+            self.index += 1
+            self.timer.lap('bookkeeping')
+
+        self.timer.stop()
+
+    def correct_factor(self, x, x_pred, L_pred, y, missing):
+        """Measurement update of the prediction, written to x and L.
+
+        Missing components of y are dropped as in correct.
+        """
+        # Measurement prediction and linearization
+        self.measure(x_pred, self._innovation, self.C)
+        C = self.C
+        pre = self._pre_meas
+        if missing.any():
+            C = self._C_obs
+            C[:] = self.C
+            C[missing] = 0
+            pre[:2, :2] = np.linalg.cholesky(self.observed_noise(missing)).T
+        else:
+            pre[:2, :2] = self._R_root
+        self.timer.lap('measure')
+
+        # [[Lr, C L_pred], [0, L_pred]] = [[S^1/2, 0], [K S^1/2, L]] Q^T
+        np.matmul(L_pred.T, C.T, out=pre[2:, :2])
+        pre[2:, 2:] = L_pred.T
+        post = np.linalg.qr(pre, mode='r').T
+        S_root = post[:2, :2]
+        K_root = post[2:, :2]
+        self.timer.lap('gain')
+
+        # State update, x = x_pred + K S^1/2 (S^-1/2 innovation)
+        np.subtract(y, self._innovation, out=self._innovation)
+        self._innovation[missing] = 0
+        e, info = self._trtrs(S_root, self._innovation, lower=1)
+        if info != 0:
+            raise np.linalg.LinAlgError(
+                'Innovation covariance is singular')
+        np.matmul(K_root, e, out=x)
+        x += x_pred
+        self.L = post[2:, 2:]
+        self.timer.lap('correct')
+
+
+# noinspection PyPep8Naming
+class ExtendedKalmanSmoother(ExtendedKalmanFilter):
+    """Fixed-interval Rauch-Tung-Striebel smoother over a recorded log.
+
+    The forward pass is the ExtendedKalmanFilter. Besides x_hat it stores
+    only what the backward pass cannot recompute: the filtered covariances,
+    packed to their 21 upper triangular entries, the two entries of the
+    dynamics Jacobian that depend on the state and the time step. The
+    predictions are recomputed from x_hat and u during the backward pass,
+    which overwrites x_hat and P_hat with the smoothed estimates in place.
+    Together with the log itself this keeps a sample at 41 floats, so logs
+    of millions of samples fit in memory.
+
+    Attributes:
+    ----------
+        P_hat : History
+            Packed covariance of every estimate in x_hat, filtered until
+            smooth is called and smoothed afterwards.
+        A_hat : History
+            A[3, 2] and A[4, 2] of the Jacobian used to predict from each
+            estimate to the next one, and the time step of the prediction.
+        smoothed : bool
+            Whether smooth has run.
+
+    Example
+    ----------
+    To smooth the whole log after filtering it:
+        $ python drone_estimator_node.py --estimator ekf --smooth
+    """
+    def __init__(self, is_noisy=False, **kwargs):
+        super().__init__(is_noisy, **kwargs)
+        if self.x_hat.maxlen is not None:
+            raise ValueError('The smoother needs the whole log, '
+                             'history_len must be None')
+        self.canvas_title = 'Extended Kalman Smoother'
+        capacity = self.data.shape[0]
+        self.P_hat = History(packed_size(6), capacity=capacity)
+        self.A_hat = History(3, capacity=capacity)
+        self.smoothed = False
+
+    def update(self, i):
+        if len(self.P_hat) == 0:
+            # Covariance of x_hat[0], which step sets to x[0]
+            self.P_hat.append(pack(self.P))
+        super().update(i)
+        self.P_hat.append(pack(self.P))
+        self.A_hat.append((self.A[3, 2], self.A[4, 2], self.dt))
+
+    def smooth(self):
+        """Run the backward RTS pass over the filtered log.
+
+        Returns
+        -------
+        x_hat : History
+            The smoothed states, replacing the filtered ones.
+        """
+        if self.smoothed:
+            return self.x_hat
+        x = self.x_hat.view()
+        P = self.P_hat.view()
+        a = self.A_hat.view()
+        u = self.u.view()
+        A = self.A
+        P_f = self._tmp
+        P_s = np.zeros((6, 6))
+        AP = np.zeros((6, 6))
+        x_pred = self._x_pred
+        P_pred = self._P_pred
+        if len(P):
+            unpack(P[-1], 6, out=P_s)
+        for k in range(len(a) - 1, -1, -1):
+            # Prediction from k to k + 1, recomputed
+            if a[k, 2] != self.dt:
+                self.set_dt(a[k, 2])
+            A[3:5, 2] = a[k, :2]
+            unpack(P[k], 6, out=P_f)
+            self.g(x[k], u[k + 1], out=x_pred)
+            np.matmul(A, P_f, out=AP)
+            np.matmul(AP, A.T, out=P_pred)
+            P_pred += self.Q
+
+            # Smoother gain, G = P_f A^T P_pred^-1 solved as
+            # P_pred G^T = A P_f by Cholesky
+            L, info = self._potrf(P_pred, lower=1, overwrite_a=0, clean=1)
+            if info != 0:
+                raise np.linalg.LinAlgError(
+                    'Predicted covariance is not positive definite')
+            Gt, info = self._potrs(L, AP, lower=1)
+            G = Gt.T
+
+            # x_s = x_f + G (x_s' - x_pred), P_s = P_f + G (P_s' - P_pred) G^T
+            x[k] += G @ (x[k + 1] - x_pred)
+            P_s -= P_pred
+            P_s = P_f + G @ P_s @ Gt
+            pack(P_s, out=P[k])
+        self.smoothed = True
+        return self.x_hat
+
+    def export_arrays(self):
+        arrays = super().export_arrays()
+        arrays['P_hat'] = self.P_hat.view()
+        return arrays
+
+
+# noinspection PyPep8Naming
+class UnscentedKalmanFilter(ExtendedKalmanFilter):
+    """Unscented Kalman filter estimator.
+
+    Uses the same quadrotor dynamics and range/bearing measurement model as
+    ExtendedKalmanFilter, but instead of linearizing them it propagates
+    2n+1 scaled sigma points through g and h. All sigma points go through
+    each function in one vectorized call, so a step costs a few array
+    operations instead of 13 Python-level model evaluations.
+
+    Q, R and P0 default to UKF_Q, UKF_R and UKF_P0, tuned for this filter.
+    With the EKF's defaults its noisy_data.npy MSE is five times higher,
+    and it drifts on the benchmark's long log. alpha only changes the MSE
+    in the fourth digit. The default of 1 keeps every sigma point weight
+    non-negative.
+
+    Attributes:
+    ----------
+        alpha : float
+            Spread of the sigma points around the mean.
+        beta : float
+            Prior knowledge of the distribution, 2 is optimal for Gaussians.
+        kappa : float
+            Secondary scaling parameter.
+        Wm : ndarray
+            Weights of the sigma points for the mean, shape (2n+1,).
+        Wc : ndarray
+            Weights of the sigma points for the covariance, shape (2n+1,).
+
+    Example
+    ----------
+    To run the unscented Kalman filter:
+        $ python drone_estimator_node.py --estimator ukf
+    """
+    def __init__(self, is_noisy=False, Q=None, R=None, P0=None, alpha=1.0,
+                 beta=2.0, kappa=0.0, **kwargs):
+        super().__init__(is_noisy, Q=UKF_Q if Q is None else Q,
+                         R=UKF_R if R is None else R,
+                         P0=UKF_P0 if P0 is None else P0, **kwargs)
+        if self.fixed_lag is not None:
+            raise ValueError('Fixed-lag smoothing needs the EKF Jacobians')
+        if self.max_iterations != 1:
+            raise ValueError('The unscented filter does not iterate')
+        self.canvas_title = 'Unscented Kalman Filter'
+        n = 6
+        self.alpha = alpha
+        self.beta = beta
+        self.kappa = kappa
+        lam = alpha**2 * (n + kappa) - n
+        self._spread = np.sqrt(n + lam)
+        self.Wm = np.full(2 * n + 1, 1 / (2 * (n + lam)))
+        self.Wc = self.Wm.copy()
+        self.Wm[0] = lam / (n + lam)
+        self.Wc[0] = lam / (n + lam) + 1 - alpha**2 + beta
+        self._sigma = np.zeros((2 * n + 1, n))
+
+    def update(self, i):
+        self.timer.start()
+
+        if len(self.x_hat) > 0:
+            if self.index == 0:
+                self.previous_state[:] = self.x[0]
+            x = self.previous_state
+
+            # Propagate sigma points of the current estimate through the
+            # dynamics in one call
+            X = self.g(self.sigma_points(x, self.P), self.u[-1])
+            self.timer.lap('sigma')
+            x_pred = self.Wm @ X
+            dX = X - x_pred
+            P_pred = (self.Wc * dX.T) @ dX + self.Q
+            self.timer.lap('predict')
+
+            y = self.y[-1]
+            missing = self.missing(y)
+            if missing.all():
+                self.skip_measurement(x, x_pred, P_pred)
+            else:
+                self.correct(x, x_pred, P_pred, y, missing)
+
+            self.x_hat.append(x)
+            self.index += 1
+            self.timer.lap('bookkeeping')
+
+        self.timer.stop()
+
+    def correct(self, x, x_pred, P_pred, y, missing):
+        """Measurement update of the prediction, written to x and P.
+
+        Missing components of y are dropped as in the EKF, by zeroing their
+        deviations and innovations and giving them unit noise.
+        """
+        partial = missing.any()
+        R = self.observed_noise(missing) if partial else self.R
+        # Redraw the sigma points so that they carry Q, then predict their
+        # measurements in one call
+        X = self.sigma_points(x_pred, P_pred)
+        dX = X - x_pred
+        Z = self.h(X, None)
+        z_pred = self.Wm @ Z
+        dZ = Z - z_pred
+        if partial:
+            dZ[:, missing] = 0
+        S = (self.Wc * dZ.T) @ dZ + R
+        Pxz = (self.Wc * dX.T) @ dZ
+
+        # Kalman gain, K = Pxz S^-1 solved as S K^T = Pxz^T by Cholesky
+        L, info = self._potrf(S, lower=1, overwrite_a=0, clean=1)
+        if info != 0:
+            raise np.linalg.LinAlgError(
+                'Innovation covariance is not positive definite')
+        Kt, info = self._potrs(L, Pxz.T, lower=1)
+        K = Kt.T
+        self.timer.lap('gain')
+
+        # State and covariance update
+        innovation = y - z_pred
+        if partial:
+            innovation[missing] = 0
+        np.matmul(K, innovation, out=x)
+        x += x_pred
+        self.P = P_pred - K @ S @ K.T
+        self.P = 0.5 * (self.P + self.P.T)
+        self.timer.lap('correct')
+
+    def sigma_points(self, x, P):
+        """Scaled sigma points of N(x, P), shape (2n+1, n).
+
+        The returned array is a reused buffer.
+        """
+        L = np.linalg.cholesky(P)
+        L *= self._spread
+        sigma = self._sigma
+        sigma[:] = x
+        sigma[1:7] += L.T
+        sigma[7:] -= L.T
+        return sigma
+
+    def g(self, x, u, out=None):
+        # Dynamics model, x + f(x, u) dt, for one state or a stack of them
+        if self.model is not None:
+            return self.model.g(x, u, self.dt, out)
+        if out is None:
+            out = np.empty_like(x)
+        phi = x[..., 2]
+        thrust = u[0] * self._dt_m
+        out[..., 0:3] = x[..., 0:3] + x[..., 3:6] * self.dt
+        out[..., 3] = x[..., 3] - np.sin(phi) * thrust
+        out[..., 4] = x[..., 4] + np.cos(phi) * thrust - self._gr_dt
+        out[..., 5] = x[..., 5] + u[1] * self._dt_J
+        return out
+
+    def h(self, x, y_obs, out=None):
+        # Measurement model, for one state or a stack of them
+        if self.model is not None:
+            return self.model.h(x, out)
+        if out is None:
+            out = np.empty(x.shape[:-1] + (2,))
+        out[..., 0] = np.sqrt((self.landmark[0] - x[..., 0])**2
+                              + self._landmark_y2
+                              + (self.landmark[2] - x[..., 1])**2)
+        out[..., 1] = x[..., 2]
+        return out
+
+
+# noinspection PyPep8Naming
+class ParticleFilter(Estimator):
+    """Particle filter estimator.
+
+    The posterior is represented by a cloud of weighted particles stored as
+    one (P,6) array. Every step propagates all particles through the
+    quadrotor dynamics with sampled process noise, weights them by the
+    range/bearing likelihood and resamples systematically when the
+    effective sample size drops. All three stages are whole-array NumPy
+    operations on preallocated buffers with no per-particle Python work;
+    the cost of a step is dominated by drawing the P*6 process noise
+    samples. Unlike the Kalman filters, the particle cloud can hold several
+    modes, e.g. while only the range constrains the position.
+
+    Attributes:
+    ----------
+        n_particles : int
+            Number of particles P.
+        particles : ndarray
+            The (P,6) particle states.
+        log_weights : ndarray
+            Unnormalized log weights of the particles, shape (P,).
+        Q : ndarray
+            Covariance of the process noise added to every particle per
+            step.
+        R : ndarray
+            Covariance of the range/bearing measurement noise.
+        P0 : ndarray
+            Covariance of the initial particle cloud around x[0].
+        resample_threshold : float
+            Resample when the effective sample size falls below this
+            fraction of P.
+        rng : Generator
+            Source of the process noise and resampling offsets.
+
+    Example
+    ----------
+    To run the particle filter with 10^4 particles:
+        $ python drone_estimator_node.py --estimator pf --particles 10000
+    """
+    def __init__(self, is_noisy=False, n_particles=4096, Q=None, R=None,
+                 P0=None, resample_threshold=0.5, seed=None, **kwargs):
+        super().__init__(is_noisy, **kwargs)
+        self.canvas_title = 'Particle Filter'
+        self.n_particles = n_particles
+        # An identity Q would scatter the particles by a metre per step
+        self.Q = np.array(DEFAULT_Q if Q is None else Q, dtype=float)
+        self.R = np.array(DEFAULT_R if R is None else R, dtype=float)
+        self.P0 = np.array(DEFAULT_P0 if P0 is None else P0, dtype=float)
+        self.resample_threshold = resample_threshold
+        # SFC64 draws the P*6 normals of every step faster than PCG64
+        self.rng = np.random.Generator(np.random.SFC64(seed))
+        self.index = 0
+
+        self._Lq = np.linalg.cholesky(self.Q).T
+        self._R_inv = np.linalg.inv(self.R)
+        # Precision of the bearing alone or of the range alone, indexed by
+        # whether the bearing is the missing one
+        self._observed_precision = (np.diag([0, 1 / self.R[1, 1]]),
+                                    np.diag([1 / self.R[0, 0], 0]))
+        self.particles = np.zeros((n_particles, 6))
+        self.log_weights = np.zeros(n_particles)
+        # Preallocated workspace so that update does not allocate
+        self._resampled = np.empty_like(self.particles)
+        self._noise = np.empty_like(self.particles)
+        self._weights = np.empty(n_particles)
+        self._sin = np.empty(n_particles)
+        self._cos = np.empty(n_particles)
+        self._e_range = np.empty(n_particles)
+        self._e_bearing = np.empty(n_particles)
+        self._cdf = np.empty(n_particles)
+        self._positions = np.empty(n_particles)
+        self._index = np.empty(n_particles, dtype=np.intp)
+        self._offsets = np.arange(n_particles) / n_particles
+
+    def update(self, _):
+        self.timer.start()
+
+        if len(self.x_hat) > 0:
+            if self.index == 0:
+                self.initialize(self.x[0])
+            self.propagate(self.u[-1])
+            self.timer.lap('predict')
+
+            self.reweight(self.y[-1])
+            self.timer.lap('weight')
+
+            x = self._weights @ self.particles
+            self.timer.lap('estimate')
+
+            ess = 1 / np.dot(self._weights, self._weights)
+            resample = ess < self.resample_threshold * self.n_particles
+            if resample:
+                self.resample()
+            self.timer.count('resampled', int(resample))
+            self.timer.lap('resample')
+
+            self.x_hat.append(x)
             self.index += 1
-        
-        end_time = time.time()  # End timing
-        elapsed_time = end_time - start_time  # Calculate elapsed time
-        self.update_runtimes.append(elapsed_time)  # Store runtime
+            self.timer.lap('bookkeeping')
+
+        self.timer.stop()
+
+    def initialize(self, x0):
+        """Draw the particle cloud from N(x0, P0) with uniform weights."""
+        self.rng.standard_normal(out=self._noise)
+        np.matmul(self._noise, np.linalg.cholesky(self.P0).T,
+                  out=self.particles)
+        self.particles += x0
+        self.log_weights[:] = 0
+
+    def propagate(self, u):
+        """Move every particle through the dynamics and add process noise."""
+        X = self.particles
+        np.sin(X[:, 2], out=self._sin)
+        np.cos(X[:, 2], out=self._cos)
+        # Positions and bearing use the velocities before this step
+        X[:, 0:3] += X[:, 3:6] * self.dt
+        self._sin *= -u[0] / self.m * self.dt
+        X[:, 3] += self._sin
+        self._cos *= u[0] / self.m * self.dt
+        X[:, 4] += self._cos
+        X[:, 4] -= self.gr * self.dt
+        X[:, 5] += u[1] / self.J * self.dt
+        self.rng.standard_normal(out=self._noise)
+        np.matmul(self._noise, self._Lq, out=self._noise)
+        X += self._noise
+
+    def reweight(self, y):
+        """Multiply the weights by the measurement likelihood of y.
+
+        NaN components of y are left out of the likelihood, which is then
+        that of the observed components only. Leaves the normalized weights
+        in self._weights.
+        """
+        X = self.particles
+        e_range, e_bearing = self._e_range, self._e_bearing
+        w = self._weights
+        missing = self.missing(y)
+        if missing.all():
+            self.normalize()
+            return
+        # Precision of the observed components
+        R_inv = self._R_inv if not missing.any() \
+            else self._observed_precision[int(missing[1])]
+
+        if not missing[0]:
+            # Range residual, computed in place to avoid temporaries
+            np.subtract(self.landmark[0], X[:, 0], out=e_range)
+            np.square(e_range, out=e_range)
+            np.subtract(self.landmark[2], X[:, 1], out=e_bearing)
+            np.square(e_bearing, out=e_bearing)
+            e_range += e_bearing
+            e_range += self.landmark[1]**2
+            np.sqrt(e_range, out=e_range)
+            e_range -= y[0]
+            # log w -= e^T R^-1 e / 2
+            np.square(e_range, out=w)
+            w *= -0.5 * R_inv[0, 0]
+            self.log_weights += w
+        if not missing[1]:
+            np.subtract(X[:, 2], y[1], out=e_bearing)
+            np.square(e_bearing, out=w)
+            w *= -0.5 * R_inv[1, 1]
+            self.log_weights += w
+        if not missing.any():
+            e_range *= e_bearing
+            e_range *= -R_inv[0, 1]
+            self.log_weights += e_range
+        self.normalize()
+
+    def normalize(self):
+        """Normalized weights of log_weights, left in self._weights."""
+        w = self._weights
+        self.log_weights -= self.log_weights.max()
+        np.exp(self.log_weights, out=w)
+        w /= w.sum()
+
+    def resample(self):
+        """Systematic resampling, one uniform offset for all P draws."""
+        np.cumsum(self._weights, out=self._cdf)
+        self._cdf[-1] = 1.0
+        np.add(self._offsets, self.rng.random() / self.n_particles,
+               out=self._positions)
+        self._index[:] = np.searchsorted(self._cdf, self._positions)
+        np.take(self.particles, self._index, axis=0, out=self._resampled)
+        self.particles, self._resampled = self._resampled, self.particles
+        self.log_weights[:] = 0
+
+
+# noinspection PyPep8Naming
+class BatchedExtendedKalmanFilter:
+    """N independent extended Kalman filters stepped together.
+
+    The filters share the quadrotor model of ExtendedKalmanFilter but each
+    has its own state, covariance, noise covariances and time step. States
+    are stored as one (N,6) array and covariances as (N,6,6), and g,
+    approx_A, h and approx_C are evaluated for the whole batch at once. The
+    per-step cost is then close to that of a single filter for moderate N,
+    instead of growing with the number of Python filter instances. Typical
+    batches are many drones, many logs or many noise configurations of the
+    same log.
+
+    Attributes:
+    ----------
+        n : int
+            Number of filters.
+        x : ndarray
+            Current state estimates, shape (N,6).
+        P : ndarray
+            Current state covariances, shape (N,6,6).
+        Q : ndarray
+            Process noise covariances, shape (N,6,6).
+        R : ndarray
+            Measurement noise covariances, shape (N,2,2).
+        dt : ndarray
+            Time step of each filter, shape (N,), set by update.
+
+    Example
+    ----------
+    To run 16 noise configurations over the same log:
+        >>> data = load_dataset(default_path(True))
+        >>> ekf = BatchedExtendedKalmanFilter.from_data(data, Q=Qs)
+        >>> x_hat = ekf.run(data)  # (16, N, 6)
+    """
+    def __init__(self, x0, dt, Q=None, R=None, P0=None):
+        self.x = np.array(np.atleast_2d(x0), dtype=float)
+        self.n = self.x.shape[0]
+        # Defined in dynamics.py for the dynamics model
+        self.gr = 9.81
+        self.m = 0.92
+        self.J = 0.0023
+        # These are the X, Y, Z coordinates of the landmark
+        self.landmark = (0, 5, 5)
+        self.dt = np.broadcast_to(np.asarray(dt, dtype=float),
+                                  (self.n,)).copy()
+        self.Q = self._stack(DEFAULT_Q if Q is None else Q, 6)
+        self.R = self._stack(DEFAULT_R if R is None else R, 2)
+        self.P = self._stack(DEFAULT_P0 if P0 is None else P0, 6)
+
+        # Jacobian buffers, only the state-dependent entries are rewritten
+        self.A = np.zeros((self.n, 6, 6))
+        self.A[:] = np.eye(6)
+        self.A[:, 0, 3] = self.dt
+        self.A[:, 1, 4] = self.dt
+        self.A[:, 2, 5] = self.dt
+        self.C = np.zeros((self.n, 2, 6))
+        self.C[:, 1, 2] = 1
+        self._I = np.eye(6)
+
+    @classmethod
+    def from_data(cls, data, Q=None, R=None, P0=None):
+        """Build the filters for one shared (T,11) log or stacked (N,T,11) logs.
+
+        The batch size is taken from the stacked logs, or else from the
+        first of Q, R and P0 given as a stack of matrices. The time step
+        starts at the nominal step of each log.
+        """
+        data = np.asarray(data)
+        x0 = data[..., 0, 1:7]
+        dt = data[..., -1, 0] / data.shape[-2]
+        if data.ndim == 2:
+            n = next((np.shape(M)[0] for M in (Q, R, P0)
+                      if M is not None and np.ndim(M) == 3), 1)
+            x0 = np.tile(x0, (n, 1))
+        return cls(x0, dt, Q, R, P0)
+
+    def _stack(self, M, dim):
+        return np.broadcast_to(np.asarray(M, dtype=float),
+                               (self.n, dim, dim)).copy()
+
+    def update(self, u, y, dt=None):
+        """Advance every filter by one step.
+
+        Parameters
+        ----------
+        u : ndarray
+            Inputs, shape (N,2) or (2,) when shared by all filters.
+        y : ndarray
+            Measurements, shape (N,2) or (2,) when shared by all filters.
+            NaN components were not measured and are left out of the
+            update, as by ExtendedKalmanFilter.correct.
+        dt : float or ndarray
+            Time step of this update, shape (N,) or shared by all filters.
+            The previous step by default.
+
+        Returns
+        -------
+        x : ndarray
+            Updated state estimates, shape (N,6).
+        """
+        if dt is not None:
+            self.set_dt(dt)
+        u = np.broadcast_to(u, (self.n, 2))
+        y = np.broadcast_to(y, (self.n, 2))
+        x_pred = self.g(self.x, u)
+        A = self.approx_A(self.x, u)
+        P_pred = A @ self.P @ A.transpose(0, 2, 1) + self.Q
+        C = self.approx_C(x_pred)
+        R = self.R
+        innovation = y - self.h(x_pred)
+        missing = np.isnan(innovation)
+        if missing.any():
+            # Zero rows of C and innovations, and unit uncorrelated noise,
+            # for the missing components give K zero columns for them
+            observed = ~missing
+            C = C * observed[:, :, None]
+            R = R * (observed[:, :, None] & observed[:, None, :])
+            R[:, [0, 1], [0, 1]] += missing
+            innovation[missing] = 0
+        CP = C @ P_pred
+        S = CP @ C.transpose(0, 2, 1) + R
+        # S K^T = C P for every filter; S is 2x2 SPD so a batched LU solve
+        # is as accurate as a Cholesky one and numpy has no batched
+        # triangular solve.
+        K = np.linalg.solve(S, CP).transpose(0, 2, 1)
+        self.x = x_pred + np.einsum('nij,nj->ni', K, innovation)
+        # Joseph form, symmetrized
+        IKC = self._I - K @ C
+        P = IKC @ P_pred @ IKC.transpose(0, 2, 1) \
+            + K @ R @ K.transpose(0, 2, 1)
+        self.P = 0.5 * (P + P.transpose(0, 2, 1))
+        return self.x
+
+    def set_dt(self, dt):
+        """Change the time step of the following updates."""
+        self.dt[:] = dt
+        self.A[:, 0, 3] = self.dt
+        self.A[:, 1, 4] = self.dt
+        self.A[:, 2, 5] = self.dt
+
+    def run(self, data):
+        """Filter a shared (T,11) log or stacked (N,T,11) logs.
+
+        Like Estimator.step, the time steps come from the timestamps and
+        NaN inputs are held from the previous row.
+
+        Returns
+        -------
+        x_hat : ndarray
+            Estimated states, shape (N,T,6), starting with x0.
+        """
+        data = np.asarray(data)
+        T = data.shape[-2]
+        u = hold(data[..., 7:9])
+        dt = step_sizes(data[..., 0], data[..., -1:, 0] / T)
+        x_hat = np.empty((self.n, T, 6))
+        x_hat[:, 0] = self.x
+        for k in range(1, T):
+            x_hat[:, k] = self.update(u[..., k, :], data[..., k, 9:11],
+                                      dt[..., k - 1])
+        return x_hat
 
     def g(self, x, u):
-        # Dynamics model
-        f = np.hstack((x[3:], [0, -self.gr, 0])) + np.array(([0, 0],
-                                                             [0, 0],
-                                                             [0, 0],
-                                                             [-np.sin(x[2])/self.m, 0],
-                                                             [np.cos(x[2])/self.m, 0],
-                                                             [0, 1/self.J])) @ u 
-        
-        return x + f * self.dt
-
-    def h(self, x, y_obs):
-        # Measurement model
-        h = np.array(([np.sqrt((self.landmark[0] - x[0])**2 + self.landmark[1]**2 + (self.landmark[2] - x[1])**2), x[2]]))
-        return h
+        # Dynamics model, x + f(x, u) dt, for every filter
+        phi = x[:, 2]
+        f = np.empty_like(x)
+        f[:, 0:3] = x[:, 3:6]
+        f[:, 3] = -np.sin(phi) / self.m * u[:, 0]
+        f[:, 4] = np.cos(phi) / self.m * u[:, 0] - self.gr
+        f[:, 5] = u[:, 1] / self.J
+        return x + f * self.dt[:, None]
+
+    def h(self, x):
+        # Measurement model, distance to the landmark and bearing
+        distance = np.sqrt((self.landmark[0] - x[:, 0])**2
+                           + self.landmark[1]**2
+                           + (self.landmark[2] - x[:, 1])**2)
+        return np.stack((distance, x[:, 2]), axis=-1)
 
     def approx_A(self, x, u):
         # Linear approx of g w.r.t. x
-        A = np.eye(6)
-        A[0, 3] = self.dt
-        A[1, 4] = self.dt
-        A[2, 5] = self.dt
-        A[3, 2] = -np.cos(x[2]) * u[0] * self.dt / self.m
-        A[4, 2] = -np.sin(x[2]) * u[0] * self.dt / self.m
-        return A
-    
+        self.A[:, 3, 2] = -np.cos(x[:, 2]) * u[:, 0] * self.dt / self.m
+        self.A[:, 4, 2] = -np.sin(x[:, 2]) * u[:, 0] * self.dt / self.m
+        return self.A
+
     def approx_C(self, x):
         # Linear approx of h w.r.t. x
-        distance = np.sqrt((self.landmark[0] - x[0])**2 + self.landmark[1]**2 + (self.landmark[2] - x[1])**2)
-        C = np.zeros((2, 6))
-        C[0, 0] = (x[0] - self.landmark[0]) / distance
-        C[0, 1] = (x[1] - self.landmark[1]) / distance
-        return C
+        distance = np.sqrt((self.landmark[0] - x[:, 0])**2
+                           + self.landmark[1]**2
+                           + (self.landmark[2] - x[:, 1])**2)
+        self.C[:, 0, 0] = (x[:, 0] - self.landmark[0]) / distance
+        self.C[:, 0, 1] = (x[:, 1] - self.landmark[2]) / distance
+        return self.C
@@ -1,22 +1,84 @@
 #!/usr/bin/env python3
 # import rospy
 from drone_estimator import \
-    OracleObserver, DeadReckoning, ExtendedKalmanFilter
+    OracleObserver, DeadReckoning, ExtendedKalmanFilter, \
+    SquareRootExtendedKalmanFilter, ExtendedKalmanSmoother, \
+    UnscentedKalmanFilter, ParticleFilter
+from dataset import DEFAULT_CHUNK_SIZE
+from models import quadrotor
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 import argparse
-
-plt.show(block=True)
+import json
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--estimator', help='the estimator you want to use')
+parser.add_argument('--particles', type=int, default=4096,
+                    help='number of particles (particle filter only)')
+parser.add_argument('--batch', action='store_true',
+                    help='integrate the whole log at once (dead reckoning only)')
+parser.add_argument('--smooth', action='store_true',
+                    help='smooth the whole log after filtering it (ekf only)')
+parser.add_argument('--lag', type=int, default=None,
+                    help='also stream estimates smoothed this many samples behind (ekf only)')
+parser.add_argument('--dtype', choices=('float64', 'float32'), default='float64',
+                    help='floating point type of the filter and its estimates (srekf only)')
+parser.add_argument('--max-iterations', type=int, default=1,
+                    help='measurement updates allowed per step, above 1 to iterate (iekf only)')
+parser.add_argument('--symbolic', action='store_true',
+                    help='use the kernels generated from models.py (ekf family only)')
+parser.add_argument('--input-every', type=int, default=1, metavar='N',
+                    help='keep every Nth input of the log, holding it in between')
+parser.add_argument('--measurement-every', type=int, nargs='+', default=[1],
+                    metavar='N',
+                    help='keep every Nth measurement, or every Nth range and Mth bearing')
+parser.add_argument('--data', default=None,
+                    help='path of the .npy log to run on (default: sample log)')
+parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                    help='number of log rows processed per chunk')
+parser.add_argument('--history-len', type=int, default=None,
+                    help='keep only the most recent samples in memory')
+parser.add_argument('--export', default=None,
+                    help='save t, x, u, y and x_hat to this .npz file')
+parser.add_argument('--headless', action='store_true',
+                    help='run without a display, report metrics and exit')
+parser.add_argument('--metrics', default=None,
+                    help='write the run metrics to this JSON file')
+parser.add_argument('--save-plot', default=None,
+                    help='render the final plot to this image file')
+parser.add_argument('--profile', default=None,
+                    help='write per-stage update latency histograms to this JSON file')
+parser.add_argument('--fps', type=float, default=30,
+                    help='frame rate of the replay window')
+parser.add_argument('--speed', type=float, default=1.0,
+                    help='log seconds replayed per second')
+
 
-def spin(estimator):
+def spin(estimator, batch=False, export=None, headless=False, metrics=None,
+         save_plot=None, profile=None, smooth=False, fps=30, speed=1.0):
     """
     Parameters
     ----------
     estimator : Estimator
         The instance of the estimator
+    batch : bool
+        Whether to run the estimator's vectorized offline mode
+    export : str
+        Path of an .npz file to save the estimator's histories to
+    headless : bool
+        Whether to skip the interactive animation window
+    metrics : str
+        Path of a JSON file to write the run metrics to
+    save_plot : str
+        Path of an image file to render the final plot to
+    profile : str
+        Path of a JSON file to write the per-stage latency summary to
+    smooth : bool
+        Whether to run the estimator's backward smoothing pass after the log
+    fps : float
+        Frame rate of the replay window
+    speed : float
+        Log seconds replayed per second of the replay window
 
     Returns
     -------
@@ -24,11 +86,33 @@ def spin(estimator):
     """
 
     # noinspection PyUnusedLocal
-    estimator.run()
+    if batch:
+        estimator.run_batch()
+    else:
+        estimator.run(profile)
+    if smooth:
+        estimator.smooth()
+        print('Smoothed Mean Squared Error: ', estimator.mean_squared_error())
+    if export is not None:
+        estimator.export(export)
+    if metrics is not None:
+        with open(metrics, 'w') as f:
+            json.dump(estimator.metrics(), f, indent=2)
+    if save_plot is not None:
+        estimator.plot_init()
+        estimator.plot_update(None)
+        estimator.fig.savefig(save_plot)
+    if headless:
+        return
+    # The replay runs at its own frame rate and only blits the lines
     anim = FuncAnimation(
-        estimator.fig,
+        estimator.init_figure(),
         estimator.plot_update,
+        frames=estimator.replay_frames(fps, speed),
         init_func=estimator.plot_init,
+        interval=1000 / fps,
+        blit=True,
+        repeat=False,
         cache_frame_data=False)
     plt.show(block=True)
 
@@ -41,21 +125,58 @@ def main():
         None
     """
     args = parser.parse_args()
+    if args.headless:
+        plt.switch_backend('Agg')
     estimator_type = args.estimator
+    kwargs = {'data_path': args.data, 'chunk_size': args.chunk_size,
+              'history_len': args.history_len,
+              'input_every': args.input_every,
+              'measurement_every': args.measurement_every}
+    if args.symbolic and estimator_type in ('ekf', 'iekf', 'srekf', 'ukf'):
+        kwargs['model'] = quadrotor()
     if estimator_type == 'oracle':
-        estimator = OracleObserver(is_noisy=True)
+        estimator = OracleObserver(is_noisy=True, **kwargs)
     elif estimator_type == 'dr':
-        estimator = DeadReckoning(is_noisy=True)
+        estimator = DeadReckoning(is_noisy=True, **kwargs)
     elif estimator_type == 'kf':
         raise RuntimeError(
             f'Estimator type: {estimator_type} is not supported for the quadrotor!')
+    elif estimator_type == 'ekf' and args.smooth:
+        estimator = ExtendedKalmanSmoother(is_noisy=True, lag=args.lag,
+                                           **kwargs)
     elif estimator_type == 'ekf':
-        estimator = ExtendedKalmanFilter(is_noisy=True)
+        estimator = ExtendedKalmanFilter(is_noisy=True, lag=args.lag,
+                                         **kwargs)
+    elif estimator_type == 'iekf':
+        estimator = ExtendedKalmanFilter(
+            is_noisy=True, lag=args.lag, max_iterations=args.max_iterations,
+            **kwargs)
+    elif estimator_type == 'srekf':
+        estimator = SquareRootExtendedKalmanFilter(
+            is_noisy=True, dtype=args.dtype, lag=args.lag, **kwargs)
+    elif estimator_type == 'ukf':
+        estimator = UnscentedKalmanFilter(is_noisy=True, **kwargs)
+    elif estimator_type == 'pf':
+        estimator = ParticleFilter(is_noisy=True, n_particles=args.particles,
+                                   **kwargs)
     else:
         raise RuntimeError(
             'Estimator type {} not supported'.format(estimator_type))
+    if args.batch and not hasattr(estimator, 'run_batch'):
+        raise RuntimeError(
+            f'Estimator type: {estimator_type} has no batch mode!')
+    if args.lag is not None and estimator.x_lagged is None:
+        raise RuntimeError(
+            f'Estimator type: {estimator_type} has no fixed-lag smoother!')
+    if args.symbolic and 'model' not in kwargs:
+        raise RuntimeError(
+            f'Estimator type: {estimator_type} has no symbolic model!')
+    if args.smooth and not hasattr(estimator, 'smooth'):
+        raise RuntimeError(
+            f'Estimator type: {estimator_type} has no smoother!')
     print('Invoking estimator {}...'.format(estimator_type))
-    spin(estimator)
+    spin(estimator, args.batch, args.export, args.headless, args.metrics,
+         args.save_plot, args.profile, args.smooth, args.fps, args.speed)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,30 @@
+"""Symbolic descriptions of the drone models, see model_compiler.py."""
+from model_compiler import DEFAULT_CACHE_DIR, compile_model
+
+
+def quadrotor_deriv(x, u, p):
+    # Planar quadrotor, x = [x, z, phi, vx, vz, omega] and u = [F, M]
+    import sympy
+    return [x[3],
+            x[4],
+            x[5],
+            -sympy.sin(x[2]) * u[0] / p['m'],
+            sympy.cos(x[2]) * u[0] / p['m'] - p['gr'],
+            u[1] / p['J']]
+
+
+def quadrotor_measure(x, p):
+    # Distance to the landmark and bearing
+    import sympy
+    lx, ly, lz = p['landmark']
+    return [sympy.sqrt((lx - x[0])**2 + ly**2 + (lz - x[1])**2),
+            x[2]]
+
+
+def quadrotor(m=0.92, J=0.0023, gr=9.81, landmark=(0, 5, 5),
+              cache_dir=DEFAULT_CACHE_DIR):
+    """Compiled quadrotor model with the estimators' default parameters."""
+    return compile_model('quadrotor', 6, 2, quadrotor_deriv,
+                         quadrotor_measure,
+                         {'m': m, 'J': J, 'gr': gr, 'landmark': tuple(landmark)},
+                         cache_dir)
@@ -0,0 +1,109 @@
+import json
+from time import perf_counter_ns
+import numpy as np
+from history import History
+
+
+class StageTimer:
+    """Per-stage latency recorder for estimator updates.
+
+    An update calls start() once, lap(stage) at the end of each stage and
+    stop() when it is done. Time between consecutive marks is charged to the
+    named stage, and a stage lapped several times in one update is summed.
+    stop() also records the whole update under 'total'. All timestamps come
+    from perf_counter_ns and samples are kept as int64 nanoseconds.
+
+    With maxlen, samples and counts are ring buffers holding the last
+    maxlen updates, so a long run takes bounded memory and seconds and
+    summary describe that recent window.
+
+    Attributes:
+    ----------
+        maxlen : int or None
+            Number of most recent updates retained, None for unbounded.
+        samples : dict
+            Maps a stage name to a History of per-update durations (ns).
+        counts : dict
+            Maps a counter name to a History of per-update integer counts,
+            recorded with count().
+    """
+    def __init__(self, maxlen=None):
+        self.maxlen = maxlen
+        self.samples = {}
+        self.counts = {}
+        self._pending = {}
+        self._start = 0
+        self._last = 0
+
+    def start(self):
+        self._start = self._last = perf_counter_ns()
+
+    def lap(self, stage):
+        now = perf_counter_ns()
+        self._pending[stage] = self._pending.get(stage, 0) + now - self._last
+        self._last = now
+
+    def count(self, name, value):
+        """Record an integer per-update quantity, e.g. an iteration count."""
+        self._record(self.counts, name, value)
+
+    def stop(self):
+        now = perf_counter_ns()
+        for stage, elapsed in self._pending.items():
+            self._record(self.samples, stage, elapsed)
+        self._pending.clear()
+        self._record(self.samples, 'total', now - self._start)
+        return now - self._start
+
+    def seconds(self, stage='total'):
+        """Durations of a stage in seconds, one entry per retained update."""
+        if stage not in self.samples:
+            return np.zeros(0)
+        return self.samples[stage].view() * 1e-9
+
+    def summary(self):
+        """Latency percentiles and log2 histograms of every stage.
+
+        Returns
+        -------
+        summary : dict
+            JSON-serializable dict with an entry per stage holding count,
+            mean, p50, p90, p99 and max in microseconds, plus histogram bin
+            edges (us) and counts. Counters are summarized the same way,
+            without units.
+        """
+        stages = {stage: self._describe(h.view() / 1e3, histogram=True)
+                  for stage, h in self.samples.items()}
+        counts = {name: self._describe(h.view(), histogram=False)
+                  for name, h in self.counts.items()}
+        return {'unit': 'us', 'stages': stages, 'counters': counts}
+
+    def to_json(self, path=None):
+        text = json.dumps(self.summary(), indent=2)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    # noinspection PyMethodMayBeStatic
+    def _record(self, table, name, value):
+        if name not in table:
+            table[name] = History(dtype=np.int64, maxlen=self.maxlen)
+        table[name].append(value)
+
+    # noinspection PyMethodMayBeStatic
+    def _describe(self, values, histogram):
+        if len(values) == 0:
+            return {'count': 0}
+        p50, p90, p99 = np.percentile(values, [50, 90, 99])
+        result = {'count': int(len(values)), 'mean': float(np.mean(values)),
+                  'p50': float(p50), 'p90': float(p90), 'p99': float(p99),
+                  'max': float(np.max(values))}
+        if histogram:
+            top = max(np.ceil(np.log2(max(result['max'], 1e-3))), -3)
+            edges = 2.0 ** np.arange(-4, top + 1)
+            edges[0] = 0
+            hist, _ = np.histogram(values, bins=edges)
+            result['histogram'] = {'edges': edges.tolist(),
+                                   'counts': hist.tolist()}
+        return result
@@ -12,7 +12,8 @@ class Sphere:
     Draws a sphere at a given position.
     '''
 
-    def __init__(self, ax, r, c='b', x0=np.array([0, 0, 0]).T, resolution=20):
+    def __init__(self, ax, r, c='b', x0=np.array([0, 0, 0]).T, resolution=20,
+        retained=False):
         '''
         Initialize the sphere.
 
@@ -23,6 +24,9 @@ class Sphere:
             x0: (3x1 numpy.ndarray) initial position of the sphere, default
                 is [0, 0, 0]
             resolution: (int) resolution of the plot, default 20
+            retained: (bool) flag to draw the surface once and move it in
+                the following calls of draw_at, instead of adding a new
+                surface each time, default False
 
         Returns:
             None
@@ -33,6 +37,24 @@ class Sphere:
         self.color = c
         self.x0 = x0
         self.reso = resolution
+        self.retained = retained
+
+        # Mesh of the sphere centered at the origin, and the polygons of
+        # the surface drawn in retained mode
+        self.mesh = None
+        self.polys = None
+        self.surface = None
+
+
+    def _mesh(self):
+        if self.mesh is None:
+            vertices = np.linspace(0, 2*np.pi, self.reso+1)
+            u, v = np.meshgrid(vertices, vertices)
+
+            self.mesh = np.array([self.r * np.cos(u) * np.sin(v),
+                                  self.r * np.sin(u) * np.sin(v),
+                                  self.r * np.cos(v)])
+        return self.mesh
     
 
     def draw(self):
@@ -69,14 +91,68 @@ class Sphere:
             None
         '''
 
-        vertices = np.linspace(0, 2*np.pi, self.reso+1)
-        u, v = np.meshgrid(vertices, vertices)
+        position = np.ravel(position)
+        if self.surface is not None:
+            # Only move the polygons of the existing surface
+            self.surface.set_verts(self.polys + position)
+            return
 
-        x = self.r * np.cos(u) * np.sin(v) + position[0]
-        y = self.r * np.sin(u) * np.sin(v) + position[1]
-        z = self.r * np.cos(v) + position[2]
+        x, y, z = self._mesh() + position[:, None, None]
+
+        if not self.retained:
+            self.ax.plot_surface(x, y, z, color=self.color)
+            return
+
+        # One polygon per mesh cell, in the order plot_surface makes them
+        # with unit strides, so that their shading still applies
+        mesh = self._mesh().transpose(1, 2, 0)
+        self.polys = np.stack((mesh[:-1, :-1], mesh[:-1, 1:],
+                               mesh[1:, 1:], mesh[1:, :-1]),
+                              axis=2).reshape(-1, 4, 3)
+        self.surface = self.ax.plot_surface(x, y, z, color=self.color,
+                                            rstride=1, cstride=1)
 
-        self.ax.plot_surface(x, y, z, color=self.color)
+
+
+def arrow_segments(x, u, length=1.0, arrow_length_ratio=0.3):
+    '''
+    Line segments of the arrow Axes3D.quiver draws from x along u, with its
+    default pivot and head angle, so that an existing quiver can be moved.
+
+    Args:
+        x: (3x1 numpy.ndarray) origin of the arrow
+        u: (3x1 numpy.ndarray) direction of the arrow, not normalized
+        length: (float) length the direction is scaled by, default = 1.0
+        arrow_length_ratio: (float) length of the head relative to the
+            arrow, default = 0.3
+
+    Returns:
+        segments: (3x2x3 numpy.ndarray) shaft and both sides of the head,
+            each from the tip
+    '''
+
+    x = np.ravel(x).astype(float)
+    u = np.ravel(u).astype(float)
+    tip = x + length * u
+
+    # Unit vector perpendicular to u in the horizontal plane, which the
+    # head is rotated about by +-15 degrees
+    norm = np.hypot(u[0], u[1])
+    x_p, y_p = (u[1] / norm, -u[0] / norm) if norm != 0 else (0.0, 1.0)
+    c = np.cos(np.radians(15))
+    s = np.sin(np.radians(15))
+    r12 = x_p * y_p * (1 - c)
+    R = np.array([[c + x_p**2 * (1 - c), r12, y_p * s],
+                  [r12, c + y_p**2 * (1 - c), -x_p * s],
+                  [-y_p * s, x_p * s, c]])
+    # The opposite rotation negates the sine terms
+    R_neg = R.copy()
+    R_neg[[0, 1, 2, 2], [2, 2, 0, 1]] *= -1
+
+    head = length * arrow_length_ratio
+    return np.array([[tip, x],
+                     [tip, tip - head * (R @ u)],
+                     [tip, tip - head * (R_neg @ u)]])
 
 
 
@@ -86,7 +162,7 @@ class Arrow:
     '''
 
     def __init__(self, ax, direction, c='b', x0=np.array([0.0, 0.0, 0.0]).T, \
-        length=1.0):
+        length=1.0, retained=False):
         '''
         Initialize the arrow.
 
@@ -97,6 +173,8 @@ class Arrow:
             x0: (3x1 numpy.ndarray) origin of the arrow, 
                 default = [0.0, 0.0, 0.0]
             length: (float) length of the arrow, default = 1.0
+            retained: (bool) flag to draw the arrow once and move it in
+                the following calls of draw_from_to, default False
 
         Returns:
             None
@@ -107,6 +185,8 @@ class Arrow:
         self.color = c
         self.x0 = x0
         self.arrow_length = length
+        self.retained = retained
+        self.quiver = None
     
 
     def draw(self):
@@ -145,13 +225,21 @@ class Arrow:
         Returns:
             None
         '''
+
+        if self.quiver is not None:
+            self.quiver.set_segments(
+                arrow_segments(x, u, self.arrow_length))
+            return
         
-        self.ax.quiver(x[0], x[1], x[2], \
+        quiver = self.ax.quiver(x[0], x[1], x[2], \
             u[0], u[1], u[2], \
             color=self.color,
             length=self.arrow_length, \
             normalize=False)
 
+        if self.retained:
+            self.quiver = quiver
+
 
 
 class Line:
@@ -160,7 +248,7 @@ class Line:
     '''
 
     def __init__(self, ax, c='b', x0=np.array([0.0, 0.0, 0.0]).T, \
-        x1=np.array([1.0, 0.0, 0.0]).T):
+        x1=np.array([1.0, 0.0, 0.0]).T, retained=False):
         '''
         Initialize the line.
         Params:
@@ -170,6 +258,8 @@ class Line:
                 default = [0.0, 0.0, 0.0]
             x1: (3x1 numpy.ndarray) end of the line, 
                 default = [1.0, 0.0, 0.0]
+            retained: (bool) flag to draw the line once and move it in
+                the following calls of draw_from_to, default False
                 
         Returns:
             None
@@ -179,6 +269,8 @@ class Line:
         self.color = c
         self.x0 = x0
         self.x1 = x1
+        self.retained = retained
+        self.line = None
     
 
     def draw(self):
@@ -211,12 +303,21 @@ class Line:
         Returns:
             None
         '''
+
+        if self.line is not None:
+            self.line.set_data_3d([x0[0], x1[0]], \
+                [x0[1], x1[1]], \
+                [x0[2], x1[2]])
+            return
         
-        self.ax.plot([x0[0], x1[0]], \
+        line, = self.ax.plot([x0[0], x1[0]], \
             [x0[1], x1[1]], \
             [x0[2], x1[2]], \
             color=self.color)
 
+        if self.retained:
+            self.line = line
+
 
 class Plane:
     '''
@@ -8,13 +8,19 @@ class Uav:
     Draws a quadrotor at a given position, with a given attitude.
     '''
 
-    def __init__(self, ax, arm_length, scaling_factor = 1):
+    def __init__(self, ax, arm_length, scaling_factor = 1, retained=False,
+        resolution=20):
         '''
         Initialize the quadrotr plotting parameters.
 
         Params:
             ax: (matplotlib axis) the axis where the sphere should be drawn
             arm_length: (float) length of the quadrotor arm
+            retained: (bool) flag to draw the quadrotor once and move its
+                artists in the following calls of draw_at, instead of
+                clearing the axis and drawing it again, default False
+            resolution: (int) resolution of the body and motor spheres,
+                default 20
 
         Returns:
             None
@@ -22,28 +28,34 @@ class Uav:
 
         self.ax = ax
         self.arm_length = arm_length
+        self.retained = retained
 
         self.b1 = np.array([1.0, 0.0, 0.0]).T
         self.b2 = np.array([0.0, 1.0, 0.0]).T
         self.b3 = np.array([0.0, 0.0, 1.0]).T
 
         # Center of the quadrotor
-        self.body = Sphere(self.ax, 0.08 * scaling_factor, 'y')
+        self.body = Sphere(self.ax, 0.08 * scaling_factor, 'y',
+                           resolution=resolution, retained=retained)
 
         # Each motor
-        self.motor1 = Sphere(self.ax, 0.05 * scaling_factor, 'r')
-        self.motor2 = Sphere(self.ax, 0.05 * scaling_factor, 'g')
-        self.motor3 = Sphere(self.ax, 0.05 * scaling_factor, 'b')
-        self.motor4 = Sphere(self.ax, 0.05 * scaling_factor, 'b')
+        self.motor1 = Sphere(self.ax, 0.05 * scaling_factor, 'r',
+                             resolution=resolution, retained=retained)
+        self.motor2 = Sphere(self.ax, 0.05 * scaling_factor, 'g',
+                             resolution=resolution, retained=retained)
+        self.motor3 = Sphere(self.ax, 0.05 * scaling_factor, 'b',
+                             resolution=resolution, retained=retained)
+        self.motor4 = Sphere(self.ax, 0.05 * scaling_factor, 'b',
+                             resolution=resolution, retained=retained)
 
         # Arrows for the each body axis
-        self.arrow_b1 = Arrow(ax, self.b1, 'r')
-        self.arrow_b2 = Arrow(ax, self.b2, 'g')
-        self.arrow_b3 = Arrow(ax, self.b3, 'b')
+        self.arrow_b1 = Arrow(ax, self.b1, 'r', retained=retained)
+        self.arrow_b2 = Arrow(ax, self.b2, 'g', retained=retained)
+        self.arrow_b3 = Arrow(ax, self.b3, 'b', retained=retained)
 
         # Quadrotor arms
-        self.arm_b1 = Line(ax)
-        self.arm_b2 = Line(ax)    
+        self.arm_b1 = Line(ax, retained=retained)
+        self.arm_b2 = Line(ax, retained=retained)
 
     def draw_at(self, x=np.array([0.0, 0.0, 0.0]).T, R=np.eye(3)):
         '''
@@ -59,8 +71,10 @@ class Uav:
             None
         '''
 
-        # First, clear the axis of all the previous plots
-        self.ax.clear()
+        # First, clear the axis of all the previous plots, unless they are
+        # moved in place
+        if not self.retained:
+            self.ax.clear()
 
         # Center of the quadrotor
         self.body.draw_at(x)
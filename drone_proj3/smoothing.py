@@ -0,0 +1,170 @@
+import functools
+import numpy as np
+
+
+@functools.lru_cache(maxsize=None)
+def _triu(n):
+    return np.triu_indices(n)
+
+
+def packed_size(n):
+    """Number of entries of the packed upper triangle of an n by n matrix."""
+    return n * (n + 1) // 2
+
+
+def pack(P, out=None):
+    """Packed upper triangle of a symmetric matrix, row by row.
+
+    Parameters
+    ----------
+    P : ndarray
+        Symmetric (..., n, n) matrix.
+    out : ndarray
+        Optional (..., n(n+1)/2) array to write to.
+
+    Returns
+    -------
+    packed : ndarray
+        The n(n+1)/2 upper triangular entries of P.
+    """
+    rows, cols = _triu(P.shape[-1])
+    if out is None:
+        return P[..., rows, cols]
+    out[...] = P[..., rows, cols]
+    return out
+
+
+def unpack(packed, n, out=None):
+    """Symmetric matrix from its packed upper triangle, see pack."""
+    rows, cols = _triu(n)
+    if out is None:
+        out = np.empty(packed.shape[:-1] + (n, n), dtype=packed.dtype)
+    out[..., rows, cols] = packed
+    out[..., cols, rows] = packed
+    return out
+
+
+class FixedLagSmoother:
+    """Streaming fixed-lag Rauch-Tung-Striebel smoother.
+
+    Each filtered estimate pushed in returns the smoothed estimate of the
+    sample lag steps earlier. One RTS backward step from sample k + 1 to k
+    is the affine map
+
+        x_s[k] = G x_s[k+1] + (x_f[k] - G x_pred[k+1])
+        P_s[k] = G P_s[k+1] G^T + (P_f[k] - G P_pred[k+1] G^T)
+
+    with gain G = P_f[k] A^T P_pred[k+1]^-1, which is known as soon as
+    sample k + 1 is filtered. Smoothing over the window is the composition
+    of its last lag maps. The maps are kept in a two-stack queue of
+    partial compositions, so every push costs a constant number of n by n
+    products, amortized, instead of a backward pass over the window.
+    Memory is fixed at about three lag by n by n arrays.
+
+    Attributes:
+    ----------
+        n : int
+            State dimension.
+        lag : int
+            Number of samples L between a filtered estimate and the
+            smoothed estimate emitted with it.
+        total : int
+            Number of estimates pushed.
+    """
+    def __init__(self, n, lag):
+        if lag < 1:
+            raise ValueError('lag must be positive')
+        self.n = n
+        self.lag = lag
+        self.total = 0
+        self._x = np.zeros(n)
+        self._P = np.zeros((n, n))
+        # Newest maps in push order, plus their composition
+        self._back_G = np.zeros((lag, n, n))
+        self._back_c = np.zeros((lag, n))
+        self._back_D = np.zeros((lag, n, n))
+        self._back_len = 0
+        self._agg = self._identity()
+        # Older maps as compositions from each map to the newest of them,
+        # the oldest on top
+        self._front_G = np.zeros((lag, n, n))
+        self._front_c = np.zeros((lag, n))
+        self._front_D = np.zeros((lag, n, n))
+        self._front_len = 0
+
+    def __len__(self):
+        return self._front_len + self._back_len
+
+    def push(self, x, P, A=None, x_pred=None, P_pred=None):
+        """Add the filtered estimate of a new sample.
+
+        Parameters
+        ----------
+        x, P : ndarray
+            Filtered state and covariance of the new sample.
+        A : ndarray
+            Dynamics Jacobian of the prediction from the previous sample.
+        x_pred, P_pred : ndarray
+            Predicted state and covariance of the new sample before its
+            measurement update. A, x_pred and P_pred are ignored for the
+            first sample.
+
+        Returns
+        -------
+        smoothed : tuple or None
+            Smoothed state and covariance of the sample lag steps before
+            this one, or None while fewer than lag + 1 samples were pushed.
+        """
+        if self.total > 0:
+            # Gain of the backward step to the previous sample, solved as
+            # P_pred G^T = A P_f
+            AP = A @ self._P
+            G = np.linalg.solve(P_pred, AP).T
+            c = self._x - G @ x_pred
+            D = self._P - G @ P_pred @ G.T
+            if len(self) == self.lag:
+                self._pop_front()
+            self._push_back(G, c, D)
+        self._x[:] = x
+        self._P[:] = P
+        self.total += 1
+        if self.total <= self.lag:
+            return None
+        G, c, D = self._agg
+        if self._front_len:
+            top = self._front_len - 1
+            G, c, D = self._compose(
+                self._front_G[top], self._front_c[top], self._front_D[top],
+                G, c, D)
+        return G @ self._x + c, G @ self._P @ G.T + D
+
+    def _push_back(self, G, c, D):
+        i = self._back_len
+        self._back_G[i] = G
+        self._back_c[i] = c
+        self._back_D[i] = D
+        self._back_len += 1
+        self._agg = self._compose(*self._agg, G, c, D)
+
+    def _pop_front(self):
+        if self._front_len == 0:
+            # Move the back stack over, newest first, so that each entry
+            # composes its map with every newer one
+            agg = self._identity()
+            for i in range(self._back_len - 1, -1, -1):
+                agg = self._compose(self._back_G[i], self._back_c[i],
+                                    self._back_D[i], *agg)
+                j = self._front_len
+                self._front_G[j], self._front_c[j], self._front_D[j] = agg
+                self._front_len += 1
+            self._back_len = 0
+            self._agg = self._identity()
+        self._front_len -= 1
+
+    def _identity(self):
+        return np.eye(self.n), np.zeros(self.n), np.zeros((self.n, self.n))
+
+    @staticmethod
+    def _compose(G1, c1, D1, G2, c2, D2):
+        # Map 1 applied after map 2
+        return G1 @ G2, G1 @ c2 + c1, G1 @ D2 @ G1.T + D1
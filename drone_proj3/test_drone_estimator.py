@@ -0,0 +1,43 @@
+"""Regression tests of the drone estimators, run with pytest."""
+import contextlib
+import io
+
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+
+from dataset import default_path, load_dataset, decimate
+from drone_estimator import \
+    DeadReckoning, ExtendedKalmanFilter, BatchedExtendedKalmanFilter
+from tuning import SEARCH_SPACE, evaluate, evaluate_batch, random_search
+
+
+def run_quietly(run):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return run()
+
+
+def test_batch_dead_reckoning_with_history_len():
+    full = DeadReckoning()
+    run_quietly(full.run_batch)
+    bounded = DeadReckoning(history_len=100)
+    run_quietly(bounded.run_batch)
+    assert len(bounded.x_hat) == len(bounded.u) == 100
+    np.testing.assert_array_equal(bounded.x_hat.view(),
+                                  full.x_hat.view()[-100:])
+    np.testing.assert_array_equal(bounded.u.view(), full.u.view()[-100:])
+
+
+def test_batched_ekf_matches_serial_on_multi_rate_log():
+    data = decimate(load_dataset(default_path(True)), 3, (10, 1))
+    ekf = ExtendedKalmanFilter(data_path=data)
+    run_quietly(ekf.run)
+    batched = BatchedExtendedKalmanFilter.from_data(data)
+    x_hat = batched.run(data)
+    np.testing.assert_allclose(x_hat[0], ekf.x_hat.view(), atol=1e-9)
+
+    configs = list(random_search(SEARCH_SPACE, 3))
+    serial = [evaluate(config, data) for config in configs]
+    for a, b in zip(serial, evaluate_batch(configs, data)):
+        assert np.isfinite(b['mse'])
+        np.testing.assert_allclose(b['mse'], a['mse'], rtol=1e-9)
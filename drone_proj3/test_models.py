@@ -0,0 +1,97 @@
+"""Parity of the generated model kernels with the hand-written models, run
+with pytest."""
+import functools
+
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import pytest
+
+from benchmark import import_turtlebot, make_turtlebot_log, turtlebot_case
+from drone_estimator import ExtendedKalmanFilter
+from models import quadrotor
+
+
+@pytest.fixture(scope='module')
+def cache_dir(tmp_path_factory):
+    # Compile from scratch rather than trust a stale user cache
+    return str(tmp_path_factory.mktemp('models'))
+
+
+@pytest.fixture(scope='module')
+def turtlebot():
+    return import_turtlebot()
+
+
+def finite_difference(f, x, eps=1e-6):
+    columns = []
+    for i in range(len(x)):
+        dx = np.zeros(len(x))
+        dx[i] = eps
+        columns.append((f(x + dx) - f(x - dx)) / (2 * eps))
+    return np.column_stack(columns)
+
+
+def check_jacobians(model, x, u, dt):
+    np.testing.assert_allclose(
+        model.approx_A(x, u, dt),
+        finite_difference(lambda x: model.g(x, u, dt), x), atol=1e-7)
+    np.testing.assert_allclose(
+        model.approx_C(x), finite_difference(model.h, x), atol=1e-7)
+
+
+def test_quadrotor_matches_hand_written_ekf(cache_dir):
+    model = quadrotor(cache_dir=cache_dir)
+    ekf = ExtendedKalmanFilter()
+    rng = np.random.default_rng(0)
+    for _ in range(10):
+        x = rng.normal(0, 1, 6)
+        u = rng.normal([9, 0], [1, 0.01])
+        np.testing.assert_allclose(model.g(x, u, ekf.dt), ekf.g(x, u),
+                                   rtol=1e-12, atol=1e-12)
+        np.testing.assert_allclose(model.approx_A(x, u, ekf.dt),
+                                   ekf.approx_A(x, u), rtol=1e-12, atol=1e-12)
+        np.testing.assert_allclose(model.h(x), ekf.h(x, None), rtol=1e-12)
+        np.testing.assert_allclose(model.approx_C(x), ekf.approx_C(x),
+                                   rtol=1e-12, atol=1e-12)
+        check_jacobians(model, x, u, ekf.dt)
+
+
+def test_frozen_bearing_matches_kalman_filter(turtlebot, cache_dir):
+    model = turtlebot.frozen_bearing(cache_dir=cache_dir)
+    kf = turtlebot.KalmanFilter()
+    np.testing.assert_allclose(model.approx_A(np.zeros(4), np.zeros(2), kf.dt),
+                               kf.A)
+    np.testing.assert_allclose(model.approx_C(np.zeros(4)), kf.C)
+    rng = np.random.default_rng(0)
+    for _ in range(10):
+        x = rng.normal(0, 1, 4)
+        u = rng.normal(0, 1, 2)
+        np.testing.assert_allclose(model.g(x, u, kf.dt),
+                                   kf.A @ x + kf.B @ u, atol=1e-12)
+        check_jacobians(model, x, u, kf.dt)
+
+
+def test_unicycle_jacobians(turtlebot, cache_dir):
+    model = turtlebot.unicycle(cache_dir=cache_dir)
+    rng = np.random.default_rng(0)
+    for _ in range(10):
+        check_jacobians(model, rng.normal(0, 1, 5), rng.normal(0, 1, 2), 0.1)
+
+
+@pytest.mark.parametrize('name', ['DeadReckoning', 'KalmanFilter'])
+def test_symbolic_turtlebot_estimators_match(turtlebot, cache_dir,
+                                             monkeypatch, name):
+    log = make_turtlebot_log(200)
+    log[1][:, 2] *= 1.5  # Turn, so the unicycle's bearing changes
+    hand_written, _ = turtlebot_case(turtlebot, name, log)()
+    for build in ('frozen_bearing', 'unicycle'):
+        monkeypatch.setattr(turtlebot, build, functools.partial(
+            getattr(turtlebot, build), cache_dir=cache_dir))
+    monkeypatch.setattr(turtlebot.rospy, 'get_param',
+                        lambda param, default=None:
+                        True if param == '~symbolic' else default)
+    generated, _ = turtlebot_case(turtlebot, name, log)()
+    assert generated.model is not None
+    np.testing.assert_allclose(generated.x_hat.view(),
+                               hand_written.x_hat.view(), atol=1e-12)
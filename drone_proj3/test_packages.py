@@ -0,0 +1,20 @@
+"""Consistency checks between the drone and turtlebot packages, run with pytest."""
+import os
+
+import pytest
+
+from benchmark import SHARED_MODULES, TURTLEBOT_SRC
+
+DRONE_SRC = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.mark.parametrize('name', SHARED_MODULES)
+def test_shared_module_copies_are_identical(name):
+    # Each package must run on its own, so the shared modules are copied
+    # rather than imported across packages; fix both copies together.
+    with open(os.path.join(DRONE_SRC, f'{name}.py'), 'rb') as f:
+        drone = f.read()
+    with open(os.path.join(TURTLEBOT_SRC, f'{name}.py'), 'rb') as f:
+        turtlebot = f.read()
+    assert drone == turtlebot, \
+        f'{name}.py differs between drone_proj3 and the turtlebot package'
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""Parallel Q/R/P0 tuning sweep for the ExtendedKalmanFilter.
+
+The noise covariances are diagonal and described by seven scales: q_pos
+(x, z), q_phi, q_vel (vx, vz), q_omega, r_range, r_bearing and p0. Each
+scale takes a list of candidate values. The sweep evaluates either their
+full grid or a log-uniform random search within the listed range. The log
+is copied once into shared memory and every worker process attaches to it
+instead of receiving a pickled copy.
+
+Configurations are ranked by MSE or by consistency, i.e. how close the
+average normalized estimation error squared (ANEES) is to the state
+dimension.
+
+Example
+----------
+    $ python tuning.py --set q_pos=1e-6,1e-4,1e-2 r_range=1e-4,1e-2 --top 5
+    $ python tuning.py --random 128 --rank-by consistency --out sweep.json
+    $ python tuning.py --random 1024 --batch-size 64
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+
+from dataset import default_path, load_dataset, iter_chunks, step_sizes, hold
+from drone_estimator import \
+    ExtendedKalmanFilter, BatchedExtendedKalmanFilter
+
+SEARCH_SPACE = {
+    'q_pos': [1e-6, 1e-4, 1e-2],
+    'q_phi': [1e-6, 1e-4, 1e-2],
+    'q_vel': [1e-6, 1e-4, 1e-2],
+    'q_omega': [1e-6, 1e-4, 1e-2],
+    'r_range': [1e-4, 1e-2, 1],
+    'r_bearing': [1e-4, 1e-2, 1],
+    'p0': [1e-2, 1],
+}
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--data', default=default_path(True),
+                    help='path of the .npy log to tune on')
+parser.add_argument('--set', nargs='+', default=[], metavar='KEY=V1,V2',
+                    help='candidate values of a scale, overriding the default space')
+parser.add_argument('--random', type=int, default=None,
+                    help='evaluate this many log-uniform random samples instead of the grid')
+parser.add_argument('--seed', type=int, default=0,
+                    help='seed of the random search')
+parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                    help='number of worker processes')
+parser.add_argument('--batch-size', type=int, default=1,
+                    help='configurations run together by BatchedExtendedKalmanFilter')
+parser.add_argument('--rank-by', choices=('mse', 'consistency'), default='mse',
+                    help='ranking criterion')
+parser.add_argument('--top', type=int, default=10,
+                    help='number of configurations printed')
+parser.add_argument('--out', default=None,
+                    help='write every evaluated configuration to this JSON file')
+
+# Set in each worker by _attach
+_data = None
+_shm = None
+
+
+def covariances(config):
+    """Build Q, R and P0 from a configuration of diagonal scales."""
+    Q = np.diag([config['q_pos'], config['q_pos'], config['q_phi'],
+                 config['q_vel'], config['q_vel'], config['q_omega']])
+    R = np.diag([config['r_range'], config['r_bearing']])
+    P0 = np.eye(6) * config['p0']
+    return Q, R, P0
+
+
+def grid(space):
+    keys = list(space)
+    for values in itertools.product(*(space[key] for key in keys)):
+        yield dict(zip(keys, values))
+
+
+def random_search(space, samples, seed=0):
+    rng = np.random.default_rng(seed)
+    for _ in range(samples):
+        yield {key: float(np.exp(rng.uniform(np.log(min(values)),
+                                             np.log(max(values)))))
+               for key, values in space.items()}
+
+
+def evaluate(config, data):
+    """Run the EKF with one configuration and score it.
+
+    Returns
+    -------
+    result : dict
+        The configuration with its mse, anees (average NEES) and
+        consistency, |log(anees / 6)|, which is 0 for a consistent filter.
+        Diverged runs score inf.
+    """
+    Q, R, P0 = covariances(config)
+    ekf = ExtendedKalmanFilter(data_path=data, Q=Q, R=R, P0=P0)
+    nees = 0.0
+    try:
+        with np.errstate(all='ignore'):
+            for chunk in iter_chunks(data, ekf.chunk_size):
+                for row in chunk:
+                    ekf.step(row)
+                    e = ekf.x[-1] - ekf.x_hat[-1]
+                    nees += e @ np.linalg.solve(ekf.P, e)
+        mse = float(ekf.mean_squared_error())
+        anees = nees / len(ekf.x_hat)
+    except np.linalg.LinAlgError:
+        mse = anees = np.inf
+    if not np.isfinite(mse) or not np.isfinite(anees):
+        mse = anees = np.inf
+    consistency = abs(np.log(anees / 6)) if np.isfinite(anees) else np.inf
+    return dict(config, mse=mse, anees=float(anees),
+                consistency=float(consistency))
+
+
+def evaluate_batch(configs, data):
+    """Score several configurations at once with the batched EKF.
+
+    Returns
+    -------
+    results : list
+        One result dict per configuration, as returned by evaluate.
+    """
+    if len(configs) == 1:
+        return [evaluate(configs[0], data)]
+    Q, R, P0 = (np.stack(M) for M in zip(*map(covariances, configs)))
+    data = np.asarray(data)
+    ekf = BatchedExtendedKalmanFilter.from_data(data, Q=Q, R=R, P0=P0)
+    # Time steps and held inputs as the serial EKF takes them, see run
+    u = hold(data[:, 7:9])
+    dt = step_sizes(data[:, 0], ekf.dt[0])
+    squared_error = np.zeros(ekf.n)
+    nees = np.zeros(ekf.n)
+    try:
+        with np.errstate(all='ignore'):
+            for k in range(1, data.shape[0]):
+                x_hat = ekf.update(u[k], data[k, 9:11], dt[k - 1])
+                e = data[k, 1:7] - x_hat
+                squared_error += np.einsum('ni,ni->n', e, e)
+                nees += np.einsum(
+                    'ni,ni->n', e, np.linalg.solve(ekf.P, e[..., None])[..., 0])
+    except np.linalg.LinAlgError:
+        return [evaluate(config, data) for config in configs]
+    mse = squared_error / (6 * data.shape[0])
+    anees = nees / data.shape[0]
+    results = []
+    for config, mse_i, anees_i in zip(configs, mse, anees):
+        if not np.isfinite(mse_i) or not np.isfinite(anees_i):
+            mse_i = anees_i = np.inf
+        consistency = abs(np.log(anees_i / 6)) \
+            if np.isfinite(anees_i) else np.inf
+        results.append(dict(config, mse=float(mse_i), anees=float(anees_i),
+                            consistency=float(consistency)))
+    return results
+
+
+def _attach(name, shape, dtype):
+    global _data, _shm
+    _shm = shared_memory.SharedMemory(name=name)
+    _data = np.ndarray(shape, dtype=dtype, buffer=_shm.buf)
+    _data.flags.writeable = False
+
+
+def _evaluate_shared(configs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return evaluate_batch(configs, _data)
+
+
+def sweep(data, configs, workers, batch_size=1):
+    """Evaluate configurations in parallel over a shared copy of data.
+
+    Parameters
+    ----------
+    data : ndarray
+        The (N,11) log.
+    configs : iterable
+        Configurations as dicts of the SEARCH_SPACE keys.
+    workers : int
+        Number of worker processes.
+    batch_size : int
+        Number of configurations each task runs together through
+        BatchedExtendedKalmanFilter.
+
+    Returns
+    -------
+    results : list
+        One result dict per configuration, in order.
+    """
+    data = np.asarray(data)
+    shm = shared_memory.SharedMemory(create=True, size=data.nbytes)
+    try:
+        np.ndarray(data.shape, dtype=data.dtype, buffer=shm.buf)[:] = data
+        configs = list(configs)
+        batches = [configs[i:i + batch_size]
+                   for i in range(0, len(configs), batch_size)]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach,
+                                 initargs=(shm.name, data.shape,
+                                           data.dtype.str)) as pool:
+            chunksize = max(1, len(batches) // (4 * workers))
+            return [result for results in
+                    pool.map(_evaluate_shared, batches, chunksize=chunksize)
+                    for result in results]
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def parse_space(overrides):
+    space = dict(SEARCH_SPACE)
+    for item in overrides:
+        key, _, values = item.partition('=')
+        if key not in space:
+            raise ValueError(f'Unknown scale {key}, expected one of '
+                             f'{", ".join(space)}')
+        space[key] = [float(v) for v in values.split(',')]
+    return space
+
+
+def main():
+    """Entry point of the tuning sweep.
+
+    Returns
+    -------
+        None
+    """
+    args = parser.parse_args()
+    space = parse_space(args.set)
+    if args.random is None:
+        configs = grid(space)
+    else:
+        configs = random_search(space, args.random, args.seed)
+    data = load_dataset(args.data)
+    results = sweep(data, configs, args.workers, args.batch_size)
+    results.sort(key=lambda result: (result[args.rank_by], result['mse']))
+    keys = list(space)
+    print(''.join(f'{key:>11}' for key in keys)
+          + f"{'MSE':>12}{'ANEES':>10}")
+    for result in results[:args.top]:
+        print(''.join(f'{result[key]:>11.3g}' for key in keys)
+              + f"{result['mse']:>12.5g}{result['anees']:>10.3g}")
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
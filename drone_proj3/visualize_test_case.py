@@ -4,6 +4,13 @@
 # Note: this code is adapted from EECS 106B Homework 2 Problem Implementing Control Lyapunov Functions
 ######################################################################################################
 
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
 import matplotlib.pyplot as plt
 from matplotlib import animation
 from matplotlib.animation import FuncAnimation
@@ -15,9 +22,35 @@ from pyplot3d.utils import ypr_to_R
 
 from test_cases import test_up_and_down, test_loop
 
-def update_plot(drone_trajectory):
+TESTS = {'loop': test_loop, 'up_and_down': test_up_and_down}
+
+parser = argparse.ArgumentParser(
+    description='Animate a simulated flight of the quadrotor.')
+parser.add_argument('--test', choices=sorted(TESTS), default='loop',
+                    help='the motion to simulate')
+parser.add_argument('--stride', type=int, default=30,
+                    help='simulation steps per animation frame')
+parser.add_argument('--fps', type=float, default=100,
+                    help='frame rate of the animation')
+parser.add_argument('--out', default=None,
+                    help='render to this video (.mp4, .gif, ...) or PNG directory '
+                         'instead of showing a window and saving data.npy')
+parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                    help='number of processes rendering --out')
+parser.add_argument('--dpi', type=int, default=100,
+                    help='resolution of the rendered frames')
+parser.add_argument('--resolution', type=int, default=20,
+                    help='mesh resolution of the quadrotor spheres')
+parser.add_argument('--immediate', action='store_true',
+                    help='clear and redraw the whole axis every frame')
+
+
+def update_plot(drone_trajectory, ax, uav_plot):
     def helper(i):
         uav_plot.draw_at(drone_trajectory[0][:, i], drone_trajectory[1][:, :, i])
+        if uav_plot.retained:
+            # The landmark and the limits are kept from make_figure
+            return
 
         circle = Circle((0, 0), radius=3, color='purple')
         ax.add_patch(circle)
@@ -27,55 +60,189 @@ def update_plot(drone_trajectory):
         ax.set(ylim3d=(-30, 0), ylabel='Y')
         ax.set(zlim3d=(0, 30), zlabel='Z')
 
-        return ln,
-
     return helper
 
-# Set up plotting
-plt.style.use('seaborn')
-
-fig = plt.figure()
-plt.plot()
-ax = fig.add_subplot(projection="3d")
-ax.set(xlim3d=(-30, 30), xlabel='X')
-ax.set(ylim3d=(-30, 0), ylabel='Y')
-ax.set(zlim3d=(0, 30), zlabel='Z')
 
-uav_plot = Uav(ax, arm_length = 5, scaling_factor = 20)
+def make_figure(retained=True, resolution=20):
+    """Set up the figure, its 3D axis and the quadrotor drawn in it.
+
+    Parameters
+    ----------
+    retained : bool
+        Whether the quadrotor's artists are moved in place every frame,
+        rather than the axis cleared and everything drawn again.
+    resolution : int
+        Mesh resolution of the quadrotor spheres.
+
+    Returns
+    -------
+    fig : Figure
+    ax : Axes3D
+    uav_plot : Uav
+    """
+    # The seaborn styles were renamed in matplotlib 3.6
+    plt.style.use('seaborn' if 'seaborn' in plt.style.available
+                  else 'seaborn-v0_8')
+
+    fig = plt.figure()
+    ax = fig.add_subplot(projection="3d")
+    ax.set(xlim3d=(-30, 30), xlabel='X')
+    ax.set(ylim3d=(-30, 0), ylabel='Y')
+    ax.set(zlim3d=(0, 30), zlabel='Z')
+
+    uav_plot = Uav(ax, arm_length = 5, scaling_factor = 20,
+                   retained=retained, resolution=resolution)
+    if retained:
+        circle = Circle((0, 0), radius=3, color='purple')
+        ax.add_patch(circle)
+        art3d.pathpatch_2d_to_3d(circle, z=20, zdir="y")
+    return fig, ax, uav_plot
+
+
+def drone_trajectory(xHist, stride):
+    """Positions and attitudes of every stride-th simulation step.
+
+    Returns
+    -------
+    x : ndarray
+        (3, N) positions.
+    R : ndarray
+        (3, 3, N) attitudes.
+    """
+    x = xHist[:3, ::stride]
+    phi = xHist[3, ::stride]
+    R = np.zeros((3, 3, x.shape[1]))
+    for i in range(x.shape[1]):
+        ypr = np.array([0, -phi[i], 0])
+        R[:, :, i] = ypr_to_R(ypr, degrees=False)
+    return x, R
+
+
+def render(trajectory, out, fps, workers, dpi=100, retained=True,
+           resolution=20):
+    """Render the animation offline, splitting the frames across processes.
+
+    Each worker renders a contiguous range of frames with the Agg backend.
+    A PNG directory is written to directly. For a video, every worker
+    encodes its range to a segment with ffmpeg and the segments are
+    concatenated without re-encoding. A .gif is assembled from the frames
+    with Pillow.
+
+    Parameters
+    ----------
+    trajectory : tuple
+        Positions and attitudes, see drone_trajectory.
+    out : str
+        Path of the video, or of the PNG directory when it has no extension.
+    fps : float
+        Frame rate of the video.
+    workers : int
+        Number of worker processes.
+    dpi : int
+        Resolution of the frames.
+    retained, resolution
+        See make_figure.
+
+    Returns
+    -------
+        None
+    """
+    n_frames = trajectory[0].shape[1]
+    ext = os.path.splitext(out)[1].lower()
+    if ext not in ('', '.gif') and not animation.FFMpegWriter.isAvailable():
+        raise RuntimeError(f'ffmpeg is required to write {out}, '
+                           f'write a .gif or a PNG directory instead')
+    ranges = [r for r in np.array_split(np.arange(n_frames), max(workers, 1))
+              if len(r)]
+    with tempfile.TemporaryDirectory() as tmp:
+        if ext == '':
+            os.makedirs(out, exist_ok=True)
+            targets = [out] * len(ranges)
+        elif ext == '.gif':
+            targets = [tmp] * len(ranges)
+        else:
+            targets = [os.path.join(tmp, f'segment_{k:03d}{ext}')
+                       for k in range(len(ranges))]
+        tasks = [(trajectory[0][:, r], trajectory[1][:, :, r], r[0], target,
+                  fps, dpi, retained, resolution)
+                 for r, target in zip(ranges, targets)]
+        with ProcessPoolExecutor(max_workers=len(tasks),
+                                 initializer=plt.switch_backend,
+                                 initargs=('Agg',)) as pool:
+            list(pool.map(_render_range, tasks))
+        if ext == '.gif':
+            _stitch_gif(tmp, n_frames, out, fps)
+        elif ext != '':
+            _stitch_video(targets, out, tmp)
+
+
+def _render_range(task):
+    x, R, first, target, fps, dpi, retained, resolution = task
+    fig, ax, uav_plot = make_figure(retained, resolution)
+    draw = update_plot((x, R), ax, uav_plot)
+    if os.path.isdir(target):
+        for i in range(x.shape[1]):
+            draw(i)
+            fig.savefig(os.path.join(target, f'frame_{first + i:06d}.png'),
+                        dpi=dpi)
+    else:
+        writer = animation.FFMpegWriter(fps=fps)
+        with writer.saving(fig, target, dpi):
+            for i in range(x.shape[1]):
+                draw(i)
+                writer.grab_frame()
+    plt.close(fig)
+
+
+def _stitch_gif(frames_dir, n_frames, out, fps):
+    from PIL import Image
+    frames = [Image.open(os.path.join(frames_dir, f'frame_{i:06d}.png'))
+              for i in range(n_frames)]
+    frames[0].save(out, save_all=True, append_images=frames[1:],
+                   duration=1000 / fps, loop=0)
+
+
+def _stitch_video(segments, out, tmp):
+    listing = os.path.join(tmp, 'segments.txt')
+    with open(listing, 'w') as f:
+        f.writelines(f"file '{os.path.abspath(segment)}'\n"
+                     for segment in segments)
+    ffmpeg = shutil.which(plt.rcParams['animation.ffmpeg_path']) or 'ffmpeg'
+    subprocess.run([ffmpeg, '-y', '-loglevel', 'error', '-f', 'concat',
+                    '-safe', '0', '-i', listing, '-c', 'copy', out],
+                   check=True)
 
-x = []
-y = []
-z = []
-ln, = ax.plot(x, y, z, '-')
 
 def main():
-
-    # TODO: choose the motion to simulate
-    # xHist, _, _ = test_up_and_down()
-    xHist, uHist, tHist, obsHist = test_loop()
-
-    x = xHist[:3, ::30]
-    phi = xHist[3, ::30]
-    SIM_LEN = x.shape[1]
-    R = np.zeros((3, 3, SIM_LEN))
-    for i in range(SIM_LEN):
-        ypr = np.array([0, -phi[i], 0])
-        R[:, :, i] = ypr_to_R(ypr, degrees=False)
-    drone_trajectory = (x, R)
-    
-    animation = FuncAnimation(fig, update_plot(drone_trajectory), frames=SIM_LEN, interval=10)
-    plt.show()
+    args = parser.parse_args()
+    if args.out is not None:
+        plt.switch_backend('Agg')
+
+    xHist, uHist, tHist, obsHist = TESTS[args.test]()
+
+    trajectory = drone_trajectory(xHist, args.stride)
+    if args.out is None:
+        fig, ax, uav_plot = make_figure(not args.immediate, args.resolution)
+        anim = FuncAnimation(fig, update_plot(trajectory, ax, uav_plot),
+                             frames=trajectory[0].shape[1],
+                             interval=1000 / args.fps)
+        plt.show()
+    else:
+        render(trajectory, args.out, args.fps, args.workers, args.dpi,
+               not args.immediate, args.resolution)
+        # Rendering leaves the estimators' log in the CWD alone
+        return
 
     # want to remove y and y_dot from the state vector
     xHist = np.delete(xHist, (1,5),0)
     dataHist = np.vstack((tHist, xHist))
     dataHist = np.vstack((dataHist, uHist))
     dataHist = np.vstack((dataHist,obsHist))
-    # this is a (N,12) where it's time, x, u, then obs 
+    # this is a (N,12) where it's time, x, u, then obs
     dataHist = dataHist.T
 
     with open('data.npy', 'wb') as f:
         np.save(f, dataHist)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
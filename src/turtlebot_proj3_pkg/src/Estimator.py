@@ -2,7 +2,14 @@ import rospy
 from std_msgs.msg import Float32MultiArray
 import matplotlib.pyplot as plt
 import numpy as np
-import time
+import threading
+from scipy.linalg import solve_discrete_are
+from downsampling import MinMaxPyramid
+from history import History
+from models import frozen_bearing, unicycle
+from profiling import StageTimer
+from sequencing import MessageBuffer
+from smoothing import FixedLagSmoother
 plt.rcParams['font.family'] = ['FreeSans', 'Helvetica', 'Arial']
 plt.rcParams['font.size'] = 14
 
@@ -21,32 +28,46 @@ class Estimator:
             Half of the track width (m) of TurtleBot3 Burger.
         r : float
             Wheel radius (m) of the TurtleBot3 Burger.
-        u : list
-            A list of system inputs, where, for the ith data point u[i],
+        u : History
+            A history of system inputs, where, for the ith data point u[i],
             u[i][0] is timestamp (s),
             u[i][1] is left wheel rotational speed (rad/s), and
             u[i][2] is right wheel rotational speed (rad/s).
-        x : list
-            A list of system states, where, for the ith data point x[i],
+        x : History
+            A history of system states, where, for the ith data point x[i],
             x[i][0] is timestamp (s),
             x[i][1] is bearing (rad),
             x[i][2] is translational position in x (m),
             x[i][3] is translational position in y (m),
             x[i][4] is left wheel rotational position (rad), and
             x[i][5] is right wheel rotational position (rad).
-        y : list
-            A list of system outputs, where, for the ith data point y[i],
+        y : History
+            A history of system outputs, where, for the ith data point y[i],
             y[i][0] is timestamp (s),
             y[i][1] is translational position in x (m) when freeze_bearing:=true,
             y[i][1] is distance to the landmark (m) when freeze_bearing:=false,
             y[i][2] is translational position in y (m) when freeze_bearing:=true, and
             y[i][2] is relative bearing (rad) w.r.t. the landmark when
             freeze_bearing:=false.
-        x_hat : list
-            A list of estimated system states. It should follow the same format
-            as x.
+        x_hat : History
+            A history of estimated system states. It should follow the same
+            format as x.
+        x_lagged : History
+            Fixed-lag smoothed states, x_lagged[i] estimating x[i] once the
+            estimator is lag samples past it. None unless the estimator
+            runs a FixedLagSmoother.
         dt : float
             Update frequency of the estimator.
+        horizon : float
+            How late (s) a u or y message may arrive, from the ~oosm_horizon
+            parameter. A message older than the current estimate is folded
+            in by rolling the estimator back to its timestamp and
+            re-propagating; messages more than horizon behind it are
+            dropped and counted in late_dropped.
+        u_buffer : MessageBuffer
+            The u messages within the horizon, ordered by timestamp.
+        y_buffer : MessageBuffer
+            The y messages within the horizon, ordered by timestamp.
         fig : Figure
             matplotlib Figure for real-time plotting.
         axd : dict
@@ -55,8 +76,16 @@ class Estimator:
             matplotlib Line object for ground truth states.
         ln_*_hat : Line
             matplotlib Line object for estimated states.
+        x_pyramid, x_hat_pyramid : MinMaxPyramid
+            Downsampled phi, x, y, theta L and theta R of x and x_hat for
+            plotting, so that the lines hold a few points per pixel
+            whatever the length of the run.
         canvas_title : str
             Title of the real-time plot, which is chosen to be estimator type.
+        timer : StageTimer
+            Per-stage latency recorder filled by update.
+        update_runtimes : ndarray
+            Wall time (s) of every retained update call.
         sub_u : rospy.Subscriber
             ROS subscriber for system inputs.
         sub_x : rospy.Subscriber
@@ -74,11 +103,25 @@ class Estimator:
     def __init__(self):
         self.d = 0.08
         self.r = 0.033
-        self.u = []
-        self.x = []
-        self.y = []
-        self.x_hat = []  # Your estimates go here!
+        # A positive ~history_len keeps only that many recent samples
+        history_len = rospy.get_param('~history_len', 0) or None
+        self.u = History(3, maxlen=history_len)
+        self.x = History(6, maxlen=history_len)
+        self.y = History(3, maxlen=history_len)
+        self.x_hat = History(6, maxlen=history_len)  # Your estimates go here!
+        self.x_lagged = None
         self.dt = 0.1
+        # Messages may arrive out of order, they are looked up by timestamp
+        self.horizon = rospy.get_param('~oosm_horizon', 1.0)
+        self.u_buffer = MessageBuffer(self.dt / 2)
+        self.y_buffer = MessageBuffer(self.dt / 2)
+        self.x_newest = -np.inf
+        self.late_dropped = 0
+        self._rollback_to = None
+        # The subscriber callbacks and the timer run on separate threads;
+        # this lock serializes filing messages with rolling back and
+        # replaying them
+        self._lock = threading.Lock()
         self.fig, self.axd = plt.subplot_mosaic(
             [['xy', 'phi'],
              ['xy', 'x'],
@@ -98,25 +141,175 @@ class Estimator:
         self.ln_thr, = self.axd['thr'].plot([], 'o-g', linewidth=2, label='True')
         self.ln_thr_hat, = self.axd['thr'].plot([], 'o-c', label='Estimated')
         self.canvas_title = 'N/A'
+        # Rows of each history already plotted, see new_rows
+        self._plotted = {}
+        self.x_pyramid = MinMaxPyramid(5, maxlen=history_len)
+        self.x_hat_pyramid = MinMaxPyramid(5, maxlen=history_len)
+        self.timer = StageTimer(maxlen=history_len)
         self.sub_u = rospy.Subscriber('u', Float32MultiArray, self.callback_u)
         self.sub_x = rospy.Subscriber('x', Float32MultiArray, self.callback_x)
         self.sub_y = rospy.Subscriber('y', Float32MultiArray, self.callback_y)
         self.tmr_update = rospy.Timer(rospy.Duration(self.dt), self.update)
 
     def callback_u(self, msg):
-        self.u.append(msg.data)
+        with self._lock:
+            self.u.append(msg.data)
+        # An input is held from its timestamp on
+        self.receive(self.u_buffer, msg.data, 0)
 
     def callback_x(self, msg):
-        self.x.append(msg.data)
-        if len(self.x_hat) == 0:
-            self.x_hat.append(msg.data)
+        with self._lock:
+            self.x.append(msg.data)
+            self.x_newest = max(self.x_newest, msg.data[0])
+            if len(self.x_hat) == 0:
+                self.x_hat.append(msg.data)
 
     def callback_y(self, msg):
-        self.y.append(msg.data)
+        with self._lock:
+            self.y.append(msg.data)
+        # A measurement corrects the step ending at its timestamp
+        self.receive(self.y_buffer, msg.data, self.dt)
+
+    def receive(self, buffer, row, lead):
+        """File a message by timestamp, scheduling a rollback if it is late.
+
+        Parameters
+        ----------
+        buffer : MessageBuffer
+            Buffer of the message's topic.
+        row : tuple
+            The message, starting with its timestamp.
+        lead : float
+            How long (s) before its timestamp the first step using the
+            message starts.
+        """
+        stamp = row[0]
+        with self._lock:
+            if len(self.x_hat):
+                now = self.x_hat.view()[-1, 0]
+                if stamp < now - self.horizon:
+                    self.late_dropped += 1
+                    return
+                if stamp - lead < now - buffer.tolerance:
+                    start = stamp - lead
+                    if self._rollback_to is None or \
+                            start < self._rollback_to:
+                        self._rollback_to = start
+            buffer.insert(row)
+
+    def ready(self):
+        """Whether the step from the current estimate can run.
+
+        It needs the input at the start of the step, and the estimate may
+        not run ahead of the true state.
+        """
+        now = self.x_hat.view()[-1, 0]
+        tolerance = self.u_buffer.tolerance
+        return self.x_newest > now + tolerance and \
+            self.u_buffer.newest >= now - tolerance and \
+            self.u_buffer.latest(now) is not None
+
+    def rollback(self):
+        """Drop the estimates a late message invalidated.
+
+        Keeps the estimates up to the start of the first step that uses a
+        late message, see receive, and calls restore so that the
+        estimator resumes from the last one kept. The following updates
+        then re-propagate over the buffered messages.
+
+        Returns
+        -------
+        n : int
+            Number of estimates dropped.
+        """
+        start, self._rollback_to = self._rollback_to, None
+        times = self.x_hat.column(0)
+        keep = np.searchsorted(times, start + self.u_buffer.tolerance,
+                               side='right')
+        n = max(min(len(times) - max(keep, 1), self.max_rollback()), 0)
+        if n > 0:
+            self.x_hat.truncate(n)
+            # The re-propagated estimates are new rows for the plot
+            plotted = self._plotted.get(id(self.x_hat))
+            if plotted is not None:
+                self._plotted[id(self.x_hat)] = min(plotted, self.x_hat.total)
+            self.restore(n)
+        self.timer.count('replayed', n)
+        return n
+
+    def max_rollback(self):
+        """Number of the most recent estimates restore can drop."""
+        return len(self.x_hat) - 1
+
+    def restore(self, n):
+        """Resume from x_hat[-1] after n estimates were dropped."""
+        raise NotImplementedError
+
+    def prune(self):
+        """Forget the messages older than the horizon."""
+        oldest = self.x_hat.view()[-1, 0] - self.horizon
+        self.u_buffer.prune(oldest)
+        self.y_buffer.prune(oldest)
 
     def update(self, _):
         raise NotImplementedError
 
+    @property
+    def update_runtimes(self):
+        return self.timer.seconds('total')
+
+    def postProcessing(self, profile_out=None):
+        """Report runtime and accuracy once the node shuts down.
+
+        Parameters
+        ----------
+        profile_out : str
+            Path of a JSON file to write the per-stage latency summary to.
+        """
+        runtimes = self.update_runtimes
+        if len(runtimes):
+            print(f"Average update runtime: {np.mean(runtimes):.6f} seconds")
+            print(f"p99 update runtime: {np.percentile(runtimes, 99):.6f} seconds")
+        print('Mean Squared Error: ', self.mean_squared_error())
+        if self.x_lagged is not None:
+            print('Fixed-lag Mean Squared Error: ',
+                  self.lagged_mean_squared_error())
+        if self.late_dropped:
+            print(f'Messages dropped beyond the horizon: {self.late_dropped}')
+        if profile_out is not None:
+            self.timer.to_json(profile_out)
+
+    def mean_squared_error(self):
+        return np.mean(np.square(self.matched_error(self.x_hat)))
+
+    def lagged_mean_squared_error(self):
+        return np.mean(np.square(self.matched_error(self.x_lagged)))
+
+    def matched_error(self, estimates):
+        """Errors of the estimates w.r.t. the true states of their time.
+
+        x is kept in arrival order, which may not be the order of the
+        timestamps, so the retained true states are sorted and matched
+        to the retained estimates by timestamp.
+        """
+        x = self.x.view()
+        x = x[np.argsort(x[:, 0], kind='stable')]
+        estimates = estimates.view()
+        if len(x) == 0:
+            return estimates[:0]
+        i = np.searchsorted(x[:, 0], estimates[:, 0] - self.dt / 2)
+        i = np.minimum(i, len(x) - 1)
+        matched = np.abs(x[i, 0] - estimates[:, 0]) <= self.dt / 2
+        return x[i[matched]] - estimates[matched]
+
+    def export(self, path):
+        """Save the retained u, x, y and x_hat histories to an .npz file."""
+        arrays = dict(u=self.u.view(), x=self.x.view(), y=self.y.view(),
+                      x_hat=self.x_hat.view())
+        if self.x_lagged is not None:
+            arrays['x_lagged'] = self.x_lagged.view()
+        np.savez(path, **arrays)
+
     def plot_init(self):
         print("WOAH")
         self.axd['xy'].set_title(self.canvas_title)
@@ -138,67 +331,116 @@ class Estimator:
         plt.tight_layout()
 
     def plot_update(self, _):
-        self.plot_xyline(self.ln_xy, self.x)
-        self.plot_xyline(self.ln_xy_hat, self.x_hat)
-        self.plot_philine(self.ln_phi, self.x)
-        self.plot_philine(self.ln_phi_hat, self.x_hat)
-        self.plot_xline(self.ln_x, self.x)
-        self.plot_xline(self.ln_x_hat, self.x_hat)
-        self.plot_yline(self.ln_y, self.x)
-        self.plot_yline(self.ln_y_hat, self.x_hat)
-        self.plot_thlline(self.ln_thl, self.x)
-        self.plot_thlline(self.ln_thl_hat, self.x_hat)
-        self.plot_thrline(self.ln_thr, self.x)
-        self.plot_thrline(self.ln_thr_hat, self.x_hat)
-
-    def plot_xyline(self, ln, data):
-        if len(data):
-            x = [d[2] for d in data]
-            y = [d[3] for d in data]
-            ln.set_data(x, y)
-            self.resize_lim(self.axd['xy'], x, y)
-
-    def plot_philine(self, ln, data):
-        if len(data):
-            t = [d[0] for d in data]
-            phi = [d[1] for d in data]
-            ln.set_data(t, phi)
-            self.resize_lim(self.axd['phi'], t, phi)
-
-    def plot_xline(self, ln, data):
-        if len(data):
-            t = [d[0] for d in data]
-            x = [d[2] for d in data]
-            ln.set_data(t, x)
-            self.resize_lim(self.axd['x'], t, x)
-
-    def plot_yline(self, ln, data):
-        if len(data):
-            t = [d[0] for d in data]
-            y = [d[3] for d in data]
-            ln.set_data(t, y)
-            self.resize_lim(self.axd['y'], t, y)
-
-    def plot_thlline(self, ln, data):
-        if len(data):
-            t = [d[0] for d in data]
-            thl = [d[4] for d in data]
-            ln.set_data(t, thl)
-            self.resize_lim(self.axd['thl'], t, thl)
-
-    def plot_thrline(self, ln, data):
-        if len(data):
-            t = [d[0] for d in data]
-            thr = [d[5] for d in data]
-            ln.set_data(t, thr)
-            self.resize_lim(self.axd['thr'], t, thr)
+        # Only the rows added since the last frame are scanned, the lines
+        # are drawn from the downsampled histories. The lock keeps a
+        # rollback on the timer thread from truncating x_hat and lowering
+        # its _plotted count between counting the new rows and
+        # summarizing them, which would leave the pyramid unrewound
+        with self._lock:
+            new = self.new_rows(self.x)
+            if new:
+                self.downsample(self.x_pyramid, self.x, new)
+                self.plot_xyline(self.ln_xy, self.x, self.x_pyramid, new)
+                self.plot_philine(self.ln_phi, self.x, self.x_pyramid, new)
+                self.plot_xline(self.ln_x, self.x, self.x_pyramid, new)
+                self.plot_yline(self.ln_y, self.x, self.x_pyramid, new)
+                self.plot_thlline(self.ln_thl, self.x, self.x_pyramid, new)
+                self.plot_thrline(self.ln_thr, self.x, self.x_pyramid, new)
+            new = self.new_rows(self.x_hat)
+            if new:
+                self.downsample(self.x_hat_pyramid, self.x_hat, new)
+                self.plot_xyline(self.ln_xy_hat, self.x_hat,
+                                 self.x_hat_pyramid, new)
+                self.plot_philine(self.ln_phi_hat, self.x_hat,
+                                  self.x_hat_pyramid, new)
+                self.plot_xline(self.ln_x_hat, self.x_hat,
+                                self.x_hat_pyramid, new)
+                self.plot_yline(self.ln_y_hat, self.x_hat,
+                                self.x_hat_pyramid, new)
+                self.plot_thlline(self.ln_thl_hat, self.x_hat,
+                                  self.x_hat_pyramid, new)
+                self.plot_thrline(self.ln_thr_hat, self.x_hat,
+                                  self.x_hat_pyramid, new)
+
+    def new_rows(self, data):
+        """Number of rows of data added since the last frame plotted it.
+
+        Call with the lock held, see plot_update.
+        """
+        plotted = self._plotted.get(id(data), 0)
+        self._plotted[id(data)] = data.total
+        return min(data.total - plotted, len(data))
+
+    # noinspection PyMethodMayBeStatic
+    def downsample(self, pyramid, data, new):
+        """Bring the pyramid of data up to date with its new rows.
+
+        Call with the lock held, see plot_update.
+        """
+        # Rows re-propagated after a rollback replace the ones summarized
+        pyramid.rewind(data.total - new)
+        pyramid.update(data[:, 1:], data.dropped)
+
+    # noinspection PyMethodMayBeStatic
+    def rows(self, pyramid, series, data, ax):
+        """Rows of data to draw series of its pyramid in ax with."""
+        return pyramid.indices(series, data.dropped, data.total,
+                               ax.bbox.width) - data.dropped
+
+    def plot_xyline(self, ln, data, pyramid, new):
+        x = data[:, 2]
+        y = data[:, 3]
+        self.resize_lim(self.axd['xy'], x[-new:], y[-new:])
+        i = self.rows(pyramid, (1, 2), data, self.axd['xy'])
+        ln.set_data(x[i], y[i])
+
+    def plot_philine(self, ln, data, pyramid, new):
+        t = data[:, 0]
+        phi = data[:, 1]
+        self.resize_lim(self.axd['phi'], t[-new:], phi[-new:])
+        i = self.rows(pyramid, (0,), data, self.axd['phi'])
+        ln.set_data(t[i], phi[i])
+
+    def plot_xline(self, ln, data, pyramid, new):
+        t = data[:, 0]
+        x = data[:, 2]
+        self.resize_lim(self.axd['x'], t[-new:], x[-new:])
+        i = self.rows(pyramid, (1,), data, self.axd['x'])
+        ln.set_data(t[i], x[i])
+
+    def plot_yline(self, ln, data, pyramid, new):
+        t = data[:, 0]
+        y = data[:, 3]
+        self.resize_lim(self.axd['y'], t[-new:], y[-new:])
+        i = self.rows(pyramid, (2,), data, self.axd['y'])
+        ln.set_data(t[i], y[i])
+
+    def plot_thlline(self, ln, data, pyramid, new):
+        t = data[:, 0]
+        thl = data[:, 4]
+        self.resize_lim(self.axd['thl'], t[-new:], thl[-new:])
+        i = self.rows(pyramid, (3,), data, self.axd['thl'])
+        ln.set_data(t[i], thl[i])
+
+    def plot_thrline(self, ln, data, pyramid, new):
+        t = data[:, 0]
+        thr = data[:, 5]
+        self.resize_lim(self.axd['thr'], t[-new:], thr[-new:])
+        i = self.rows(pyramid, (4,), data, self.axd['thr'])
+        ln.set_data(t[i], thr[i])
 
     # noinspection PyMethodMayBeStatic
     def resize_lim(self, ax, x, y):
+        # The limits only grow, so merging them with the new points alone
+        # gives the limits of all the points
         xlim = ax.get_xlim()
-        ax.set_xlim([min(min(x) * 1.05, xlim[0]), max(max(x) * 1.05, xlim[1])])
+        xlim_new = (min(x.min() * 1.05, xlim[0]), max(x.max() * 1.05, xlim[1]))
+        if xlim_new != xlim:
+            ax.set_xlim(xlim_new)
         ylim = ax.get_ylim()
-        ax.set_ylim([min(min(y) * 1.05, ylim[0]), max(max(y) * 1.05, ylim[1])])
+        ylim_new = (min(y.min() * 1.05, ylim[0]), max(y.max() * 1.05, ylim[1]))
+        if ylim_new != ylim:
+            ax.set_ylim(ylim_new)
 
 
 class OracleObserver(Estimator):
@@ -220,7 +462,10 @@ class OracleObserver(Estimator):
         self.canvas_title = 'Oracle Observer'
 
     def update(self, _):
+        self.timer.start()
         self.x_hat.append(self.x[-1])
+        self.timer.lap('bookkeeping')
+        self.timer.stop()
 
 
 class DeadReckoning(Estimator):
@@ -242,68 +487,70 @@ class DeadReckoning(Estimator):
             noise_injection:=false \
             freeze_bearing:=false
     For debugging, you can simulate a noise-free unicycle model by setting
-    noise_injection:=false.
+    noise_injection:=false. Setting the estimator node's ~symbolic
+    parameter to true steps the kernels generated from models.unicycle
+    instead of the model below.
     """
     def __init__(self):
         super().__init__()
         self.timeStep = 0
         self.previousState = 0
         self.canvas_title = 'Dead Reckoning'
-        self.update_runtimes = []  # List to store update runtimes
+        self.model = None
+        if rospy.get_param('~symbolic', False):
+            self.model = unicycle(self.d, self.r)
 
     def update(self, _):
-        start_time = time.time()  # Start timing
+        self.timer.start()
 
-        if len(self.x_hat) > 0 and self.x_hat[-1][0] < self.x[-1][0] and len(self.u) > self.timeStep:
-            # TODO: Your implementation goes here!
-            # You may ONLY use self.u and self.x[0] for estimation
-            if self.timeStep == 0:
-                self.previousState = self.x[0]
+        with self._lock:
+            if len(self.x_hat) > 0:
+                if self._rollback_to is not None:
+                    self.rollback()
+                # Catches up over several steps after a rollback
+                while self.ready():
+                    self.step()
+                self.prune()
+
+        self.timer.stop()
 
+    def step(self):
+        # TODO: Your implementation goes here!
+        # You may ONLY use self.u and self.x[0] for estimation
+        if self.timeStep == 0:
+            self.previousState = self.x[0].copy()
+
+        # Input held at the start of the step
+        inputs = self.u_buffer.latest(self.previousState[0])[1:]
+
+        stateEstimate = np.zeros(6)
+        stateEstimate[0] = self.previousState[0] + self.dt
+        if self.model is not None:
+            stateEstimate[1:] = self.model.g(self.previousState[1:], inputs,
+                                             self.dt)
+        else:
             lastPhi = self.previousState[1]
             model = [[-(self.r / (2 * self.d)), (self.r / (2 * self.d))],
-                        [(self.r * np.cos(lastPhi)) / 2, (self.r * np.cos(lastPhi)) / 2],
-                        [(self.r * np.sin(lastPhi)) / 2, (self.r * np.sin(lastPhi)) / 2],
-                        [1, 0],
-                        [0, 1]]
-            inputs = np.array([self.u[self.timeStep][1], self.u[self.timeStep][2]])
-
+                     [(self.r * np.cos(lastPhi)) / 2, (self.r * np.cos(lastPhi)) / 2],
+                     [(self.r * np.sin(lastPhi)) / 2, (self.r * np.sin(lastPhi)) / 2],
+                     [1, 0],
+                     [0, 1]]
             nextState = (model @ inputs)
+            stateEstimate[1:] = self.previousState[1:] + nextState * self.dt
+
+        # stateEstimate += (nextState * self.dt)
+        # stateEstimate[0] = self.timeStep * self.dt
+        self.timer.lap('predict')
+        self.previousState = stateEstimate
+
+        self.x_hat.append(stateEstimate)
+        self.timeStep += 1
+        self.timer.lap('bookkeeping')
+
+    def restore(self, n):
+        self.previousState = self.x_hat[-1].copy()
+        self.timeStep -= n
 
-            stateEstimate = np.zeros(6)
-            stateEstimate[0] = self.previousState[0] + self.dt           
-            stateEstimate[1:] = self.previousState[1:] + nextState * self.dt  
-
-            # stateEstimate += (nextState * self.dt)
-            # stateEstimate[0] = self.timeStep * self.dt
-            self.previousState = stateEstimate
-            
-            self.x_hat.append(stateEstimate)
-            self.timeStep += 1
-
-        end_time = time.time()  # End timing
-        elapsed_time = end_time - start_time  # Calculate elapsed time
-        self.update_runtimes.append(elapsed_time)  # Store runtime
-
-            # print("Step Model: ", stepModel)
-            # print("SM Shape: ", stepModel.shape)
-            # print("Inputs: ", inputs)
-            # print("Inputs Shape: ", inputs.shape)
-            # # print("Initial: ", initialState)
-            # # print("Initial Shape: ", initialState.shape)
-            # # print("Matrix Multiplication: ", stepModel @ inputs)
-            # print("step shape: ", (stepModel @ inputs).shape)
-            # print("NE Shape: ", nextState.shape)
-            # # print("nextState: ", nextState)
-            # # print("nextState type: ", type(nextState))
-            # print("State Estimate: ", stateEstimate)
-            # print("SE Shape: ", stateEstimate.shape)
-
-    def postProcessing(self):
-        # Calculate the average runtime
-        average_runtime = np.mean(self.update_runtimes)
-        print(f"Average update runtime: {average_runtime:.6f} seconds")
-        print('Mean Squared Error: ', np.mean(np.square(np.array(self.x) - np.array(self.x_hat))))
 
 class KalmanFilter(Estimator):
     """Kalman filter estimator.
@@ -318,6 +565,22 @@ class KalmanFilter(Estimator):
     ----------
         phid : float
             Default bearing of the turtlebot fixed at pi / 4.
+        fixed_lag : FixedLagSmoother
+            Smoother fed by every update when the ~lag parameter is
+            positive, else None.
+        K : ndarray
+            Steady-state gain used for every update when the
+            ~steady_state parameter is true, else None. P is then not
+            propagated.
+        P_hat : History
+            Covariances of the estimates a rollback can return to, about
+            horizon / dt of the most recent ones.
+        x_pred_hat, P_pred_hat : History
+            Predictions the estimates in P_hat were corrected from.
+        model : CompiledModel
+            Kernels generated from models.frozen_bearing, which give A, C
+            and the state extrapolation when the ~symbolic parameter is
+            true, else None.
 
     Example
     ----------
@@ -326,6 +589,12 @@ class KalmanFilter(Estimator):
             estimator_type:=kalman_filter \
             noise_injection:=true \
             freeze_bearing:=true
+    To also stream estimates smoothed 5 samples (0.5 s) behind, set the
+    estimator node's ~lag parameter to 5. Measurements arriving up to
+    ~oosm_horizon seconds late (1 by default) are folded back in by
+    rolling the filter back and re-propagating. Setting ~steady_state to
+    true runs the filter with its precomputed steady-state gain, and
+    setting ~symbolic to true runs it on the generated model kernels.
     """
     def __init__(self):
         super().__init__()
@@ -355,63 +624,202 @@ class KalmanFilter(Estimator):
                            [0, 1, 0, 0],
                            [0, 0, 1, 0],
                            [0, 0, 0, 1]])
-        
-        self.update_runtimes = []  # List to store update runtimes
+        # B only depends on the constant bearing
+        self.B = np.array([[(self.r/2) * np.cos(self.phid), (self.r/2) * np.cos(self.phid)],
+                           [(self.r/2) * np.sin(self.phid), (self.r/2) * np.sin(self.phid)],
+                           [1, 0],
+                           [0, 1]]) * self.dt
+
+        self.model = None
+        if rospy.get_param('~symbolic', False):
+            self.model = frozen_bearing(self.r, self.phid)
+            # The model is linear, its Jacobians are constant
+            self.A = self.model.approx_A(np.zeros(4), np.zeros(2), self.dt)
+            self.C = self.model.approx_C(np.zeros(4))
+
+        self.fixed_lag = None
+        lag = rospy.get_param('~lag', 0)
+        if lag > 0:
+            self.fixed_lag = FixedLagSmoother(4, lag)
+            self.x_lagged = History(6, maxlen=self.x_hat.maxlen)
+
+        self.K = None
+        if rospy.get_param('~steady_state', False):
+            if self.fixed_lag is not None:
+                raise ValueError('Fixed-lag smoothing needs the covariances '
+                                 'the steady-state filter does not propagate')
+            self.K = self.steady_state_gain()
+            self.canvas_title = 'Steady-State Kalman Filter'
+
+        # Covariance of the most recent estimates, to resume from after a
+        # rollback, and the predictions that led to them, to rebuild
+        # fixed_lag from
+        steps = int(np.ceil(self.horizon / self.dt)) + max(lag, 0) + 2
+        self.P_hat = History((4, 4), maxlen=steps)
+        self.x_pred_hat = History(4, maxlen=steps)
+        self.P_pred_hat = History((4, 4), maxlen=steps)
 
     # noinspection DuplicatedCode
     # noinspection PyPep8Naming
     def update(self, _):
-        start_time = time.time()  # Start timing
+        self.timer.start()
 
-        if len(self.x_hat) > 0 and self.x_hat[-1][0] < self.x[-1][0] and len(self.u) > self.t:
-            # TODO: Your implementation goes here!
-            # You may use self.u, self.y, and self.x[0] for estimation
-            if self.t == 0:
-                self.previous_state = self.x[0]
-
-            # phi = self.previous_state[1]
-            self.B = np.array([[(self.r/2) * np.cos(self.phid), (self.r/2) * np.cos(self.phid)],
-                                [(self.r/2) * np.sin(self.phid), (self.r/2) * np.sin(self.phid)],
-                                [1, 0],
-                                [0, 1]]) * self.dt
-            
-            # print("Previous State: ", self.previous_state)
-
-            # State extrapolation
-            next_x = self.A @ self.x_hat[self.t][2:] + self.B @ self.u[self.t][1:]
-            
-            # Covariance extrapolation
-            Pt1 = self.A @ self.P @ self.A.T + self.Q
-            
+        with self._lock:
+            if len(self.x_hat) > 0:
+                if self._rollback_to is not None:
+                    self.rollback()
+                # Catches up over several steps after a rollback
+                while self.ready():
+                    self.step()
+                self.prune()
+
+        self.timer.stop()
+
+    # noinspection PyPep8Naming
+    def step(self):
+        # TODO: Your implementation goes here!
+        # You may use self.u, self.y, and self.x[0] for estimation
+        if self.t == 0:
+            self.previous_state = self.x[0].copy()
+            self.checkpoint(self.previous_state[2:], self.P)
+            if self.fixed_lag is not None:
+                self.fixed_lag.push(self.previous_state[2:], self.P)
+
+        # print("Previous State: ", self.previous_state)
+
+        # State extrapolation, with the input held at the start of the step
+        now = self.previous_state[0]
+        u = self.u_buffer.latest(now)[1:]
+        if self.model is not None:
+            next_x = self.model.g(self.x_hat[-1][2:], u, self.dt)
+        else:
+            next_x = self.A @ self.x_hat[-1][2:] + self.B @ u
+
+        # Covariance extrapolation, skipped with the steady-state gain
+        Pt1 = self.P if self.K is not None \
+            else self.A @ self.P @ self.A.T + self.Q
+        self.timer.lap('predict')
+
+        y = self.y_buffer.at(now + self.dt)
+        if y is None:
+            # Predict only, a rollback folds the measurement in if it
+            # arrives late
+            next_state = next_x
+            self.P = Pt1
+        elif self.K is not None:
+            # State update with the constant gain
+            next_state = next_x + self.K @ (y[1:] - (self.C @ next_x))
+        else:
             # Kalman gain
             Kt1 = Pt1 @ self.C.T @ np.linalg.inv(self.C @ Pt1 @ self.C.T + self.R)
-            
+            self.timer.lap('gain')
+
             # State update
-            next_state = next_x + Kt1 @ (self.y[self.t+1][1:] - (self.C @ next_x))
+            next_state = next_x + Kt1 @ (y[1:] - (self.C @ next_x))
             # self.P = (np.eye(4) - (Kt1 @ self.C)) @ self.P
-            
+
             # Covariance update
             self.P = (np.eye(4) - (Kt1 @ self.C)) @ Pt1
 
-            state_estimate = np.zeros(6)
-            state_estimate[0] = self.previous_state[0] + self.dt
-            state_estimate[1] = self.previous_state[1]# + (self.phid * self.dt))
-            state_estimate[2:] = next_state
-            # print("State Estimate: ", state_estimate)
-
-            self.previous_state = state_estimate
-            self.x_hat.append(state_estimate)
-            self.t += 1
-        
-        end_time = time.time()  # End timing
-        elapsed_time = end_time - start_time  # Calculate elapsed time
-        self.update_runtimes.append(elapsed_time)  # Store runtime
-
-    def postProcessing(self):
-        # Calculate the average runtime
-        average_runtime = np.mean(self.update_runtimes)
-        print(f"Average update runtime: {average_runtime:.6f} seconds")
-        print('Mean Squared Error: ', np.mean(np.square(np.array(self.x) - np.array(self.x_hat))))
+        state_estimate = np.zeros(6)
+        state_estimate[0] = self.previous_state[0] + self.dt
+        state_estimate[1] = self.previous_state[1]# + (self.phid * self.dt))
+        state_estimate[2:] = next_state
+        # print("State Estimate: ", state_estimate)
+        self.timer.lap('correct')
+
+        if self.fixed_lag is not None:
+            smoothed = self.fixed_lag.push(next_state, self.P, self.A,
+                                           next_x, Pt1)
+            if smoothed is not None:
+                lagged = state_estimate.copy()
+                lagged[0] -= self.fixed_lag.lag * self.dt
+                lagged[2:] = smoothed[0]
+                self.x_lagged.append(lagged)
+            self.timer.lap('smooth')
+
+        self.checkpoint(next_x, Pt1)
+        self.previous_state = state_estimate
+        self.x_hat.append(state_estimate)
+        self.t += 1
+        self.timer.lap('bookkeeping')
+
+    def steady_state_gain(self):
+        """Limit of the Kalman gain for the constant A, C, Q and R.
+
+        The wheel angles are not measured, so the Riccati equation of the
+        whole state has no stabilizing solution: their variance grows
+        without bound although the gain converges. The equation is solved
+        on the observable subspace, spanned by the rows of the
+        observability matrix, and the gain of the unobservable states
+        follows from the Stein equation of their steady cross-covariance
+        with the observable ones.
+
+        Returns
+        -------
+        K : ndarray
+            Steady-state gain, shape (4, 2).
+        """
+        A, C, Q, R = self.A, self.C, self.Q, self.R
+        n = A.shape[0]
+        O = np.vstack([C @ np.linalg.matrix_power(A, k) for k in range(n)])
+        _, s, Vt = np.linalg.svd(O)
+        rank = np.sum(s > s[0] * n * np.finfo(float).eps)
+        To, Tu = Vt[:rank].T, Vt[rank:].T
+        # In these coordinates A is block lower triangular and C = [C_o, 0]
+        A_oo, A_uo, A_uu = To.T @ A @ To, Tu.T @ A @ To, Tu.T @ A @ Tu
+        C_o = C @ To
+        P_oo = solve_discrete_are(A_oo.T, C_o.T, To.T @ Q @ To, R)
+        S = C_o @ P_oo @ C_o.T + R
+        K_o = np.linalg.solve(S, C_o @ P_oo).T
+        # Predicted cross-covariance X = A_uu X F^T + E, with F the closed
+        # loop of the observable states, solved vectorized
+        I_KC = np.eye(rank) - K_o @ C_o
+        F = A_oo @ I_KC
+        E = A_uo @ I_KC @ P_oo @ A_oo.T + Tu.T @ Q @ To
+        m = n - rank
+        X = np.linalg.solve(np.eye(m * rank) - np.kron(F, A_uu),
+                            E.ravel(order='F')).reshape((m, rank), order='F')
+        K_u = np.linalg.solve(S, C_o @ X.T).T
+        return To @ K_o + Tu @ K_u
+
+    def checkpoint(self, x_pred, P_pred):
+        """Record P, and the prediction it was corrected from, with x_hat."""
+        self.P_hat.append(self.P)
+        self.x_pred_hat.append(x_pred)
+        self.P_pred_hat.append(P_pred)
+
+    def max_rollback(self):
+        # The window of fixed_lag has to stay within the checkpoints
+        window = self.fixed_lag.lag \
+            if self.fixed_lag is not None and self.P_hat.dropped else 0
+        return min(len(self.P_hat) - 1 - window, super().max_rollback())
+
+    def restore(self, n):
+        self.t -= n
+        self.previous_state = self.x_hat[-1].copy()
+        self.P_hat.truncate(n)
+        self.x_pred_hat.truncate(n)
+        self.P_pred_hat.truncate(n)
+        self.P = self.P_hat[-1].copy()
+        if self.t == 0:
+            # step starts over from x[0]
+            self.P_hat.clear()
+            self.x_pred_hat.clear()
+            self.P_pred_hat.clear()
+        if self.fixed_lag is None:
+            return
+        lag = self.fixed_lag.lag
+        self.x_lagged.truncate(self.x_lagged.total
+                               - max(self.x_hat.total - lag, 0))
+        # Replay the pushes of the window ending at the restored estimate
+        self.fixed_lag = FixedLagSmoother(4, lag)
+        m = min(lag + 1, len(self.P_hat))
+        x = self.x_hat[-m:] if m else ()
+        for j in range(m):
+            k = len(self.P_hat) - m + j
+            self.fixed_lag.push(x[j][2:], self.P_hat[k], self.A,
+                                self.x_pred_hat[k], self.P_pred_hat[k])
 
 # noinspection PyPep8Naming
 class ExtendedKalmanFilter(Estimator):
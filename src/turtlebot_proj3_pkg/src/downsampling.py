@@ -0,0 +1,207 @@
+import numpy as np
+
+from history import History
+
+
+class MinMaxPyramid:
+    """Multi-resolution min/max summary of sampled series, for plotting.
+
+    Level k >= 1 splits the samples into buckets of factor**k samples and
+    keeps, for each series, the samples where it reaches its minimum and
+    its maximum within each bucket. The extremes of a bucket are extremes
+    of its sub-buckets, so level k + 1 is built from level k alone and
+    every level keeps the spikes of the raw samples. Building the pyramid
+    is amortized O(1) per sample, vectorized over the samples added since
+    the previous update.
+
+    indices picks the coarsest level that still draws about two points per
+    series and pixel column, so the number of points drawn does not depend
+    on the length of the log.
+
+    Attributes:
+    ----------
+        n_series : int
+            Number of series summarized.
+        factor : int
+            Number of buckets of level k making one bucket of level k + 1.
+        levels : list
+            History of the buckets of each level, levels[k - 1] holding
+            level k. A row holds the sample index and value of the minimum
+            and maximum of each series.
+        origin : int
+            Absolute index of the first sample summarized.
+        total : int
+            Absolute index one past the last sample summarized.
+
+    Example
+    ----------
+        >>> pyramid = MinMaxPyramid(2)
+        >>> pyramid.update(x[:, :2], 0)
+        >>> i = pyramid.indices([0], 0, len(x), width=800)
+        >>> line.set_data(t[i], x[i, 0])
+    """
+    def __init__(self, n_series, factor=4, maxlen=None):
+        if factor < 2:
+            raise ValueError('factor must be at least 2')
+        self.n_series = n_series
+        self.factor = factor
+        self.maxlen = maxlen
+        self.levels = []
+        self.origin = 0
+        self.total = 0
+
+    @property
+    def needed(self):
+        """Absolute index of the first sample the next update needs."""
+        if not self.levels:
+            return self.origin
+        return self.origin + self.factor * self.levels[0].total
+
+    def update(self, values, first):
+        """Summarize the samples added since the previous update.
+
+        Parameters
+        ----------
+        values : ndarray
+            (m, n_series) samples, values[i] being sample first + i, up to
+            the newest sample. They must include every sample from needed
+            on, earlier ones are skipped. If first is past needed, samples
+            were never seen, e.g. evicted from a ring buffer in between,
+            and the pyramid starts over at first.
+        first : int
+            Absolute index of values[0].
+        """
+        if first > self.needed:
+            self.levels = []
+            self.origin = first
+        rows = np.asarray(values)[self.needed - first:]
+        self.total = self.needed + rows.shape[0]
+        n = rows.shape[0] // self.factor
+        if n == 0:
+            return
+        # Level 1 from the raw samples
+        index = self.needed + np.arange(n * self.factor)
+        self._level(0).extend(self._reduce(
+            index.reshape(n, self.factor),
+            rows[:n * self.factor].reshape(n, self.factor, self.n_series)))
+        # Higher levels from the level below, as far as it completes them
+        k = 0
+        while k < len(self.levels):
+            child = self.levels[k]
+            merged = self.levels[k + 1].total if k + 1 < len(self.levels) \
+                else 0
+            n = child.total // self.factor - merged
+            if n == 0:
+                break
+            start = self.factor * merged - child.dropped
+            buckets = child[start:start + n * self.factor].reshape(
+                (n, self.factor) + child.row_shape)
+            self._level(k + 1).extend(
+                self._reduce(buckets[..., 0], buckets[..., 1]))
+            k += 1
+
+    def rewind(self, stop):
+        """Forget the samples from absolute index stop on, e.g. when they
+        are recomputed. The next update needs them again."""
+        if stop <= self.origin:
+            self.levels = []
+            self.origin = stop
+            self.total = stop
+            return
+        size = 1
+        for level in self.levels:
+            size *= self.factor
+            keep = (stop - self.origin) // size
+            if level.total > keep:
+                level.truncate(min(level.total - keep, len(level)))
+        self.total = min(self.total, stop)
+
+    def indices(self, series, lo, hi, width):
+        """Samples to draw to show some series over a range.
+
+        Parameters
+        ----------
+        series : sequence
+            Indices of the series drawn, e.g. both coordinates of a path.
+        lo, hi : int
+            Absolute range of samples [lo, hi) shown. Samples past total
+            are drawn raw.
+        width : float
+            Number of pixel columns the range is drawn over.
+
+        Returns
+        -------
+        indices : ndarray
+            Increasing absolute indices of the samples to draw.
+        """
+        budget = 2 * max(width, 1)
+        k = 0
+        size = 1
+        while k < len(self.levels) and (hi - lo) * 2 > budget * size:
+            k += 1
+            size *= self.factor
+        parts = []
+        self._collect(list(series), lo, hi, k, parts)
+        indices = np.concatenate(parts) if parts else np.zeros(0, int)
+        # Samples that are the extreme of several series appear twice
+        if len(indices) > 1:
+            keep = np.empty(len(indices), bool)
+            keep[0] = True
+            np.not_equal(indices[1:], indices[:-1], out=keep[1:])
+            indices = indices[keep]
+        return indices
+
+    def _collect(self, series, lo, hi, k, parts):
+        if hi <= lo:
+            return
+        if k == 0:
+            parts.append(np.arange(lo, hi))
+            return
+        level = self.levels[k - 1]
+        size = self.factor ** k
+        # Buckets of level k lying entirely within [lo, hi)
+        first = max(-(-(lo - self.origin) // size), level.dropped)
+        last = min((hi - self.origin) // size, level.total)
+        if first >= last:
+            self._collect(series, lo, hi, k - 1, parts)
+            return
+        self._collect(series, lo, self.origin + first * size, k - 1, parts)
+        buckets = level[first - level.dropped:last - level.dropped, series]
+        parts.append(np.sort(buckets[..., 0].reshape(last - first, -1),
+                             axis=1).ravel().astype(int))
+        self._collect(series, self.origin + last * size, hi, k - 1, parts)
+
+    def _reduce(self, index, values):
+        """Extremes of each series within n groups of factor entries.
+
+        index and values are (n, factor, n_series, 2), the last axis
+        holding the candidates for the minimum and for the maximum. Raw
+        samples, with index (n, factor) and values (n, factor, n_series),
+        are candidates for both.
+        """
+        n = values.shape[0]
+        if values.ndim == 3:
+            index = np.broadcast_to(index[..., None, None],
+                                    values.shape + (2,))
+            values = np.broadcast_to(values[..., None], values.shape + (2,))
+        picks = np.stack((values[..., 0].argmin(axis=1),
+                          values[..., 1].argmax(axis=1)), axis=-1)
+        b = np.arange(n)[:, None, None]
+        s = np.arange(self.n_series)[None, :, None]
+        e = np.arange(2)[None, None, :]
+        out = np.empty((n, self.n_series, 2, 2))
+        out[..., 0] = index[b, picks, s, e]
+        out[..., 1] = values[b, picks, s, e]
+        return out
+
+    def _level(self, k):
+        if k == len(self.levels):
+            maxlen = None
+            if self.maxlen is not None:
+                # Room for the buckets of maxlen samples, plus those not
+                # merged into the level above yet
+                maxlen = self.maxlen // self.factor ** (k + 1) \
+                    + self.factor + 1
+            self.levels.append(History((self.n_series, 2, 2),
+                                       maxlen=maxlen))
+        return self.levels[k]
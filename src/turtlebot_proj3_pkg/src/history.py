@@ -0,0 +1,135 @@
+import numpy as np
+
+
+class History:
+    """Contiguous, append-only store of fixed-shape rows.
+
+    Rows are kept in one preallocated array instead of a list of small
+    ndarrays. Without maxlen the array doubles when full, so append is
+    amortized O(1). With maxlen the store is a ring buffer holding the last
+    maxlen rows. Every row is written twice, at i and i + maxlen, so the
+    retained rows are always one contiguous slice and view() never copies.
+
+    Indexing, len(), iteration and np.asarray() behave like the (N, *shape)
+    array returned by view().
+
+    Attributes:
+    ----------
+        row_shape : tuple
+            Shape of a single row, () for scalars.
+        maxlen : int or None
+            Number of most recent rows retained, None for unbounded.
+        total : int
+            Number of rows appended since the store was created or cleared.
+        dropped : int
+            Number of rows evicted from the ring buffer, so that absolute
+            row i is view()[i - dropped].
+    """
+    def __init__(self, row_shape=(), dtype=float, capacity=1024,
+                 maxlen=None):
+        if np.ndim(row_shape) == 0:
+            row_shape = (row_shape,)
+        self.row_shape = tuple(row_shape)
+        self.maxlen = maxlen
+        if maxlen is not None:
+            if maxlen < 1:
+                raise ValueError('maxlen must be positive')
+            capacity = 2 * maxlen
+        self._buf = np.empty((max(capacity, 1),) + self.row_shape, dtype)
+        self._start = 0
+        self._len = 0
+        self.total = 0
+
+    @property
+    def dtype(self):
+        return self._buf.dtype
+
+    @property
+    def dropped(self):
+        return self.total - self._len
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, key):
+        return self.view()[key]
+
+    def __iter__(self):
+        return iter(self.view())
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self.view()
+        return self.view().astype(dtype)
+
+    def view(self):
+        """Zero-copy view of the retained rows, oldest first.
+
+        The view stays valid until the next append that grows the store.
+        """
+        return self._buf[self._start:self._start + self._len]
+
+    def column(self, j):
+        """Zero-copy view of column j of the retained rows."""
+        return self.view()[:, j]
+
+    def at(self, i):
+        """Row with absolute index i, counted from the first append."""
+        if not self.dropped <= i < self.total:
+            raise IndexError(f'row {i} is not retained')
+        return self._buf[self._start + i - self.dropped]
+
+    def append(self, row):
+        if self.maxlen is None:
+            if self._len == self._buf.shape[0]:
+                self._grow(self._len + 1)
+            self._buf[self._len] = row
+            self._len += 1
+        else:
+            w = (self._start + self._len) % self.maxlen
+            self._buf[w] = row
+            self._buf[w + self.maxlen] = row
+            if self._len < self.maxlen:
+                self._len += 1
+            else:
+                self._start = (self._start + 1) % self.maxlen
+        self.total += 1
+
+    def extend(self, rows):
+        rows = np.asarray(rows)
+        n = rows.shape[0]
+        if self.maxlen is None:
+            if self._len + n > self._buf.shape[0]:
+                self._grow(self._len + n)
+            self._buf[self._len:self._len + n] = rows
+            self._len += n
+        else:
+            kept = rows[-self.maxlen:]
+            w = (self._start + self._len
+                 + np.arange(n - kept.shape[0], n)) % self.maxlen
+            self._buf[w] = kept
+            self._buf[w + self.maxlen] = kept
+            overflow = max(self._len + n - self.maxlen, 0)
+            self._start = (self._start + overflow) % self.maxlen
+            self._len = min(self._len + n, self.maxlen)
+        self.total += n
+
+    def truncate(self, n):
+        """Remove the n most recent rows, e.g. to recompute them."""
+        if not 0 <= n <= self._len:
+            raise ValueError(f'cannot remove {n} of {self._len} rows')
+        self._len -= n
+        self.total -= n
+
+    def clear(self):
+        self._start = 0
+        self._len = 0
+        self.total = 0
+
+    def _grow(self, needed):
+        capacity = self._buf.shape[0]
+        while capacity < needed:
+            capacity *= 2
+        buf = np.empty((capacity,) + self.row_shape, self._buf.dtype)
+        buf[:self._len] = self._buf[:self._len]
+        self._buf = buf
@@ -0,0 +1,210 @@
+"""Symbolic model compiler for the estimators.
+
+A model is described once by its continuous dynamics and its measurement
+function, both written with sympy. compile_model discretizes the dynamics
+with the forward Euler step the estimators use, differentiates both
+functions and generates plain NumPy source for the values and Jacobians,
+with common subexpressions eliminated. The generated module is cached on
+disk, keyed by the source of the model functions and their parameters, so
+the symbolic work only happens the first time a model is used. Loading a
+cached model does not need sympy, which is only imported on a cache miss
+since importing it takes longer than loading the cached kernels.
+
+Example
+----------
+    >>> def deriv(x, u, p):
+    ...     import sympy
+    ...     return [x[1], -p['k'] * sympy.sin(x[0]) + u[0]]
+    >>> def measure(x, p):
+    ...     return [x[0]]
+    >>> pendulum = compile_model('pendulum', 2, 1, deriv, measure, {'k': 9.81})
+    >>> x_next, A = pendulum.predict(np.array([0.1, 0.0]), [0.0], 0.01)
+"""
+import hashlib
+import importlib.util
+import inspect
+import os
+import tempfile
+
+import numpy as np
+
+# Bump when the generated code changes so that stale caches are ignored
+COMPILER_VERSION = 1
+DEFAULT_CACHE_DIR = os.environ.get(
+    'PROJ3_MODEL_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'proj3_models'))
+
+
+class CompiledModel:
+    """Generated kernels of a discrete-time model.
+
+    Every function accepts a single state or a stack of states with shape
+    (..., n_states) and returns new arrays unless out (and A or C) are
+    given. Buffers passed in must hold zeros wherever the Jacobian is
+    structurally zero, as left by a previous call or np.zeros; only the
+    other entries are written.
+
+    Attributes:
+    ----------
+        name : str
+            Name the model was compiled under.
+        n_states, n_inputs, n_outputs : int
+            Dimensions of x, u and the measurement.
+        path : str
+            Generated source file.
+        g : callable
+            g(x, u, dt, out=None), x + f(x, u) dt.
+        approx_A : callable
+            approx_A(x, u, dt, out=None), Jacobian of g w.r.t. x.
+        predict : callable
+            predict(x, u, dt, out=None, A=None), returns g and approx_A
+            together, sharing their subexpressions.
+        h : callable
+            h(x, out=None), the measurement model.
+        approx_C : callable
+            approx_C(x, out=None), Jacobian of h w.r.t. x.
+        measure : callable
+            measure(x, out=None, C=None), returns h and approx_C together.
+    """
+    def __init__(self, name, path, module):
+        self.name = name
+        self.path = path
+        self.n_states = module.N_STATES
+        self.n_inputs = module.N_INPUTS
+        self.n_outputs = module.N_OUTPUTS
+        self.g = module.g
+        self.approx_A = module.approx_A
+        self.predict = module.predict
+        self.h = module.h
+        self.approx_C = module.approx_C
+        self.measure = module.measure
+
+
+def compile_model(name, n_states, n_inputs, deriv, measure, params=None,
+                  cache_dir=DEFAULT_CACHE_DIR):
+    """Generate, cache and load the kernels of a model.
+
+    Parameters
+    ----------
+    name : str
+        Name of the model, used in the cache file name.
+    n_states, n_inputs : int
+        Dimensions of x and u.
+    deriv : callable
+        deriv(x, u, params) returning the n_states sympy expressions of
+        dx/dt, where x and u are lists of sympy symbols.
+    measure : callable
+        measure(x, params) returning the sympy expressions of the
+        measurement.
+    params : dict
+        Numerical parameters passed to deriv and measure. They are folded
+        into the generated code.
+    cache_dir : str
+        Directory of the generated modules.
+
+    Returns
+    -------
+    model : CompiledModel
+    """
+    params = dict(params or {})
+    key = _cache_key(name, n_states, n_inputs, deriv, measure, params)
+    path = os.path.join(cache_dir, f'{name}_{key}.py')
+    if not os.path.exists(path):
+        try:
+            import sympy  # noqa: F401
+        except ImportError:
+            raise ImportError(f'sympy is required to compile model {name}, '
+                              f'no cached build found in {cache_dir}')
+        source = generate_source(n_states, n_inputs, deriv, measure, params)
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write then rename so that concurrent processes never load a
+        # partial file
+        fd, tmp = tempfile.mkstemp(suffix='.py', dir=cache_dir)
+        with os.fdopen(fd, 'w') as f:
+            f.write(source)
+        os.replace(tmp, path)
+    spec = importlib.util.spec_from_file_location(f'_model_{name}_{key}', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return CompiledModel(name, path, module)
+
+
+def generate_source(n_states, n_inputs, deriv, measure, params):
+    """Python source of the model kernels, see compile_model."""
+    import sympy
+    x = sympy.symbols(f'x0:{n_states}')
+    u = sympy.symbols(f'u0:{n_inputs}')
+    dt = sympy.Symbol('dt')
+    f = sympy.Matrix(deriv(list(x), list(u), params))
+    g = sympy.Matrix(x) + f * dt
+    A = g.jacobian(x)
+    z = sympy.Matrix(measure(list(x), params))
+    C = z.jacobian(x)
+    lines = ['# Generated by model_compiler.py, do not edit',
+             'import numpy', '',
+             f'N_STATES = {n_states}',
+             f'N_INPUTS = {n_inputs}',
+             f'N_OUTPUTS = {z.shape[0]}']
+    signature = ['x', 'u', 'dt']
+    dims = (n_states, n_inputs)
+    lines += _function('g', signature, [('out', g)], *dims)
+    lines += _function('approx_A', signature, [('out', A)], *dims)
+    lines += _function('predict', signature, [('out', g), ('A', A)], *dims)
+    lines += _function('h', ['x'], [('out', z)], *dims)
+    lines += _function('approx_C', ['x'], [('out', C)], *dims)
+    lines += _function('measure', ['x'], [('out', z), ('C', C)], *dims)
+    return '\n'.join(lines) + '\n'
+
+
+def _function(name, args, outputs, n_states, n_inputs):
+    """Source lines of one kernel writing the given matrices."""
+    import sympy
+    from sympy.printing.numpy import NumPyPrinter
+
+    class Printer(NumPyPrinter):
+        def _print_Float(self, expr):
+            # Round-trip precision rather than sympy's 15 digits
+            return repr(float(expr))
+
+    printer = Printer()
+    entries = []
+    for buffer, M in outputs:
+        for (i, j), expr in np.ndenumerate(np.array(M.tolist(), dtype=object)):
+            if expr != 0:
+                index = (i,) if M.shape[1] == 1 else (i, j)
+                entries.append((buffer, index, expr))
+    replacements, reduced = sympy.cse(
+        [expr for _, _, expr in entries],
+        symbols=sympy.numbered_symbols('_t'))
+
+    used = set()
+    for expr in [e for _, e in replacements] + reduced:
+        used |= {s.name for s in expr.free_symbols}
+    buffers = [buffer for buffer, _ in outputs]
+    body = [f'    x{i} = x[..., {i}]' for i in range(n_states)
+            if f'x{i}' in used]
+    # One input vector is shared by a stack of states
+    body += [f'    u{i} = u[{i}]' for i in range(n_inputs) if f'u{i}' in used]
+    body += [f'    {symbol} = {printer.doprint(expr)}'
+             for symbol, expr in replacements]
+    for buffer, M in outputs:
+        shape = (M.shape[0],) if M.shape[1] == 1 else M.shape
+        body += [f'    if {buffer} is None:',
+                 f'        {buffer} = numpy.zeros(numpy.shape(x)[:-1] + {shape})']
+    for (buffer, index, _), expr in zip(entries, reduced):
+        subscript = ', '.join(str(k) for k in index)
+        body.append(f'    {buffer}[..., {subscript}] = {printer.doprint(expr)}')
+    body.append(f"    return {', '.join(buffers)}")
+    defaults = ', '.join(f'{buffer}=None' for buffer in buffers)
+    return ['', '', f"def {name}({', '.join(args)}, {defaults}):"] + body
+
+
+def _cache_key(name, n_states, n_inputs, deriv, measure, params):
+    parts = [str(COMPILER_VERSION), name, str(n_states), str(n_inputs),
+             repr(sorted(params.items()))]
+    for function in (deriv, measure):
+        try:
+            parts.append(inspect.getsource(function))
+        except (OSError, TypeError):
+            parts.append(function.__qualname__)
+    return hashlib.sha256('\0'.join(parts).encode()).hexdigest()[:16]
@@ -0,0 +1,53 @@
+"""Symbolic descriptions of the turtlebot models, see model_compiler.py."""
+import numpy as np
+
+from model_compiler import DEFAULT_CACHE_DIR, compile_model
+
+
+def unicycle_deriv(x, u, p):
+    # Unicycle, x = [phi, x, y, theta_l, theta_r] and u = [u_l, u_r]
+    import sympy
+    speed = p['r'] / 2 * (u[0] + u[1])
+    return [p['r'] / (2 * p['d']) * (u[1] - u[0]),
+            speed * sympy.cos(x[0]),
+            speed * sympy.sin(x[0]),
+            u[0],
+            u[1]]
+
+
+def unicycle_measure(x, p):
+    # Distance to the landmark and its bearing relative to the heading
+    import sympy
+    lx, ly = p['landmark']
+    return [sympy.sqrt((lx - x[1])**2 + (ly - x[2])**2),
+            sympy.atan2(ly - x[2], lx - x[1]) - x[0]]
+
+
+def frozen_bearing_deriv(x, u, p):
+    # Unicycle at the fixed bearing phid, x = [x, y, theta_l, theta_r]
+    import sympy
+    speed = p['r'] / 2 * (u[0] + u[1])
+    return [speed * sympy.cos(p['phid']),
+            speed * sympy.sin(p['phid']),
+            u[0],
+            u[1]]
+
+
+def frozen_bearing_measure(x, p):
+    # Position
+    return [x[0], x[1]]
+
+
+def unicycle(d=0.08, r=0.033, landmark=(0.5, 0.5),
+             cache_dir=DEFAULT_CACHE_DIR):
+    """Compiled unicycle model with the estimators' default parameters."""
+    return compile_model('unicycle', 5, 2, unicycle_deriv, unicycle_measure,
+                         {'d': d, 'r': r, 'landmark': tuple(landmark)},
+                         cache_dir)
+
+
+def frozen_bearing(r=0.033, phid=np.pi / 4, cache_dir=DEFAULT_CACHE_DIR):
+    """Compiled frozen-bearing unicycle model, as used by the KalmanFilter."""
+    return compile_model('frozen_bearing', 4, 2, frozen_bearing_deriv,
+                         frozen_bearing_measure, {'r': r, 'phid': phid},
+                         cache_dir)
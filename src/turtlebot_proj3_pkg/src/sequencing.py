@@ -0,0 +1,69 @@
+import bisect
+import numpy as np
+
+
+class MessageBuffer:
+    """Timestamp-ordered store of the recent messages of one topic.
+
+    Messages are rows whose first entry is their timestamp. They are kept
+    sorted by it whatever order they arrive in, so that the estimators can
+    look them up by time instead of by arrival index. Only the messages
+    the estimator can still use are retained, see prune.
+
+    Attributes:
+    ----------
+        tolerance : float
+            Largest difference (s) between two timestamps taken as equal.
+        newest : float
+            Largest timestamp received, -inf before the first message.
+    """
+    def __init__(self, tolerance):
+        self.tolerance = tolerance
+        self.newest = -np.inf
+        self._stamps = []
+        self._rows = []
+
+    def __len__(self):
+        return len(self._stamps)
+
+    def insert(self, row):
+        """File a message by its timestamp.
+
+        A message with the timestamp of a retained one replaces it.
+        """
+        row = np.array(row, dtype=float)
+        stamp = row[0]
+        i = bisect.bisect_left(self._stamps, stamp - self.tolerance)
+        if i < len(self._stamps) and \
+                self._stamps[i] <= stamp + self.tolerance:
+            self._rows[i] = row
+        else:
+            self._stamps.insert(i, stamp)
+            self._rows.insert(i, row)
+        self.newest = max(self.newest, stamp)
+
+    def at(self, stamp):
+        """Message with the given timestamp, None if there is none."""
+        i = bisect.bisect_left(self._stamps, stamp - self.tolerance)
+        if i < len(self._stamps) and \
+                self._stamps[i] <= stamp + self.tolerance:
+            return self._rows[i]
+        return None
+
+    def latest(self, stamp):
+        """Newest message at or before the given timestamp, None if none.
+
+        This is the zero-order hold of a topic sampled at stamp.
+        """
+        i = bisect.bisect_right(self._stamps, stamp + self.tolerance)
+        return self._rows[i - 1] if i else None
+
+    def prune(self, stamp):
+        """Drop the messages before stamp, except the newest of them.
+
+        The one kept still holds for stamp, see latest.
+        """
+        i = bisect.bisect_left(self._stamps, stamp - self.tolerance) - 1
+        if i > 0:
+            del self._stamps[:i]
+            del self._rows[:i]